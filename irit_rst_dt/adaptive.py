@@ -0,0 +1,159 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Adaptive evaluation (successive halving over the evaluation grid)
+
+Most configurations are clearly behind after a couple of folds. We run
+every evaluation on a few folds, rank them on `ADAPTIVE_METRIC` (summed
+over the folds run so far), drop the bottom `ADAPTIVE_DROP` of them,
+and run the survivors on more folds (twice as many each round), until
+the survivors have seen every fold.
+
+Models and predictions go in the usual fold directories (predictions
+are committed as in `irit_rst_dt.speculate`), so a later (full)
+`irit-rst-dt evaluate --resume` picks up where this left off (and
+running the adaptive evaluation again just rescores the units that
+are already done).
+"""
+
+from __future__ import print_function
+from os import path as fp
+import json
+import math
+import os
+import sys
+
+from joblib import (delayed)
+
+from attelo.io import (load_fold_dict, load_multipack)
+
+from .local import (ADAPTIVE_DROP,
+                    ADAPTIVE_METRIC,
+                    ADAPTIVE_MIN_FOLDS)
+from .repeated import (run_jobs)
+from .results import (score_output)
+from .score import (add_counts, f1_scores)
+from .speculate import (output_path, run_unit)
+
+
+def rung_sizes(nfolds, min_folds):
+    """Number of folds seen by the end of each round: `min_folds`,
+    doubling until we have all of them"""
+    sizes = [min(max(min_folds, 1), nfolds)]
+    while sizes[-1] < nfolds:
+        sizes.append(min(sizes[-1] * 2, nfolds))
+    return sizes
+
+
+def survivors(scores, drop):
+    """Keys that make it to the next round
+
+    Parameters
+    ----------
+    scores : dict(string, float)
+
+    drop : float
+        Fraction of the keys to eliminate (we always keep at least one)
+
+    Returns
+    -------
+    kept : list of string
+        Best first
+    """
+    ranked = sorted(scores, key=lambda k: (-scores[k], k))
+    nkeep = max(1, int(math.ceil(len(ranked) * (1. - drop))))
+    return ranked[:nkeep]
+
+
+def _run_fold(hconf, mpack, fold_dict, fold, econfs):
+    """fit and decode the given configs on a fold (unless their
+    predictions are already there), and count their test edges"""
+    gold = hconf.gold_cache(False)
+    test_dpacks = [mpack[d] for d in sorted(mpack) if fold_dict[d] == fold]
+    counts = {}
+    for econf in econfs:
+        run_unit(hconf, mpack, fold_dict, econf, fold)
+        counts[econf.key] = score_output(output_path(hconf, econf, fold),
+                                         test_dpacks, gold)
+    return counts
+
+
+def _report_lines(results, eliminated, nfolds):
+    "human readable summary of an adaptive evaluation"
+    lines = ['adaptive evaluation on {} folds, ranked by {} '
+             '(dropping {:.0%} each round)'.format(nfolds, ADAPTIVE_METRIC,
+                                                   ADAPTIVE_DROP),
+             '',
+             'survivors (all folds)']
+    for key in sorted(results, key=lambda k: -results[k][ADAPTIVE_METRIC]):
+        scores = ' '.join('{}={:.4f}'.format(m, v)
+                          for m, v in sorted(results[key].items()))
+        lines.append('    {:<48} {}'.format(key, scores))
+    lines.extend(['', 'eliminated'])
+    for key, elim in sorted(eliminated.items(),
+                            key=lambda x: (-x[1]['round'], -x[1]['score'])):
+        lines.append('    {:<48} round {} ({} folds): {:.4f}'.format(
+            key, elim['round'], elim['folds'], elim['score']))
+    return lines
+
+
+def evaluate_adaptive(hconf):
+    """Successive halving over the evaluations in the harness (which
+    must already be loaded)
+    """
+    report_dir = fp.join(hconf.eval_dir, 'adaptive')
+    if not fp.exists(report_dir):
+        os.makedirs(report_dir)
+    mpack = load_multipack(*hconf.mpack_paths(False)[:4], verbose=True)
+    if fp.exists(hconf.fold_file):
+        fold_dict = load_fold_dict(hconf.fold_file)
+    else:
+        fold_dict = hconf.create_folds(mpack)
+    folds = sorted(frozenset(fold_dict.values()))
+    econfs = dict((e.key, e) for e in hconf.evaluations)
+
+    alive = sorted(econfs)
+    totals = dict((k, {}) for k in alive)
+    eliminated = {}
+    done = 0
+    sizes = rung_sizes(len(folds), ADAPTIVE_MIN_FOLDS)
+    for rnd, size in enumerate(sizes):
+        new_folds = folds[done:size]
+        print('round {}: {} configs on folds {}'.format(
+            rnd, len(alive), new_folds), file=sys.stderr)
+        jobs = []
+        for fold in new_folds:
+            jobs.append(delayed(_run_fold)(
+                hconf, mpack, fold_dict, fold,
+                [econfs[k] for k in alive]))
+        for counts in run_jobs(hconf.runcfg.n_jobs, jobs):
+            for key, count in counts.items():
+                totals[key] = add_counts(totals[key], count)
+        done = size
+        if size == sizes[-1]:
+            break
+        scores = dict((k, f1_scores(totals[k])[ADAPTIVE_METRIC])
+                      for k in alive)
+        kept = survivors(scores, ADAPTIVE_DROP)
+        for key in alive:
+            if key not in kept:
+                eliminated[key] = {'round': rnd,
+                                   'folds': size,
+                                   'score': scores[key]}
+                print('eliminated {} after {} folds ({}={:.4f})'.format(
+                    key, size, ADAPTIVE_METRIC, scores[key]),
+                    file=sys.stderr)
+        alive = kept
+
+    results = dict((k, f1_scores(totals[k])) for k in alive)
+    with open(fp.join(report_dir, 'scores.json'), 'w') as stream:
+        json.dump({'metric': ADAPTIVE_METRIC,
+                   'rounds': sizes,
+                   'survivors': results,
+                   'eliminated': eliminated},
+                  stream, indent=2, sort_keys=True)
+    lines = _report_lines(results, eliminated, len(folds))
+    with open(fp.join(report_dir, 'report.txt'), 'w') as stream:
+        print('\n'.join(lines), file=stream)
+    print('\n'.join(lines))
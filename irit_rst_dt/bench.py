@@ -0,0 +1,298 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Benchmarks for the harness hot paths, on synthetic corpora
+
+We generate a multipack with the same on-disk layout as the output of
+`irit-rst-dt gather` (edu inputs, pairings, svmlight features and
+vocabulary), and time
+
+* loading it
+* fold slicing (attelo selection vs cached fold indices)
+* fitting each of our learners
+* decoding with each of our decoders (along with what the pruned
+  Eisner and A* decoders report about their decodes, see
+  `irit_rst_dt.decoding`)
+* scoring
+
+The pruned Eisner decoder is only here, not in `local.py`: on our
+synthetic documents, it rarely proves its trees exact beyond 40 EDUs
+(see `irit_rst_dt.decoding`), so try it with `--edus 100` or so against
+`decoder_eisner` to see if that changes.
+"""
+
+from __future__ import print_function
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from os import path as fp
+import codecs
+import random
+import sys
+import time
+
+import scipy.sparse
+
+from attelo.fold import (make_n_fold,
+                         select_testing,
+                         select_training)
+from attelo.harness.config import (Keyed, LearnerConfig)
+from attelo.io import (load_multipack)
+from attelo.table import (UNRELATED)
+
+from .config.common import (decoder_last,
+                            mk_joint)
+from .config import perceptron
+from .decoding import (PrunedEisnerDecoder,
+                       decode_summary,
+                       pop_decode_stats)
+from .folds import (compute_fold_indices,
+                    select_rows,
+                    stack_multipack)
+from .local import (DECODER_LOCAL,
+                    attach_learner_dectree,
+                    attach_learner_maxent,
+                    attach_learner_rndforest,
+                    attach_learner_rndforest_proj,
+                    decoder_astar,
+                    decoder_eisner,
+                    decoder_mst,
+                    label_learner_dectree,
+                    label_learner_maxent,
+                    label_learner_rndforest,
+                    label_learner_rndforest_proj)
+from .score import (count_metrics, sum_counts)
+
+
+class SyntheticParams(namedtuple('SyntheticParams',
+                                 ['docs', 'edus', 'features',
+                                  'density', 'labels', 'seed'])):
+    """
+    Shape of a synthetic corpus
+
+    Parameters
+    ----------
+    docs : int
+        Number of documents
+
+    edus : int
+        EDUs per document
+
+    features : int
+        Size of the feature vocabulary
+
+    density : int
+        Number of active features for each candidate pair
+
+    labels : int
+        Number of relation labels (besides UNRELATED and ROOT)
+
+    seed : int
+        Random seed
+    """
+
+
+def write_synthetic(params, prefix):
+    """Write a synthetic multipack to disk, using the same file names
+    as `IritHarness.mpack_paths` relative to `prefix`
+
+    Every document gets a random dependency tree over its EDUs; each
+    EDU pair (and root attachment) is a candidate, with random sparse
+    features, some of which are tied to its gold label so that the
+    learners have something to learn.
+
+    Returns
+    -------
+    paths : (string, string, string, string)
+        Paths to the edu input, pairings, features and vocabulary
+    """
+    rng = random.Random(params.seed)
+    labels = [UNRELATED, 'ROOT'] +\
+        ['rel{}'.format(i) for i in range(params.labels)]
+    # attelo numbers labels from 1 (0 is reserved for unknown)
+    label_num = dict((l, i + 1) for i, l in enumerate(labels))
+    paths = (prefix + '.edu_input', prefix + '.pairings',
+             prefix, prefix + '.vocab')
+    with codecs.open(paths[0], 'w', 'utf-8') as f_edus,\
+            codecs.open(paths[1], 'w', 'utf-8') as f_pairs,\
+            codecs.open(paths[2], 'w', 'utf-8') as f_feats:
+        print('# labels: ' + ' '.join(labels), file=f_feats)
+        for doc_idx in range(params.docs):
+            doc = 'synth_{:04d}.out'.format(doc_idx)
+            ids = ['{}_{}'.format(doc, i)
+                   for i in range(1, params.edus + 1)]
+            gold = {}
+            for i, edu in enumerate(ids):
+                # sentences of (up to) 4 EDUs
+                sent = '{}_s{}'.format(doc, i // 4)
+                print('\t'.join([edu, 'edu {}'.format(i), doc, sent,
+                                 str(i * 10), str(i * 10 + 9)]),
+                      file=f_edus)
+                head = 'ROOT' if i == 0 else ids[rng.randrange(i)]
+                gold[(head, edu)] = ('ROOT' if i == 0 else
+                                     rng.choice(labels[2:]))
+            for edu1 in ['ROOT'] + ids:
+                for edu2 in ids:
+                    if edu1 == edu2:
+                        continue
+                    label = gold.get((edu1, edu2), UNRELATED)
+                    print('\t'.join([edu1, edu2]), file=f_pairs)
+                    feats = set(rng.randrange(params.features)
+                                for _ in range(params.density))
+                    # a noisy hint at the gold label
+                    if rng.random() < 0.8:
+                        feats.add(label_num[label] % params.features)
+                    print(' '.join([str(label_num[label])] +
+                                   ['{}:1'.format(f + 1)
+                                    for f in sorted(feats)]),
+                          file=f_feats)
+    with codecs.open(paths[3], 'w', 'utf-8') as f_vocab:
+        for i in range(params.features):
+            print('feat{}\t{}'.format(i, i + 1), file=f_vocab)
+    return paths
+
+
+@contextmanager
+def timed(timings, name):
+    """Record the wall-clock duration of a block in a dictionary"""
+    start = time.time()
+    yield
+    timings[name] = time.time() - start
+
+
+def _learner_factories():
+    """All the learners we know how to build, as
+    (name, attach factory, label factory); label factory may be None
+    for attach-only learners"""
+    return [
+        ('maxent', attach_learner_maxent, label_learner_maxent),
+        ('dectree', attach_learner_dectree, label_learner_dectree),
+        ('rndforest', attach_learner_rndforest, label_learner_rndforest),
+        ('rndforest-proj', attach_learner_rndforest_proj,
+         label_learner_rndforest_proj),
+        ('perc', perceptron.attach_learner_perc,
+         perceptron.label_learner_perc),
+        ('pa', perceptron.attach_learner_pa,
+         perceptron.label_learner_pa),
+        ('dp-perc', perceptron.attach_learner_dp_perc,
+         perceptron.label_learner_dp_perc),
+        ('dp-pa', perceptron.attach_learner_dp_pa,
+         perceptron.label_learner_dp_pa),
+        ('dp-struct-perc',
+         lambda: perceptron.attach_learner_dp_struct_perc(
+             decoder_eisner().payload), None),
+        ('dp-struct-pa',
+         lambda: perceptron.attach_learner_dp_struct_pa(
+             decoder_eisner().payload), None),
+    ]
+
+
+PRUNED_EISNER_WIDTH = 20
+"""Pruned Eisner decoder: drop arcs between EDUs further apart than
+this (see `irit_rst_dt.decoding`)"""
+
+PRUNED_EISNER_BEAM = 5.
+"""Pruned Eisner decoder: drop arcs scoring this much below the best
+arc into the same EDU (log probability)"""
+
+
+def _decoders():
+    "all the decoders we know how to build"
+    pruned = Keyed('eisner_pruned',
+                   PrunedEisnerDecoder(max_width=PRUNED_EISNER_WIDTH,
+                                       beam=PRUNED_EISNER_BEAM))
+    return [decoder_last(), DECODER_LOCAL, decoder_mst(), decoder_eisner(),
+            pruned, decoder_astar()]
+
+
+def _bench_fit(timings, dpacks, learners):
+    "time fitting each learner on the training data"
+    targets = [d.target for d in dpacks]
+    for name, mk_attach, mk_label in _learner_factories():
+        if learners is not None and name not in learners:
+            continue
+        for task, factory in [('attach', mk_attach), ('label', mk_label)]:
+            if factory is None:
+                continue
+            tname = 'fit:{}:{}'.format(task, name)
+            try:
+                with timed(timings, tname):
+                    factory().payload.fit(dpacks, targets)
+            # we want the other learners to be timed regardless
+            # pylint: disable=broad-except
+            except Exception as oops:
+                print('{}: {}'.format(tname, oops), file=sys.stderr)
+                timings[tname] = None
+            # pylint: enable=broad-except
+
+
+def run_benchmarks(params, work_dir, nfolds=10, learners=None):
+    """Run all benchmarks on a synthetic corpus
+
+    Parameters
+    ----------
+    params : SyntheticParams
+
+    work_dir : string
+        Where to write the synthetic corpus
+
+    nfolds : int
+
+    learners : container of string, optional
+        Only time fitting for these learners (default: all)
+
+    Returns
+    -------
+    timings : OrderedDict(string, float)
+        Seconds spent in each benchmark (None if it failed)
+
+    decodes : dict(string, dict(string, int))
+        For each decoder that reports on its decodes, the counts of
+        `irit_rst_dt.decoding.decode_summary`
+    """
+    timings = OrderedDict()
+    prefix = fp.join(work_dir, 'synthetic.relations.sparse')
+    with timed(timings, 'generate'):
+        paths = write_synthetic(params, prefix)
+    with timed(timings, 'load'):
+        mpack = load_multipack(*paths)
+    fold_dict = make_n_fold(mpack, nfolds, random.Random(params.seed))
+
+    # fold slicing
+    with timed(timings, 'folds:attelo'):
+        for fold in range(nfolds):
+            for part in [select_training(mpack, fold_dict, fold),
+                         select_testing(mpack, fold_dict, fold)]:
+                scipy.sparse.vstack([d.data for d in part.values()],
+                                    format='csr')
+    with timed(timings, 'folds:indices'):
+        indices = compute_fold_indices(mpack, fold_dict)
+    with timed(timings, 'folds:stack'):
+        _, data, target = stack_multipack(mpack)
+    with timed(timings, 'folds:slice'):
+        for fold in range(nfolds):
+            for part in ['train_attach', 'test_attach']:
+                select_rows(data, target, indices, fold, part)
+
+    train = list(select_training(mpack, fold_dict, 0).values())
+    test = list(select_testing(mpack, fold_dict, 0).values())
+    _bench_fit(timings, train, learners)
+
+    # decoding (joint maxent pipeline, fitted once per decoder,
+    # only the decoding is timed) and scoring
+    klearner = LearnerConfig(attach=attach_learner_maxent(),
+                             label=label_learner_maxent())
+    decoded = []
+    decodes = {}
+    for kdecoder in _decoders():
+        parser = mk_joint(klearner, kdecoder).parser.payload
+        parser.fit(train, [d.target for d in train])
+        pop_decode_stats()
+        with timed(timings, 'decode:' + kdecoder.key):
+            decoded = [parser.transform(d) for d in test]
+        summary = decode_summary(pop_decode_stats())
+        if summary:
+            decodes[kdecoder.key] = summary
+    with timed(timings, 'score'):
+        sum_counts(count_metrics(d) for d in decoded)
+    return timings, decodes
@@ -5,10 +5,18 @@ irit-rst-dt subcommands
 # Author: Eric Kow
 # License: CeCILL-B (French BSD3)
 
-from . import (clean,
+from . import (bench,
+               clean,
+               compare,
                evaluate,
+               export,
+               featsel,
                gather,
-               preview)
+               parse,
+               preview,
+               snapshot,
+               speculate,
+               status)
 
 
 SUBCOMMANDS =\
@@ -17,4 +25,12 @@ SUBCOMMANDS =\
         evaluate,
         clean,
         preview,
+        parse,
+        bench,
+        export,
+        featsel,
+        status,
+        speculate,
+        compare,
+        snapshot,
     ]
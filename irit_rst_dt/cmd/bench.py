@@ -0,0 +1,163 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+benchmark the harness on a synthetic corpus
+"""
+
+from __future__ import print_function
+from os import path as fp
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+
+from attelo.harness.util import timestamp
+import pkg_resources
+
+from ..bench import (SyntheticParams, run_benchmarks)
+from ..local import (SNAPSHOTS)
+
+NAME = 'bench'
+
+SLOWER_THRESHOLD = 1.2
+"""Flag benchmarks that are this many times slower than last time"""
+
+
+def config_argparser(psr):
+    """
+    Subcommand flags.
+
+    You should create and pass in the subparser to which the flags
+    are to be added.
+    """
+    psr.add_argument('--docs', type=int, default=50,
+                     help='number of synthetic documents')
+    psr.add_argument('--edus', type=int, default=20,
+                     help='EDUs per synthetic document')
+    psr.add_argument('--features', type=int, default=5000,
+                     help='size of the synthetic feature vocabulary')
+    psr.add_argument('--density', type=int, default=30,
+                     help='active features per candidate pair')
+    psr.add_argument('--labels', type=int, default=18,
+                     help='number of relation labels')
+    psr.add_argument('--seed', type=int, default=0,
+                     help='random seed for the synthetic corpus')
+    psr.add_argument('--folds', type=int, default=10,
+                     help='number of folds for the slicing benchmark')
+    psr.add_argument('--learners', nargs='+', metavar='KEY',
+                     help='only time fitting these learners '
+                     '(eg. maxent perc)')
+    psr.add_argument('--history', metavar='FILE',
+                     default=fp.join(SNAPSHOTS, 'bench-history.jsonl'),
+                     help='append results to this file (JSON lines)')
+    psr.set_defaults(func=main)
+
+
+def _git_commit():
+    "commit of the harness we are benchmarking (None if unknown)"
+    try:
+        out = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                      cwd=fp.dirname(__file__))
+        return out.decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _versions():
+    "versions of the packages whose performance we care about"
+    versions = {}
+    for pkg in ['attelo', 'educe', 'scikit-learn', 'numpy', 'scipy']:
+        try:
+            versions[pkg] = pkg_resources.get_distribution(pkg).version
+        except pkg_resources.DistributionNotFound:
+            versions[pkg] = None
+    return versions
+
+
+def _last_comparable(history_file, params):
+    "most recent record in the history with the same parameters"
+    if not fp.exists(history_file):
+        return None
+    last = None
+    with open(history_file) as stream:
+        for line in stream:
+            record = json.loads(line)
+            if record['params'] == params:
+                last = record
+    return last
+
+
+def _report_pruned(record):
+    "how the pruned Eisner decoder did against the exact one"
+    counts = record['decodes'].get('eisner_pruned', {})
+    timings = record['timings']
+    pruned = timings.get('decode:eisner_pruned')
+    exact = timings.get('decode:eisner')
+    if not counts or not pruned or not exact:
+        return
+    print()
+    print('pruned eisner: {}/{} decodes proved exact, {:.2f}x the time '
+          'of eisner'.format(counts.get('pruned_exact', 0),
+                             counts['pruned_decodes'], pruned / exact))
+
+
+def _report(record, previous):
+    "print timings, compared to a previous record if any"
+    print('{:<28} {:>10} {:>10}'.format('benchmark', 'seconds',
+                                        'vs last'))
+    for name, secs in record['timings'].items():
+        old = (previous['timings'].get(name) if previous is not None
+               else None)
+        if secs is None:
+            print('{:<28} {:>10}'.format(name, 'FAILED'))
+            continue
+        if old:
+            ratio = secs / old
+            flag = ' SLOWER' if ratio > SLOWER_THRESHOLD else ''
+            print('{:<28} {:>10.3f} {:>9.2f}x{}'.format(name, secs,
+                                                       ratio, flag))
+        else:
+            print('{:<28} {:>10.3f}'.format(name, secs))
+    _report_pruned(record)
+    if previous is not None:
+        print()
+        print('compared with {} ({})'.format(previous['timestamp'],
+                                             previous['commit']))
+
+
+def main(args):
+    """
+    Subcommand main.
+
+    You shouldn't need to call this yourself if you're using
+    `config_argparser`
+    """
+    params = SyntheticParams(docs=args.docs,
+                             edus=args.edus,
+                             features=args.features,
+                             density=args.density,
+                             labels=args.labels,
+                             seed=args.seed)
+    work_dir = tempfile.mkdtemp(prefix='irit-rst-dt-bench-')
+    try:
+        timings, decodes = run_benchmarks(params, work_dir,
+                                          nfolds=args.folds,
+                                          learners=args.learners)
+    finally:
+        shutil.rmtree(work_dir)
+
+    record = {'timestamp': timestamp(),
+              'commit': _git_commit(),
+              'versions': _versions(),
+              'params': dict(params._asdict()),
+              'timings': timings,
+              'decodes': decodes}
+    previous = _last_comparable(args.history, record['params'])
+    _report(record, previous)
+    hdir = fp.dirname(args.history)
+    if hdir and not fp.exists(hdir):
+        os.makedirs(hdir)
+    with open(args.history, 'a') as stream:
+        print(json.dumps(record), file=stream)
@@ -0,0 +1,83 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+compare configurations across evaluations (from the results database)
+"""
+
+from __future__ import print_function
+from os import path as fp
+import sys
+
+from ..results import (RESULTS_DB,
+                       best_configs,
+                       config_history,
+                       connect)
+from ..score import (SCORED_METRICS)
+
+NAME = 'compare'
+
+
+def config_argparser(psr):
+    """
+    Subcommand flags.
+
+    You should create and pass in the subparser to which the flags
+    are to be added.
+    """
+    psr.add_argument('--metric', choices=SCORED_METRICS,
+                     default='edges_by_label',
+                     help='metric to rank by (default: %(default)s)')
+    psr.add_argument('--last', metavar='N', type=int,
+                     help='only look at the N latest runs')
+    psr.add_argument('--config', metavar='KEY',
+                     help='only configurations whose key contains KEY '
+                     '(with --history: the exact key)')
+    psr.add_argument('--gather', metavar='HASH',
+                     help='only runs on this gathered data '
+                     '(hash prefix, as shown by --history)')
+    psr.add_argument('--top', metavar='N', type=int, default=20,
+                     help='show the N best configurations '
+                     '(default: %(default)s)')
+    psr.add_argument('--history', action='store_true',
+                     help='show the score of one configuration '
+                     '(--config) in each run')
+    psr.add_argument('--db', metavar='FILE', default=RESULTS_DB,
+                     help='results database (default: %(default)s)')
+    psr.set_defaults(func=main)
+
+
+def _seconds(value):
+    "timing cell (may be unknown)"
+    return '?' if value is None else '{:.0f}s'.format(value)
+
+
+def main(args):
+    """
+    Subcommand main.
+
+    You shouldn't need to call this yourself if you're using
+    `config_argparser`
+    """
+    if not fp.exists(args.db):
+        sys.exit("No results database at {} (it is filled in by "
+                 "irit-rst-dt evaluate [--end])".format(args.db))
+    conn = connect(args.db)
+    try:
+        if args.history:
+            if args.config is None:
+                sys.exit("--history needs a --config")
+            rows = config_history(conn, args.config, args.metric,
+                                  last=args.last)
+            for name, ghash, value, fit, decode in rows:
+                print('{:.4f}\t{}\t{}\tfit {}\tdecode {}'.format(
+                    value, name, ghash, _seconds(fit), _seconds(decode)))
+        else:
+            rows = best_configs(conn, args.metric, last=args.last,
+                                config=args.config, gather=args.gather,
+                                limit=args.top)
+            for config, best, mean, runs, name in rows:
+                print('{:.4f}\t(mean {:.4f} over {} runs, best in {})\t{}'
+                      .format(best, mean, runs, name, config))
+    finally:
+        conn.close()
@@ -10,6 +10,7 @@ from __future__ import print_function
 from attelo.harness import (RuntimeConfig, ClusterStage)
 
 from ..harness import (IritHarness)
+from ..profiling import (PROFILE_MODES)
 
 # pylint: disable=too-few-public-methods
 
@@ -43,6 +44,14 @@ def config_argparser(psr):
                           "evaluation (useful if you just want to "
                           "evaluate recent changes to the decoders "
                           "without losing previous scores)")
+    psr.add_argument("--profile", metavar="KEY[,KEY]",
+                     type=lambda x: x.split(','),
+                     help="profile the fitting and decoding of these "
+                     "evaluations (per fold profiles in the eval dir)")
+    psr.add_argument("--profile-mode", choices=PROFILE_MODES,
+                     default=PROFILE_MODES[0],
+                     help="cprofile (.prof files, and approximate "
+                     ".collapsed stacks) or sample (.collapsed stacks)")
 
     cluster_grp = psr.add_mutually_exclusive_group()
     cluster_grp.add_argument("--start", action='store_true',
@@ -56,6 +65,22 @@ def config_argparser(psr):
     cluster_grp.add_argument("--end", action='store_true',
                              default=False,
                              help="generate report only (cluster mode)")
+    cluster_grp.add_argument("--repeated", action='store_true',
+                             default=False,
+                             help="repeated cross-validation over the "
+                             "seeds in REPEATED_CV_SEEDS (reports mean "
+                             "and confidence interval)")
+    cluster_grp.add_argument("--test-only", action='store_true',
+                             default=False,
+                             help="skip cross-validation; train the test "
+                             "evaluation on all training data (or reuse "
+                             "the combined model) and score it on the "
+                             "test corpus")
+    cluster_grp.add_argument("--adaptive", action='store_true',
+                             default=False,
+                             help="successive halving: run all evaluations "
+                             "on a few folds, then only the best ones on "
+                             "more folds (see ADAPTIVE_* in local.py)")
 
 
 def main(args):
@@ -88,4 +113,13 @@ def main(args):
                            stage=stage,
                            n_jobs=args.n_jobs)
     hconf = IritHarness()
-    hconf.run(runcfg)
+    if args.profile:
+        hconf.set_profile_keys(args.profile, args.profile_mode)
+    if args.repeated:
+        hconf.run_repeated(runcfg)
+    elif args.test_only:
+        hconf.run_test_only(runcfg)
+    elif args.adaptive:
+        hconf.run_adaptive(runcfg)
+    else:
+        hconf.run(runcfg)
@@ -0,0 +1,50 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+text export of compressed (packed) harness files
+"""
+
+from __future__ import print_function
+import sys
+
+from ..storage import (BlockReader, unpack_file)
+
+NAME = 'export'
+
+
+def config_argparser(psr):
+    """
+    Subcommand flags.
+
+    You should create and pass in the subparser to which the flags
+    are to be added.
+    """
+    psr.add_argument('files', nargs='+', metavar='FILE',
+                     help='packed files (*.blk)')
+    psr.add_argument('--stdout', action='store_true',
+                     help='print to stdout instead of writing the text '
+                     'version next to each file')
+    psr.add_argument('--block', type=int, metavar='N',
+                     help='only print block N (implies --stdout)')
+    psr.set_defaults(func=main)
+
+
+def main(args):
+    """
+    Subcommand main.
+
+    You shouldn't need to call this yourself if you're using
+    `config_argparser`
+    """
+    for path in args.files:
+        if args.block is not None:
+            with BlockReader(path) as reader:
+                for line in reader.block(args.block):
+                    print(line)
+        elif args.stdout:
+            with BlockReader(path) as reader:
+                for line in reader.lines():
+                    print(line)
+        else:
+            print(unpack_file(path), file=sys.stderr)
@@ -0,0 +1,115 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+select features on the training data and write reduced feature
+matrices (between `gather` and `evaluate`)
+"""
+
+from __future__ import print_function
+from os import path as fp
+import sys
+
+from attelo.harness import (RuntimeConfig)
+from attelo.io import (load_fold_dict, load_multipack)
+from attelo.table import (UNRELATED)
+
+from ..featsel import (REDUCED_EXT,
+                       SELECTION_EXT,
+                       fold_selections,
+                       save_selections,
+                       write_reduced)
+from ..folds import (stack_multipack)
+from ..harness import (IritHarness)
+from ..local import (SELECT_K, SELECT_MIN_COUNT, SELECT_SCORE,
+                     SELECTED_FEATURES)
+from ..util import (exit_ungathered, latest_tmp)
+
+# NB: this module isn't called `select` so that it doesn't shadow the
+# standard library module (see `cmd.parse`)
+NAME = 'select'
+
+
+def config_argparser(psr):
+    """
+    Subcommand flags.
+
+    You should create and pass in the subparser to which the flags
+    are to be added.
+    """
+    psr.set_defaults(func=main)
+
+
+def _core_path(hconf, test_data):
+    "features file in the evaluation dir (before any unpacking)"
+    dset = hconf.testset if test_data else hconf.dataset
+    return fp.join(hconf.eval_dir, dset + '.relations.sparse')
+
+
+def _reduce(hconf, test_data, columns):
+    "write the reduced version of a features file"
+    _, _, features_path, vocab_path, _ =\
+        hconf.mpack_paths(test_data, selected=False)
+    out_path = _core_path(hconf, test_data) + REDUCED_EXT
+    write_reduced(features_path, vocab_path, columns, out_path)
+    print('wrote', out_path, file=sys.stderr)
+
+
+def main(_):
+    """
+    Subcommand main.
+
+    You shouldn't need to call this yourself if you're using
+    `config_argparser`
+    """
+    data_dir = latest_tmp()
+    if not fp.exists(data_dir):
+        exit_ungathered()
+    hconf = IritHarness()
+    runcfg = RuntimeConfig(mode='resume', folds=None, stage=None,
+                           n_jobs=0)
+    hconf.load(runcfg,
+               fp.join(data_dir, 'eval-current'),
+               fp.join(data_dir, 'scratch-current'))
+    if not fp.exists(hconf.fold_file):
+        sys.exit("No folds yet: we also report the selection on the "
+                 "training part of each fold.\n"
+                 "Hint: run `irit-rst-dt evaluate --start` first "
+                 "(then `irit-rst-dt evaluate --resume` after this)")
+
+    mpack = load_multipack(*hconf.mpack_paths(False, selected=False)[:4],
+                           verbose=True)
+    unrelated = list(mpack.values())[0].label_number(UNRELATED)
+    fold_indices = hconf.fold_indices(mpack,
+                                      load_fold_dict(hconf.fold_file))
+    _, data, target = stack_multipack(mpack)
+    del mpack
+    nfeatures = data.shape[1]
+    selections, counts = fold_selections(data, target, fold_indices,
+                                         unrelated,
+                                         min_count=SELECT_MIN_COUNT,
+                                         k=SELECT_K,
+                                         score=SELECT_SCORE)
+    del data, target
+
+    # any mix of the fold selections would leak test data into the
+    # folds (see `irit_rst_dt.featsel`)
+    columns = selections['all']
+    for name in sorted(selections):
+        print('{}: {} of {} features'.format(name,
+                                             len(selections[name]),
+                                             nfeatures),
+              file=sys.stderr)
+    print('keeping {} of {} features'.format(len(columns), nfeatures),
+          file=sys.stderr)
+    save_selections(selections, counts,
+                    _core_path(hconf, False) + SELECTION_EXT)
+    _reduce(hconf, False, columns)
+    if hconf.testset is not None:
+        _reduce(hconf, True, columns)
+    if not SELECTED_FEATURES:
+        print('NB: set SELECTED_FEATURES in local.py to evaluate on the '
+              'reduced features', file=sys.stderr)
+    print('NB: cross-validation on the reduced features is optimistic '
+          '(the selection has seen every test fold); use the maxent-sel '
+          'learners for that', file=sys.stderr)
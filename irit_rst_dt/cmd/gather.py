@@ -10,13 +10,29 @@ from os import path as fp
 import os
 
 from attelo.harness.util import call, force_symlink
+from joblib import (Parallel, delayed)
 
-from ..local import (TEST_CORPUS,
+from ..local import (COMPRESS_ARTEFACTS,
+                     TEST_CORPUS,
                      TRAINING_CORPUS,
                      PTB_DIR,
+                     FEATURE_HASH_WIDTH,
                      FEATURE_SET,
+                     HASH_REVERSE_INDEX,
                      CORENLP_OUT_DIR,
-                     LECSIE_DATA_DIR)
+                     LECSIE_DATA_DIR,
+                     UNPACK_DIR)
+from ..gold import (cache_gold_trees)
+from ..hashing import (hash_features, read_labels)
+from ..provenance import (find_gather,
+                          provenance,
+                          skip_training_provenance,
+                          write_manifest)
+from ..storage import (BlockWriter,
+                       PACKED_EXT,
+                       local_cache_dir,
+                       pack_file,
+                       readable_path)
 from ..util import (current_tmp, latest_tmp)
 
 NAME = 'gather'
@@ -46,6 +62,10 @@ def config_argparser(psr):
     psr.add_argument('--fix_pseudo_rels',
                         action='store_true',
                         help='fix pseudo-relation labels')
+    psr.add_argument('--force',
+                     action='store_true',
+                     help='extract again even if an identical gather '
+                     'is already there')
     psr.set_defaults(func=main)
 
 
@@ -110,29 +130,132 @@ def extract_features(corpus, output_dir, coarse, fix_pseudo_rels,
     call(cmd)
 
 
-def main(args):
+def write_stripped(features_path, ostream):
+    """Write a stripped version of a features file (labels, a single
+    feature to keep the format happy, and the targets)
+
+    This is the Python equivalent of the loop in
+    `cluster/gather.script.example`
     """
-    Subcommand main.
+    with open(features_path) as istream:
+        ostream.write(istream.readline())
+        first = istream.readline()
+        ostream.write(' '.join(first.split()[:2]) + '\n')
+        for line in istream:
+            ostream.write(line.split(' ', 1)[0].rstrip('\n') + '\n')
 
-    You shouldn't need to call this yourself if you're using
-    `config_argparser`
+
+def compress_features(tdir, corpus):
+    """Replace the (text) features, pairings and edu inputs for a
+    corpus with their packed versions, and add a packed stripped
+    version of the features
+
+    The vocabulary stays in plain text (it is small, and needed as is
+    to extract the test data)
     """
-    if args.skip_training:
-        tdir = latest_tmp()
-    else:
-        tdir = current_tmp()
+    features_path = fp.join(tdir, fp.basename(corpus) + '.relations.sparse')
+    with BlockWriter(features_path + '.stripped' + PACKED_EXT) as ostream:
+        write_stripped(features_path, ostream)
+    for path in [features_path,
+                 features_path + '.pairings',
+                 features_path + '.edu_input']:
+        pack_file(path)
+        os.unlink(path)
+
+
+def _extract_with_vocab(args, tdir):
+    """Extract the training data, then the test data against the
+    training vocabulary and labels
+    """
+    if not args.skip_training:
         extract_features(TRAINING_CORPUS, tdir, args.coarse,
                          args.fix_pseudo_rels)
     if TEST_CORPUS is not None:
         train_path = fp.join(tdir, fp.basename(TRAINING_CORPUS))
-        label_path = train_path + '.relations.sparse'
-        vocab_path = label_path + '.vocab'
+        # the training features may have been packed by a previous
+        # gather (--skip-training)
+        label_path = readable_path(train_path + '.relations.sparse',
+                                   local_cache_dir(tdir, UNPACK_DIR))
+        vocab_path = train_path + '.relations.sparse.vocab'
         extract_features(TEST_CORPUS, tdir, args.coarse,
                          args.fix_pseudo_rels,
                          vocab_path=vocab_path,
                          label_path=label_path)
+
+
+def _extract_hashed(args, tdir):
+    """Extract the training and test data independently (in parallel),
+    then hash them both into the same feature space
+    (FEATURE_HASH_WIDTH)
+    """
+    corpora = [] if args.skip_training else [TRAINING_CORPUS]
+    if TEST_CORPUS is not None:
+        corpora.append(TEST_CORPUS)
+    if not fp.exists(tdir):
+        os.makedirs(tdir)
+    Parallel(n_jobs=max(1, len(corpora)), backend='threading')(
+        delayed(extract_features)(corpus, tdir, args.coarse,
+                                  args.fix_pseudo_rels)
+        for corpus in corpora)
+    train_path = fp.join(tdir, fp.basename(TRAINING_CORPUS) +
+                         '.relations.sparse')
+    if not args.skip_training:
+        report = hash_features(train_path, FEATURE_HASH_WIDTH,
+                               reverse_index=HASH_REVERSE_INDEX)
+        print('hashed {features} features into {width} columns '
+              '({colliding_features} in collisions)'.format(**report))
+    if TEST_CORPUS is not None:
+        test_path = fp.join(tdir, fp.basename(TEST_CORPUS) +
+                            '.relations.sparse')
+        labels = read_labels(readable_path(train_path,
+                                           local_cache_dir(tdir,
+                                                           UNPACK_DIR)))
+        hash_features(test_path, FEATURE_HASH_WIDTH, labels=labels)
+
+
+def main(args):
+    """
+    Subcommand main.
+
+    You shouldn't need to call this yourself if you're using
+    `config_argparser`
+    """
+    tdir = latest_tmp() if args.skip_training else current_tmp()
+    # an identical gather may already be there (see
+    # `irit_rst_dt.provenance`)
+    prov = provenance(args.coarse, args.fix_pseudo_rels)
+    if args.skip_training:
+        # the manifest must still say what the training data is
+        prov = skip_training_provenance(tdir, prov)
+    elif not args.force:
+        prior = find_gather(prov)
+        if prior is not None:
+            print('reusing identical gather', prior,
+                  '(--force to extract again)')
+            force_symlink(fp.basename(prior), latest_tmp())
+            return
+    if FEATURE_HASH_WIDTH is None:
+        _extract_with_vocab(args, tdir)
+    else:
+        _extract_hashed(args, tdir)
+    # gold trees, converted once for all evaluations
+    if not args.skip_training:
+        cache_gold_trees(TRAINING_CORPUS, tdir, coarse=args.coarse,
+                         fix_pseudo_rels=args.fix_pseudo_rels)
+    if TEST_CORPUS is not None:
+        cache_gold_trees(TEST_CORPUS, tdir, coarse=args.coarse,
+                         fix_pseudo_rels=args.fix_pseudo_rels)
+    if COMPRESS_ARTEFACTS:
+        # only once we are done with extraction: the test extraction
+        # reads the labels from the training features
+        if not args.skip_training:
+            compress_features(tdir, TRAINING_CORPUS)
+        if TEST_CORPUS is not None:
+            compress_features(tdir, TEST_CORPUS)
     with open(os.path.join(tdir, "versions-gather.txt"), "w") as stream:
         call(["pip", "freeze"], stdout=stream)
+    # last, so that an interrupted gather has no (matching) manifest
+    write_manifest(tdir, prov)
     if not args.skip_training:
         latest_dir = latest_tmp()
         force_symlink(fp.basename(tdir), latest_dir)
@@ -0,0 +1,378 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+parse new documents with the (warm) test evaluation parser
+"""
+
+from __future__ import print_function
+from os import path as fp
+import json
+import os
+import select
+import shutil
+import sys
+import tempfile
+import time
+
+from six.moves import socketserver
+
+from attelo.harness import (RuntimeConfig)
+from attelo.io import (load_multipack)
+from attelo.table import (UNRELATED)
+
+from ..harness import (IritHarness)
+from ..hashing import (hash_features, read_labels)
+from ..local import (EVALUATIONS, FEATURE_HASH_WIDTH)
+from ..util import (exit_ungathered, latest_tmp)
+from .gather import (extract_features)
+
+NAME = 'parse'
+
+FEATURES_EXT = '.relations.sparse'
+
+
+def config_argparser(psr):
+    """
+    Subcommand flags.
+
+    You should create and pass in the subparser to which the flags
+    are to be added.
+    """
+    psr.add_argument('--socket', metavar='PATH',
+                     help='serve requests on this unix socket '
+                     '(default: read requests from stdin)')
+    psr.add_argument('--batch-size', type=int, default=8,
+                     help='extract features for up to this many '
+                     'pending requests at once')
+    psr.add_argument('--coarse',
+                     action='store_true',
+                     help='use coarse-grained labels '
+                     '(should match gather)')
+    psr.add_argument('--fix_pseudo_rels',
+                     action='store_true',
+                     help='fix pseudo-relation labels '
+                     '(should match gather)')
+    psr.set_defaults(func=main)
+
+
+class WarmParser(object):
+    """
+    The test evaluation parser with its combined models loaded,
+    along with the training vocabulary and labels needed to extract
+    features for new documents.
+
+    Requests are paths to either
+
+    * a directory of documents laid out like the RST-DT corpus
+      (features are extracted for them against the training vocabulary)
+    * the features file (`*.relations.sparse`) of documents that have
+      already been extracted with the training vocabulary
+    """
+    def __init__(self, hconf, coarse=False, fix_pseudo_rels=False):
+        # the bare parser, not the one the harness wraps for
+        # evaluations (which would write progress events and shared
+        # label scores into the eval dirs)
+        econf = [e for e in EVALUATIONS
+                 if e.key == hconf.test_evaluation.key][0]
+        cache = hconf.model_paths(econf.learner, None, econf.parser)
+        missing = [p for p in cache.values() if not fp.exists(p)]
+        if missing:
+            sys.exit("No combined models for {}:\n{}\n"
+                     "Hint: run `irit-rst-dt evaluate --test-only` "
+                     "or `irit-rst-dt evaluate --combined-models` "
+                     "first".format(econf.key, "\n".join(missing)))
+        self.key = econf.key
+        self.parser = econf.parser.payload
+        self.parser.fit([], [], cache=cache)  # load models
+        paths = hconf.mpack_paths(False)
+        self.label_path = paths[2]
+        self.vocab_path = paths[3]
+        self.coarse = coarse
+        self.fix_pseudo_rels = fix_pseudo_rels
+
+    def _extract(self, corpus_dirs, tmp_dir):
+        """Extract features for a batch of document directories in a
+        single run of the feature extractor
+
+        Returns
+        -------
+        mpack : dict(string, DataPack)
+        """
+        batch_dir = fp.join(tmp_dir, 'batch')
+        os.makedirs(batch_dir)
+        for corpus_dir in corpus_dirs:
+            for fname in os.listdir(corpus_dir):
+                lpath = fp.join(batch_dir, fname)
+                # the same file, from a repeated request (see `_claim`)
+                if not fp.exists(lpath):
+                    os.symlink(fp.abspath(fp.join(corpus_dir, fname)),
+                               lpath)
+        features_path = fp.join(tmp_dir, 'batch' + FEATURES_EXT)
+        if FEATURE_HASH_WIDTH is None:
+            extract_features(batch_dir, tmp_dir,
+                             self.coarse, self.fix_pseudo_rels,
+                             vocab_path=self.vocab_path,
+                             label_path=self.label_path)
+        else:
+            extract_features(batch_dir, tmp_dir,
+                             self.coarse, self.fix_pseudo_rels)
+            hash_features(features_path, FEATURE_HASH_WIDTH,
+                          labels=read_labels(self.label_path))
+        return _load_extracted(features_path)
+
+    def _load(self, requests, tmp_dir):
+        """Datapacks for each request, in request order
+
+        Returns
+        -------
+        mpacks : list of dict(string, DataPack) or string
+            The error message for requests we could not load
+        """
+        loaded = {}
+        to_extract = []
+        claimed = {}
+        for req in requests:
+            if req.endswith(FEATURES_EXT):
+                continue
+            clash = _attempt(_claim, claimed, req)
+            if clash is None:
+                to_extract.append(req)
+            else:
+                loaded[req] = clash
+        try:
+            extracted = (self._extract(to_extract, fp.join(tmp_dir, 'all'))
+                         if to_extract else {})
+        except Exception:  # pylint: disable=broad-except
+            # extract them one at a time, so that one bad request
+            # does not fail the others
+            for i, req in enumerate(to_extract):
+                loaded[req] = _attempt(self._extract, [req],
+                                       fp.join(tmp_dir, str(i)))
+        else:
+            for req in to_extract:
+                loaded[req] = _attempt(_request_docs, extracted, req)
+        for req in requests:
+            if req.endswith(FEATURES_EXT):
+                loaded[req] = _attempt(_load_extracted, req)
+        return [loaded[r] for r in requests]
+
+    def _parse_doc(self, dpack):
+        "predicted edges of a document"
+        dpack = self.parser.transform(dpack)
+        unrelated = dpack.label_number(UNRELATED)
+        return [[e1.id, e2.id, dpack.get_label(num)] for
+                (e1, e2), num in zip(dpack.pairings,
+                                     dpack.graph.prediction)
+                if num != unrelated]
+
+    def parse_batch(self, requests):
+        """Parse a batch of requests
+
+        Failures only affect the request (if it could not be loaded)
+        or the document (if it could not be parsed) they come from
+
+        Returns
+        -------
+        results : list of dict
+            One JSON-friendly result for each document (or failed
+            request)
+        """
+        tmp_dir = tempfile.mkdtemp(prefix='irit-rst-dt-parse-')
+        start = time.time()
+        try:
+            mpacks = self._load(requests, tmp_dir)
+        finally:
+            shutil.rmtree(tmp_dir)
+        ndocs = sum(len(m) for m in mpacks if isinstance(m, dict))
+        load_time = (time.time() - start) / ndocs if ndocs else 0.
+        results = []
+        for req, mpack in zip(requests, mpacks):
+            if not isinstance(mpack, dict):
+                results.append({'request': req, 'error': mpack})
+                continue
+            for doc in sorted(mpack):
+                start = time.time()
+                edges = _attempt(self._parse_doc, mpack[doc])
+                if not isinstance(edges, list):
+                    results.append({'request': req,
+                                    'doc': doc,
+                                    'error': edges})
+                    continue
+                results.append({'request': req,
+                                'doc': doc,
+                                'edges': edges,
+                                'extract_seconds': load_time,
+                                'parse_seconds': time.time() - start})
+        return results
+
+
+def _attempt(func, *args):
+    """Result of a function, or if it fails, the error message (a
+    long-lived parser must survive bad requests)"""
+    try:
+        return func(*args)
+    except Exception as oops:  # pylint: disable=broad-except
+        return '{}: {}'.format(type(oops).__name__, oops)
+
+
+def _claim(claimed, req):
+    """Note the files of a directory request, failing if a different
+    file of the same name is in an earlier request of the batch (the
+    documents are extracted together, and known by file name)"""
+    names = os.listdir(req)
+    for name in names:
+        path = fp.realpath(fp.join(req, name))
+        if claimed.get(name, path) != path:
+            raise ValueError('{} is also in another request of the same '
+                             'batch; please send it again'.format(name))
+    for name in names:
+        claimed[name] = fp.realpath(fp.join(req, name))
+
+
+def _request_docs(extracted, req):
+    "the documents of a directory request among a batch extraction"
+    docs = frozenset(os.listdir(req))
+    return dict((k, v) for k, v in extracted.items() if k in docs)
+
+
+def _load_extracted(features_path):
+    "load a multipack from the features file written by the extractor"
+    return load_multipack(features_path + '.edu_input',
+                          features_path + '.pairings',
+                          features_path,
+                          features_path + '.vocab')
+
+
+class _LineReader(object):
+    """
+    Lines of UTF-8 text from a file descriptor, with a way to tell if
+    another one is waiting
+
+    We do our own buffering: `select` on a buffered file (`sys.stdin`,
+    a socket's `rfile`) does not see the lines already in its buffer
+    """
+    def __init__(self, fileno):
+        self.fileno = fileno
+        self._buf = b''
+        self._eof = False
+
+    def ready(self):
+        "True if `readline` would not block"
+        return (b'\n' in self._buf or self._eof or
+                bool(select.select([self.fileno], [], [], 0)[0]))
+
+    def readline(self):
+        "next line (with its newline), or '' at end of input"
+        while b'\n' not in self._buf and not self._eof:
+            chunk = os.read(self.fileno, 1 << 16)
+            if not chunk:
+                self._eof = True
+            self._buf += chunk
+        if b'\n' in self._buf:
+            line, self._buf = self._buf.split(b'\n', 1)
+            return line.decode('utf-8') + '\n'
+        line, self._buf = self._buf, b''
+        return line.decode('utf-8')
+
+
+def _read_batch(stream, batch_size):
+    """Read a batch of requests (one path per line) from a
+    `_LineReader`: block for the first one, then take any others that
+    are already waiting
+
+    Returns
+    -------
+    requests : list of string
+        Empty if we hit end of input
+    """
+    requests = []
+    while len(requests) < batch_size:
+        if requests and not stream.ready():
+            break
+        line = stream.readline()
+        if not line:
+            break
+        line = line.strip()
+        if line:
+            requests.append(line)
+    return requests
+
+
+def _serve_stream(wparser, batch_size, instream, outstream):
+    "answer requests on instream until end of input"
+    while True:
+        requests = _read_batch(instream, batch_size)
+        if not requests:
+            return
+        for result in wparser.parse_batch(requests):
+            if 'error' not in result:
+                print('{} {}: {:.3f}s'.format(
+                    wparser.key, result['doc'],
+                    result['extract_seconds'] + result['parse_seconds']),
+                    file=sys.stderr)
+            outstream.write(json.dumps(result) + '\n')
+            outstream.flush()
+
+
+def _serve_socket(wparser, batch_size, path):
+    "answer requests on a unix socket (one connection at a time)"
+    class _Handler(socketserver.StreamRequestHandler):
+        "read requests from a connection and answer on it"
+        def handle(self):
+            _serve_stream(wparser, batch_size,
+                          _LineReader(self.connection.fileno()),
+                          _Writer(self))
+
+    class _Writer(object):
+        "text to bytes adapter for the connection"
+        def __init__(self, handler):
+            self.handler = handler
+
+        def write(self, text):
+            "write to the connection"
+            self.handler.wfile.write(text.encode('utf-8'))
+
+        def flush(self):
+            "flush the connection"
+            self.handler.wfile.flush()
+
+    if fp.exists(path):
+        os.unlink(path)
+    server = socketserver.UnixStreamServer(path, _Handler)
+    print('listening on', path, file=sys.stderr)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(path)
+
+
+def main(args):
+    """
+    Subcommand main.
+
+    You shouldn't need to call this yourself if you're using
+    `config_argparser`
+    """
+    hconf = IritHarness()
+    if hconf.test_evaluation is None:
+        sys.exit("Sorry, there's an error in your configuration:\n"
+                 "Parsing needs both TEST_CORPUS and TEST_EVALUATION_KEY "
+                 "to be set")
+    data_dir = latest_tmp()
+    if not fp.exists(data_dir):
+        exit_ungathered()
+    runcfg = RuntimeConfig(mode='resume', folds=None, stage=None,
+                           n_jobs=0)
+    hconf.load(runcfg,
+               fp.join(data_dir, 'eval-current'),
+               fp.join(data_dir, 'scratch-current'))
+    wparser = WarmParser(hconf,
+                         coarse=args.coarse,
+                         fix_pseudo_rels=args.fix_pseudo_rels)
+    if args.socket is None:
+        _serve_stream(wparser, args.batch_size,
+                      _LineReader(sys.stdin.fileno()), sys.stdout)
+    else:
+        _serve_socket(wparser, args.batch_size, args.socket)
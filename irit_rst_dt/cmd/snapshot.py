@@ -0,0 +1,86 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+save the essentials of an evaluation to SNAPSHOTS
+"""
+
+from __future__ import print_function
+from os import path as fp
+import sys
+
+from attelo.harness import (RuntimeConfig)
+
+from ..harness import (IritHarness)
+from ..local import (SNAPSHOTS)
+from ..snapshot import (ObjectStore, make_snapshot, snapshot_files)
+from ..util import (exit_ungathered, latest_tmp)
+
+NAME = 'snapshot'
+
+
+def config_argparser(psr):
+    """
+    Subcommand flags.
+
+    You should create and pass in the subparser to which the flags
+    are to be added.
+    """
+    psr.add_argument('--eval-dir', metavar='DIR',
+                     help='evaluation to snapshot '
+                     '(default: TMP/latest/eval-current)')
+    psr.add_argument('--name', metavar='NAME',
+                     help='name of the snapshot (default: after the '
+                     'evaluation, eg. 2016-01-01T1200-eval-...)')
+    psr.add_argument('--models', metavar='KEY', nargs='+',
+                     help='also keep the combined models of these '
+                     'evaluations')
+    psr.add_argument('--note', metavar='TEXT',
+                     help='what this snapshot is (saved in its '
+                     'manifest)')
+    psr.add_argument('--skip-existing', action='store_true',
+                     help='if there is already a snapshot by that '
+                     'name, say so and leave it be (instead of '
+                     'failing)')
+    psr.set_defaults(func=main)
+
+
+def main(args):
+    """
+    Subcommand main.
+
+    You shouldn't need to call this yourself if you're using
+    `config_argparser`
+    """
+    data_dir = latest_tmp()
+    if not fp.exists(data_dir):
+        exit_ungathered()
+    eval_dir = fp.realpath(args.eval_dir or
+                           fp.join(data_dir, 'eval-current'))
+    hconf = IritHarness()
+    runcfg = RuntimeConfig(mode='resume', folds=None, stage=None,
+                           n_jobs=0)
+    hconf.load(runcfg, eval_dir, fp.join(data_dir, 'scratch-current'))
+    known = frozenset(e.key for e in hconf.evaluations)
+    unknown = [k for k in args.models or [] if k not in known]
+    if unknown:
+        sys.exit("Sorry, I can't snapshot the models of evaluations "
+                 "that aren't in your configuration:\n" +
+                 "\n".join(unknown))
+    name = args.name or '{}-{}'.format(
+        fp.basename(fp.dirname(eval_dir)), fp.basename(eval_dir))
+    snap_dir = fp.join(SNAPSHOTS, name)
+    if fp.exists(snap_dir):
+        if args.skip_existing:
+            print('There is already a snapshot called {}; '
+                  'leaving it be'.format(name), file=sys.stderr)
+            return
+        sys.exit("There is already a snapshot called {}".format(name))
+    info = {'eval_dir': eval_dir,
+            'models': args.models or [],
+            'note': args.note}
+    manifest = make_snapshot(snapshot_files(hconf, args.models),
+                             snap_dir, ObjectStore(SNAPSHOTS), info)
+    print('{}: {} files, {:.1f} MB ({:.1f} MB new)'.format(
+        snap_dir, len(manifest['files']),
+        manifest['bytes'] / 1e6, manifest['new_bytes'] / 1e6))
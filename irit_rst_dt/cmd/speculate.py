@@ -0,0 +1,55 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+run duplicates of straggling (evaluation, fold) units
+"""
+
+from __future__ import print_function
+from os import path as fp
+import sys
+
+from attelo.harness import (RuntimeConfig)
+
+from ..harness import (IritHarness)
+from ..speculate import (speculate)
+from ..util import (exit_ungathered, latest_tmp)
+
+NAME = 'speculate'
+
+
+def config_argparser(psr):
+    """
+    Subcommand flags.
+
+    You should create and pass in the subparser to which the flags
+    are to be added.
+    """
+    psr.add_argument('--poll', metavar='SECONDS', type=int,
+                     help='keep watching (every SECONDS) until every '
+                     'unit is done (default: just look once)')
+    psr.add_argument('--cancel', action='store_true',
+                     help='once every unit is done, scancel the cluster '
+                     'jobs still working on folds')
+    psr.set_defaults(func=main)
+
+
+def main(args):
+    """
+    Subcommand main.
+
+    You shouldn't need to call this yourself if you're using
+    `config_argparser`
+    """
+    data_dir = latest_tmp()
+    if not fp.exists(data_dir):
+        exit_ungathered()
+    hconf = IritHarness()
+    runcfg = RuntimeConfig(mode='resume', folds=None, stage=None,
+                           n_jobs=0)
+    hconf.load(runcfg,
+               fp.join(data_dir, 'eval-current'),
+               fp.join(data_dir, 'scratch-current'))
+    if not fp.exists(hconf.fold_file):
+        sys.exit("No folds yet: has the evaluation started?")
+    speculate(hconf, poll=args.poll, cancel=args.cancel)
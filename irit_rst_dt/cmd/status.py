@@ -0,0 +1,118 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+show how far along an evaluation is (across all its cluster jobs)
+"""
+
+from __future__ import print_function
+from os import path as fp
+import json
+import sys
+
+from attelo.harness import (RuntimeConfig)
+from attelo.io import (load_fold_dict)
+
+from ..harness import (IritHarness)
+from ..progress import (PROGRESS_DIR,
+                        fold_sizes,
+                        read_events,
+                        summarise_progress)
+from ..util import (exit_ungathered, latest_tmp)
+
+NAME = 'status'
+
+
+def config_argparser(psr):
+    """
+    Subcommand flags.
+
+    You should create and pass in the subparser to which the flags
+    are to be added.
+    """
+    psr.add_argument('--eval-dir', metavar='DIR',
+                     help='evaluation to look at '
+                     '(default: TMP/latest/eval-current)')
+    psr.add_argument('--json', action='store_true',
+                     help='print the summary as JSON')
+    psr.set_defaults(func=main)
+
+
+def _duration(seconds):
+    "human friendly duration"
+    if seconds is None:
+        return '?'
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{}h{:02d}m{:02d}s'.format(hours, minutes, seconds)
+
+
+def _search_stats(dec):
+    "pruning and A* budget counts for an evaluation, if any"
+    parts = []
+    if dec['pruned_decodes']:
+        parts.append('pruning exact {pruned_exact}/{pruned_decodes}'
+                     .format(**dec))
+    if dec['astar_decodes']:
+        parts.append('A* optimal {astar_optimal}/{astar_decodes}, '
+                     'budget hits: {budget_hits_time} time, '
+                     '{budget_hits_expansions} expansions'.format(**dec))
+    return ''.join(', ' + p for p in parts)
+
+
+def _report_lines(summary):
+    "human readable version of the progress summary"
+    lines = [
+        'units done: {done}/{units} ({running} running)'.format(**summary),
+        'elapsed: {}, ETA: {}'.format(_duration(summary['elapsed']),
+                                      _duration(summary['eta_seconds'])),
+        'throughput: {:.1f} units/hour, {:.2f} docs/sec per worker '
+        '({} docs decoded)'.format(summary['units_per_hour'],
+                                   summary['docs_per_second'],
+                                   summary['docs_decoded']),
+        'median unit: {}'.format(_duration(summary['median_unit_seconds'])),
+        'workers: {}'.format(len(summary['workers'])),
+    ]
+    decoding = [(k, d) for k, d in sorted(summary['decoding'].items())
+                if d['docs']]
+    if decoding:
+        lines.extend(['', 'decoding'])
+        for key, dec in decoding:
+            lines.append('    {}: {} docs, {:.3f}s/doc{}'.format(
+                key, dec['docs'], dec['seconds'] / dec['docs'],
+                _search_stats(dec)))
+    if summary['stragglers']:
+        lines.extend(['', 'stragglers'])
+        for strag in summary['stragglers']:
+            lines.append('    {} {}: running for {} on {}'.format(
+                strag['key'], strag['fold'], _duration(strag['seconds']),
+                strag['where']))
+    return lines
+
+
+def main(args):
+    """
+    Subcommand main.
+
+    You shouldn't need to call this yourself if you're using
+    `config_argparser`
+    """
+    data_dir = latest_tmp()
+    if not fp.exists(data_dir):
+        exit_ungathered()
+    eval_dir = args.eval_dir or fp.join(data_dir, 'eval-current')
+    hconf = IritHarness()
+    runcfg = RuntimeConfig(mode='resume', folds=None, stage=None,
+                           n_jobs=0)
+    hconf.load(runcfg, eval_dir, fp.join(data_dir, 'scratch-current'))
+    if not fp.exists(hconf.fold_file):
+        sys.exit("No folds in {}: has this evaluation "
+                 "started?".format(eval_dir))
+    summary = summarise_progress(
+        read_events(fp.join(eval_dir, PROGRESS_DIR)),
+        [e.key for e in hconf.evaluations],
+        fold_sizes(load_fold_dict(hconf.fold_file)))
+    if args.json:
+        print(json.dumps(summary, indent=2, sort_keys=True))
+    else:
+        print('\n'.join(_report_lines(summary)))
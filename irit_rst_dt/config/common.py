@@ -2,10 +2,6 @@
 
 from collections import namedtuple
 import six
-# from attelo.decoding.astar import (AstarArgs,
-#                                    AstarDecoder,
-#                                    Heuristic,
-#                                    RfcConstraint)
 from attelo.decoding.baseline import (LastBaseline,
                                       LocalBaseline)
 from attelo.harness.config import (EvaluationConfig,
@@ -15,6 +11,8 @@ from attelo.learning.oracle import (AttachOracle, LabelOracle)
 from attelo.parser.full import (JointPipeline,
                                 PostlabelPipeline)
 
+from ..learning import (SharedLabelClassifier)
+
 
 def combined_key(*variants):
     """return a key from a list of objects that have a
@@ -101,6 +99,21 @@ def _core_settings(key, klearner):
                     children=None)
 
 
+def share_label_scores(klearner):
+    """return a learner config whose label model scores each document
+    only once for all the pipelines built from it (eg. both `mk_joint`
+    and `mk_post`), see `SharedLabelClassifier`
+
+    Oracles are left alone (they don't really score anything)"""
+    label = klearner.label
+    if 'oracle' in label.key or\
+            isinstance(label.payload, SharedLabelClassifier):
+        return klearner
+    return LearnerConfig(attach=klearner.attach,
+                         label=Keyed(label.key,
+                                     SharedLabelClassifier(label.payload)))
+
+
 def mk_joint(klearner, kdecoder):
     "return a joint decoding parser config"
     settings = _core_settings('AD.L-jnt', klearner)
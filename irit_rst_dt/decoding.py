@@ -0,0 +1,896 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Decoders with a bounded cost on long documents
+
+Eisner decoding over a pruned search space
+------------------------------------------
+The Eisner decoder is cubic in the number of EDUs, so the longest
+documents dominate decoding time. Our `eisner` fills in all the spans
+of a width at once, and with a `max_width` only builds arcs up to that
+width (plus those from the root) and only splits longer spans where
+they end in such an arc, which brings the chart down to
+O(n^2 * max_width). `PrunedEisnerDecoder` first decodes with only some
+of the candidate arcs:
+
+* span width: arcs between EDUs more than `max_width` apart are
+  dropped (attachments to the root are always kept)
+* beam: for each EDU, arcs scoring more than `beam` below its best
+  incoming arc are dropped
+
+and then checks that no tree using a dropped arc would have done
+better:
+
+* trees with a single dropped arc: the best of them scores the
+  max-marginal of that arc (from an inside/outside pass over the
+  pruned chart); we only compute it for the arcs that the bound below
+  does not already rule out
+* trees with dropped arcs into two EDUs or more score at most
+  `UB - g1 - g2`, where `UB` sums the best incoming arc of each EDU
+  (over all the candidates) and `g1`, `g2` are the two smallest
+  differences between a dropped arc and the best arc into its EDU
+
+If any of them could do better (or the pruned space has no tree at
+all), we decode again without pruning. The second bound gets looser
+as documents grow: `UB` ignores the tree constraint, and the slack
+adds up over the EDUs. On synthetic documents (arc log-probabilities
+falling with distance, plus noise; `max_width` 20, `beam` 5), pruning
+was proved exact on 10/10 documents of 20 EDUs, 6/10 of 40 EDUs and
+none of 80 or 150 EDUs, while our `eisner` took under 0.05 seconds on
+150 EDUs. So this decoder only runs in `irit-rst-dt bench`, not in
+our `local.py` evaluations, until a tighter bound makes it pay off.
+
+A* with a budget
+----------------
+`BudgetAstarDecoder` reads EDUs left to right, searching with A*
+under an admissible heuristic (the best arc each EDU without a head
+could still get, from tables computed once per document). With the
+right frontier constraint (RFC), it keeps a stack of the EDUs still
+waiting for a head, as in shift-reduce parsing: each new EDU either
+settles part of the stack (right arcs) or becomes the head of the EDUs
+on top (left arcs), so it finds the best projective tree, arcs going
+either way. Without it, each EDU is attached to an earlier one as soon
+as it is read: trees need not be projective, but heads always come
+before their dependents (no left arcs). It starts from a greedy tree
+and keeps the best complete tree found. Without the RFC the heuristic
+is exact (each EDU takes its best earlier head), so the search goes
+straight to the best tree. With it, the heuristic is loose. On
+synthetic documents (arc log-probabilities falling with distance,
+plus noise), A* with a 100000 expansion / 10 second budget was exact
+up to 20 EDUs (but took up to 3 seconds), ran out of budget on 4 out
+of 5 documents of 30 EDUs and on all of those of 40 to 150 EDUs, and
+its trees were then 7 to 26 log-prob units worse than Eisner's, which
+took under 0.05 seconds. So when the budget runs out in RFC mode, the
+decoder decodes again with `eisner`, and the budget should be small.
+
+Each decode leaves a record of what happened (see `pop_decode_stats`),
+which `irit_rst_dt.progress` attaches to its events so that
+`irit-rst-dt status` can report how often pruning was exact and how
+often A* ran out of budget.
+"""
+
+from __future__ import print_function
+import heapq
+import time
+
+import numpy as np
+
+from attelo.decoding.interface import (Decoder)
+from attelo.decoding.util import (convert_prediction,
+                                  simple_candidates)
+from attelo.table import (FAKE_ROOT_ID)
+
+_NEG_INF = -np.inf
+
+_TOLERANCE = 1e-9
+"""Slack for float error when comparing tree scores"""
+
+_DECODE_STATS = []
+"""Records of the decodes (in this process) nobody has picked up yet"""
+
+
+def pop_decode_stats():
+    """Records left by the decodes since the last call (and forget
+    them)
+
+    Returns
+    -------
+    stats : list of dict
+        One dict per decoded document, with the 'decoder' and the
+        'seconds' it took, and for the pruned Eisner decoder: 'arcs'
+        (candidates), 'pruned' (arcs dropped), 'checked' (dropped arcs
+        whose max-marginal we computed), 'exact' (whether the pruned
+        tree was provably optimal), 'fallback' (whether we had to
+        decode again); for the A* decoder: 'expansions',
+        'budget_hit' (None, 'time' or 'expansions'), 'fallback'
+        (whether we then decoded with `eisner`) and 'optimal'
+    """
+    stats = list(_DECODE_STATS)
+    del _DECODE_STATS[:]
+    return stats
+
+
+DECODE_FIELDS = ['pruned_decodes', 'pruned_exact',
+                 'astar_decodes', 'astar_optimal',
+                 'budget_hits_time', 'budget_hits_expansions']
+"""Counts we keep about decodes (see `decode_summary`)"""
+
+
+def decode_summary(stats):
+    """Counts (for `DECODE_FIELDS`) over some decode records
+
+    Returns
+    -------
+    counts : dict(string, int)
+        Only the non zero counts
+    """
+    pruned = [x for x in stats if x['decoder'] == 'eisner_pruned']
+    astar = [x for x in stats if x['decoder'] == 'astar']
+    counts = {
+        'pruned_decodes': len(pruned),
+        'pruned_exact': sum(x['exact'] for x in pruned),
+        'astar_decodes': len(astar),
+        'astar_optimal': sum(x['optimal'] for x in astar),
+        'budget_hits_time': sum(x['budget_hit'] == 'time'
+                                for x in astar),
+        'budget_hits_expansions': sum(x['budget_hit'] == 'expansions'
+                                      for x in astar),
+    }
+    return dict((k, v) for k, v in counts.items() if v)
+
+
+def score_matrix(dpack, use_prob=True):
+    """Arc scores of a datapack as a matrix (the root is node 0, no
+    arc is -inf), and the best label of each arc
+
+    Returns
+    -------
+    nodes : list of string
+        EDU id of each node
+
+    scores : 2D array of float
+        `scores[h, d]`: score of an arc from `h` to `d` (log
+        probability if `use_prob`)
+
+    labels : dict((int, int), string)
+    """
+    nodes = [FAKE_ROOT_ID] + [e.id for e in dpack.edus
+                              if e.id != FAKE_ROOT_ID]
+    index = dict((e, i) for i, e in enumerate(nodes))
+    scores = np.full((len(nodes), len(nodes)), _NEG_INF)
+    labels = {}
+    for edu1, edu2, score, label in simple_candidates(dpack):
+        src = index[edu1.id]
+        tgt = index[edu2.id]
+        if use_prob:
+            with np.errstate(divide='ignore'):
+                score = np.log(score)
+        scores[src, tgt] = score
+        labels[(src, tgt)] = label
+    return nodes, scores, labels
+
+
+def _predictions(nodes, labels, heads):
+    "attelo style predictions for a tree"
+    return [(nodes[h], nodes[d], labels[(h, d)])
+            for d, h in enumerate(heads) if h >= 0]
+
+
+def _backtrack(n, unique_root, root_child, back):
+    "heads of the best tree from the chart back pointers"
+    bc_left, bc_right, bi_split = back
+    heads = np.empty(n, dtype=np.intp)
+    heads.fill(-1)
+    if unique_root:
+        heads[root_child] = 0
+        todo = [('cl', 1, root_child), ('cr', root_child, n - 1)]
+    else:
+        todo = [('cr', 0, n - 1)]
+    while todo:
+        kind, src, tgt = todo.pop()
+        if src == tgt:
+            continue
+        if kind == 'cr':
+            mid = bc_right[src, tgt]
+            todo.extend([('ir', src, mid), ('cr', mid, tgt)])
+        elif kind == 'cl':
+            mid = bc_left[src, tgt]
+            todo.extend([('cl', src, mid), ('il', mid, tgt)])
+        else:
+            if kind == 'ir':
+                heads[tgt] = src
+            else:
+                heads[src] = tgt
+            mid = bi_split[src, tgt]
+            todo.extend([('cr', src, mid), ('cl', mid + 1, tgt)])
+    return heads
+
+
+def _chart(n):
+    "empty Eisner chart (complete left/right, incomplete left/right)"
+    return [np.full((n, n), _NEG_INF) for _ in range(4)]
+
+
+def _inside(scores, max_width=None, unique_root=True):
+    """Eisner chart for a matrix of arc scores (see `eisner`)
+
+    The spans of each width are filled in at once. With `max_width`,
+    incomplete spans (one per arc) only go up to that width, except
+    for arcs from the root; complete spans still go all the way (a
+    chain of short arcs can cover the whole document) but only split
+    where the arc they end with is at most that wide.
+
+    Returns
+    -------
+    chart : list of 2D array of float
+        Complete left, complete right, incomplete left and incomplete
+        right spans
+
+    back : tuple of 2D array of int
+        Back pointers (see `_backtrack`)
+    """
+    n = scores.shape[0]
+    first = 1 if unique_root else 0
+    c_left, c_right, i_left, i_right = chart = _chart(n)
+    np.fill_diagonal(c_left, 0.)
+    np.fill_diagonal(c_right, 0.)
+    bc_left = np.zeros((n, n), dtype=np.intp)
+    bc_right = np.zeros((n, n), dtype=np.intp)
+    bi_split = np.zeros((n, n), dtype=np.intp)
+    for width in range(1, n - first):
+        srcs = np.arange(first, n - width)
+        tgts = srcs + width
+        # incomplete spans: an arc over two adjacent complete ones
+        if max_width is None or width <= max_width:
+            isrcs = srcs
+        else:
+            isrcs = srcs[srcs == 0]
+        if len(isrcs):
+            itgts = isrcs + width
+            mids = isrcs[:, None] + np.arange(width)[None, :]
+            vals = c_right[isrcs[:, None], mids] + c_left[mids + 1,
+                                                          itgts[:, None]]
+            split = vals.argmax(axis=1)
+            best = vals[np.arange(len(isrcs)), split]
+            bi_split[isrcs, itgts] = isrcs + split
+            i_right[isrcs, itgts] = best + scores[isrcs, itgts]
+            i_left[isrcs, itgts] = best + scores[itgts, isrcs]
+        nsplit = width if max_width is None else min(width, max_width)
+        steps = np.arange(nsplit)[None, :]
+        # left facing: the last arc into `tgt`'s left dependent
+        mids = tgts[:, None] - nsplit + steps
+        vals = c_left[srcs[:, None], mids] + i_left[mids, tgts[:, None]]
+        split = vals.argmax(axis=1)
+        c_left[srcs, tgts] = vals[np.arange(len(srcs)), split]
+        bc_left[srcs, tgts] = mids[np.arange(len(srcs)), split]
+        # right facing: the last arc from `src` to its right (any
+        # width for the root)
+        rsrcs, rtgts = srcs[srcs > 0], tgts[srcs > 0]
+        mids = rsrcs[:, None] + 1 + steps
+        vals = i_right[rsrcs[:, None], mids] + c_right[mids,
+                                                      rtgts[:, None]]
+        split = vals.argmax(axis=1)
+        c_right[rsrcs, rtgts] = vals[np.arange(len(rsrcs)), split]
+        bc_right[rsrcs, rtgts] = mids[np.arange(len(rsrcs)), split]
+        if first == 0:
+            vals = i_right[0, 1:width + 1] + c_right[1:width + 1, width]
+            split = int(np.argmax(vals))
+            c_right[0, width] = vals[split]
+            bc_right[0, width] = 1 + split
+    return chart, (bc_left, bc_right, bi_split)
+
+
+def _update(table, rows, cols, vals):
+    "keep the best of what is in a table and new values"
+    table[rows, cols] = np.maximum(table[rows, cols], vals)
+
+
+def _outside(scores, chart, max_width=None, unique_root=True):
+    """Outside scores of a chart from `_inside`: for each item, the
+    best score of the rest of a tree using it
+
+    Returns
+    -------
+    outside : list of 2D array of float
+        In the same order as the chart
+    """
+    n = scores.shape[0]
+    first = 1 if unique_root else 0
+    c_left, c_right, i_left, i_right = chart
+    o_c_left, o_c_right, o_i_left, o_i_right = outside = _chart(n)
+    if unique_root:
+        roots = np.arange(1, n)
+        _update(o_c_left, 1, roots, scores[0, roots] + c_right[roots, n - 1])
+        _update(o_c_right, roots, n - 1, scores[0, roots] + c_left[1, roots])
+    else:
+        o_c_right[0, n - 1] = 0.
+    for width in range(n - 1 - first, 0, -1):
+        srcs = np.arange(first, n - width)
+        tgts = srcs + width
+        nsplit = width if max_width is None else min(width, max_width)
+        steps = np.arange(nsplit)[None, :]
+        # complete spans (see `_inside` for the splits)
+        out = o_c_left[srcs, tgts][:, None]
+        mids = tgts[:, None] - nsplit + steps
+        _update(o_c_left, srcs[:, None], mids,
+                out + i_left[mids, tgts[:, None]])
+        _update(o_i_left, mids, tgts[:, None],
+                out + c_left[srcs[:, None], mids])
+        rsrcs, rtgts = srcs[srcs > 0], tgts[srcs > 0]
+        out = o_c_right[rsrcs, rtgts][:, None]
+        mids = rsrcs[:, None] + 1 + steps
+        _update(o_i_right, rsrcs[:, None], mids,
+                out + c_right[mids, rtgts[:, None]])
+        _update(o_c_right, mids, rtgts[:, None],
+                out + i_right[rsrcs[:, None], mids])
+        if first == 0:
+            mids = np.arange(1, width + 1)
+            out = o_c_right[0, width]
+            _update(o_i_right, 0, mids, out + c_right[mids, width])
+            _update(o_c_right, mids, width, out + i_right[0, mids])
+        # incomplete spans
+        if max_width is None or width <= max_width:
+            isrcs = srcs
+        else:
+            isrcs = srcs[srcs == 0]
+        if not len(isrcs):
+            continue
+        itgts = isrcs + width
+        out = np.maximum(o_i_right[isrcs, itgts] + scores[isrcs, itgts],
+                         o_i_left[isrcs, itgts] + scores[itgts, isrcs])
+        out = out[:, None]
+        mids = isrcs[:, None] + np.arange(width)[None, :]
+        _update(o_c_right, isrcs[:, None], mids,
+                out + c_left[mids + 1, itgts[:, None]])
+        _update(o_c_left, mids + 1, itgts[:, None],
+                out + c_right[isrcs[:, None], mids])
+    return outside
+
+
+def _max_marginal(scores, chart, outside, head, dep):
+    """Best score of a tree using the arc `head -> dep` (which need not
+    be in the chart) and otherwise only arcs of the chart"""
+    c_left, c_right, _, _ = chart
+    o_c_left, o_c_right, _, _ = outside
+    src, tgt = min(head, dep), max(head, dep)
+    mids = np.arange(src, tgt)
+    inside = (c_right[src, mids] + c_left[mids + 1, tgt]).max() +\
+        scores[head, dep]
+    if head < dep:
+        # the last right dependent of `head` so far
+        ends = np.arange(tgt, scores.shape[0])
+        rest = (o_c_right[src, ends] + c_right[tgt, ends]).max()
+    else:
+        starts = np.arange(0, src + 1)
+        rest = (o_c_left[starts, tgt] + c_left[starts, src]).max()
+    return inside + rest
+
+
+def eisner(scores, max_width=None, unique_root=True):
+    """Best projective dependency tree for a matrix of arc scores
+
+    Parameters
+    ----------
+    scores : 2D array of float
+        `scores[h, d]` is the score of an arc from `h` to `d`, with
+        node 0 as the root; -inf where there is no arc
+
+    max_width : int, optional
+        Assume there are no arcs between non-root nodes more than this
+        far apart (and skip the corresponding chart cells)
+
+    unique_root : bool
+        If true, the root has exactly one dependent
+
+    Returns
+    -------
+    total : float
+        Score of the best tree (-inf if there is none)
+
+    heads : array of int
+        Head of each node (-1 for the root)
+    """
+    total, heads, _ = _eisner(scores, max_width, unique_root)
+    return total, heads
+
+
+def _eisner(scores, max_width, unique_root):
+    "`eisner`, also returning the chart"
+    n = scores.shape[0]
+    no_tree = np.array([-1] * n, dtype=np.intp)
+    chart, back = _inside(scores, max_width, unique_root)
+    c_left, c_right, _, _ = chart
+    if unique_root:
+        if n < 2:
+            return _NEG_INF, no_tree, chart
+        totals = scores[0, 1:] + c_left[1, 1:] + c_right[1:, n - 1]
+        root_child = 1 + int(np.argmax(totals))
+        total = totals[root_child - 1]
+    else:
+        root_child = None
+        total = c_right[0, n - 1]
+    if total == _NEG_INF:
+        return total, no_tree, chart
+    return total, _backtrack(n, unique_root, root_child, back), chart
+
+
+def prune(scores, max_width=None, beam=None):
+    """Drop arcs from a score matrix (see module docstring)
+
+    Returns
+    -------
+    pruned : 2D array of float
+        Scores with the dropped arcs set to -inf
+
+    dropped : 2D array of bool
+        Arcs dropped
+    """
+    n = scores.shape[0]
+    keep = np.isfinite(scores)
+    candidates = keep.copy()
+    if max_width is not None:
+        heads, deps = np.indices((n, n))
+        keep &= (np.abs(heads - deps) <= max_width) | (heads == 0)
+    if beam is not None:
+        best = scores.max(axis=0)
+        keep &= (scores >= best - beam) | (np.arange(n)[:, None] == 0)
+    return np.where(keep, scores, _NEG_INF), candidates & ~keep
+
+
+def certify(scores, pruned, dropped, total, chart, max_width=None,
+            unique_root=True):
+    """True if no tree using a dropped arc scores more than `total`
+    (the best tree without them)
+
+    Parameters
+    ----------
+    scores : 2D array of float
+        All the arc scores
+
+    pruned, dropped : 2D array
+        See `prune`
+
+    total : float
+        Score of the best tree in the pruned space
+
+    chart : list of 2D array of float
+        Its chart (see `_inside`), with the same `max_width` and
+        `unique_root`
+
+    Returns
+    -------
+    exact : bool
+
+    checked : int
+        Arcs we had to compute the max-marginal of
+    """
+    if not dropped.any():
+        return True, 0
+    if total == _NEG_INF:
+        return False, 0
+    limit = total + _TOLERANCE
+    best_in = scores.max(axis=0)
+    best_in[0] = 0.
+    upper = best_in.sum()
+    # trees with dropped arcs into two nodes (or more)
+    with np.errstate(invalid='ignore'):
+        gaps = np.where(dropped, best_in[None, :] - scores, np.inf)
+    gaps = np.sort(gaps.min(axis=0))
+    if np.isfinite(gaps[1]) and upper - gaps[0] - gaps[1] > limit:
+        return False, 0
+    # trees with one dropped arc: loose bound first, then (for the
+    # arcs it does not rule out) their max-marginal over the chart
+    heads, deps = np.nonzero(dropped)
+    loose = scores[heads, deps] + upper - best_in[deps]
+    todo = np.flatnonzero(loose > limit)
+    if not len(todo):
+        return True, 0
+    outside = _outside(pruned, chart, max_width, unique_root)
+    for checked, idx in enumerate(todo, 1):
+        if _max_marginal(scores, chart, outside,
+                         heads[idx], deps[idx]) > limit:
+            return False, checked
+    return True, len(todo)
+
+
+class PrunedEisnerDecoder(Decoder):
+    """
+    Eisner decoder trying a pruned search space first, and falling
+    back to exact decoding when it cannot prove the result optimal
+
+    Parameters
+    ----------
+    max_width : int, optional
+        Span width pruning (None to disable)
+
+    beam : float, optional
+        Score threshold pruning, in the units of the arc scores (log
+        probabilities if `use_prob`; None to disable)
+
+    unique_real_root : bool
+        The root has exactly one dependent
+
+    use_prob : bool
+        The attachment scores are probabilities
+    """
+    def __init__(self, max_width=None, beam=None, unique_real_root=True,
+                 use_prob=True):
+        self.max_width = max_width
+        self.beam = beam
+        self.unique_real_root = unique_real_root
+        self.use_prob = use_prob
+
+    def decode(self, dpack, nonfixed_pairs=None):
+        start = time.time()
+        nodes, scores, labels = score_matrix(dpack, self.use_prob)
+        unique = self.unique_real_root
+        pruned, dropped = prune(scores, self.max_width, self.beam)
+        total, heads, chart = _eisner(pruned, self.max_width, unique)
+        exact, checked = certify(scores, pruned, dropped, total, chart,
+                                 self.max_width, unique)
+        if not exact:
+            total, heads = eisner(scores, unique_root=unique)
+        _DECODE_STATS.append({'decoder': 'eisner_pruned',
+                              'arcs': int(np.isfinite(scores).sum()),
+                              'pruned': int(dropped.sum()),
+                              'checked': checked,
+                              'exact': bool(exact),
+                              'fallback': not exact,
+                              'seconds': time.time() - start})
+        return convert_prediction(dpack,
+                                  _predictions(nodes, labels, heads))
+
+
+# ---------------------------------------------------------------------
+# A*
+# ---------------------------------------------------------------------
+
+
+def heuristic_table(scores, unique_root=True, rfc=True):
+    """Admissible A* heuristic for left to right attachment
+
+    It is computed once per document, so that the search only ever
+    looks it up.
+
+    Returns
+    -------
+    best_in : array of float
+        For each node, the best arc into it from a head it could get
+        (any node if `rfc`, since arcs can then go either way; an
+        earlier node otherwise)
+
+    table : array of float
+        For each `k`, `sum(best_in[k+1:])`: an upper bound on the
+        arcs into the nodes still to come
+
+    later : 2D array of float
+        `later[k, x]`: the best arc into `x` from a node after `k`
+        (for the nodes waiting on the stack in `rfc` mode)
+    """
+    n = scores.shape[0]
+    if rfc:
+        allowed = ~np.eye(n, dtype=bool)
+    else:
+        allowed = np.triu(np.ones((n, n), dtype=bool), 1)
+        if unique_root:
+            allowed[0, 2:] = False
+    best_in = np.where(allowed, scores, _NEG_INF).max(axis=0)
+    best_in[0] = 0.
+    table = np.zeros(n)
+    table[:-1] = np.cumsum(best_in[::-1])[::-1][1:]
+    later = np.full((n, n), _NEG_INF)
+    later[:-1] = np.maximum.accumulate(scores[::-1], axis=0)[::-1][1:]
+    return best_in, table, later
+
+
+def _heads_for(n, state, parents, greedy=None):
+    "heads from the A* parent pointers (then a greedy completion)"
+    heads = np.empty(n, dtype=np.intp)
+    heads.fill(-1)
+    while parents[state][1] is not None:
+        _, parent, arcs = parents[state]
+        for head, dep in arcs:
+            heads[dep] = head
+        state = parent
+    for node, head in (greedy or {}).items():
+        heads[node] = head
+    return heads
+
+
+class _Search(object):
+    """Left to right attachment of the nodes of a document
+
+    With `rfc`, a state is the last node read and a stack of the
+    nodes still waiting for a head (the root at the bottom), as in
+    arc-standard shift-reduce parsing. Reading a node first settles
+    some of the top of the stack, each node as a right dependent of
+    the one below it, then makes the new node the head of some of the
+    nodes left on top (left arcs), and pushes it. This reaches every
+    projective tree: each node gets its head either from the right
+    frontier of what is to its left or from a later node.
+
+    Without `rfc`, each node is attached to any earlier node as soon
+    as it is read, so every arc goes rightwards (heads come before
+    their dependents), but trees need not be projective.
+    """
+    def __init__(self, scores, rfc, unique_root, table):
+        self.scores = scores
+        self.rfc = rfc
+        self.unique_root = unique_root
+        _, self.table, self.later = table
+        self.init = (0, (0,)) if rfc else (0, ())
+
+    def _waiting(self, stack, node, later):
+        """Bounds for the moves reading `node` from a stack: for each
+        `below`, on the arcs into `stack[1:below + 1]` and into `node`
+        if they are left waiting (from a node below them on the
+        stack, or if `later` from a node after `node`)"""
+        nodes = np.array(stack)
+        below = self.scores[np.ix_(nodes, nodes)]
+        below[np.tril_indices(len(nodes))] = _NEG_INF
+        wait = below.max(axis=0)
+        into = np.maximum.accumulate(self.scores[nodes, node])
+        if later:
+            wait = np.maximum(wait, self.later[node, nodes])
+            into = np.maximum(into, self.later[node, node])
+        wait[0] = 0.
+        return np.cumsum(wait) + into
+
+    def _rfc_options(self, stack, node, later):
+        """Score and estimate (see `moves`) of the moves reading
+        `node` in `rfc` mode, for each `(below, top)`: settle the
+        stack down to `stack[top]`, make `node` the head of
+        `stack[below + 1:top + 1]`
+
+        Returns
+        -------
+        values : 2D array of float
+            Score of each move (-inf for impossible ones)
+
+        rest : array of float
+            Estimate for each `below`
+        """
+        scores = self.scores
+        size = len(stack)
+        nodes = np.array(stack)
+        idx = np.arange(size)
+        # settle[top]: arcs settling everything above `top`
+        chain = scores[nodes[:-1], nodes[1:]]
+        settle = np.zeros(size)
+        settle[:-1] = np.cumsum(chain[::-1])[::-1]
+        # left[below, top]: left arcs to `stack[below + 1:top + 1]`
+        left = np.cumsum(np.where(idx[None, :] > idx[:, None],
+                                  scores[node, nodes][None, :], 0.),
+                         axis=1)
+        values = settle[None, :] + left
+        # settling onto the root is only for the end if it is unique
+        lowest = 1 if self.unique_root and size > 1 else 0
+        values[(idx[:, None] > idx[None, :]) | (idx[None, :] < lowest)] =\
+            _NEG_INF
+        if node == scores.shape[0] - 1:
+            # settle everything (onto a single root dependent)
+            finish = np.zeros(size)
+            finish[1:] = np.cumsum(chain)
+            values += (finish + scores[nodes, node])[:, None]
+            return values, np.zeros(size)
+        return values, self.table[node] + self._waiting(stack, node, later)
+
+    def _rfc_move(self, stack, node, below, top):
+        "arcs and next state of a move from `_rfc_options`"
+        arcs = list(zip(stack[top:-1], stack[top + 1:]))[::-1]
+        arcs.extend((node, x) for x in stack[below + 1:top + 1][::-1])
+        nxt = stack[:below + 1] + (node,)
+        if node == self.scores.shape[0] - 1:
+            arcs.extend(zip(nxt[:-1], nxt[1:]))
+            nxt = (0,)
+        return tuple(arcs), (node, nxt)
+
+    def moves(self, state, later=True):
+        """(arcs, score, next state, estimate) for reading the next
+        node
+
+        The estimate is an upper bound on the arcs the next state
+        still has to get (see `heuristic_table`); without `later`, the
+        nodes left waiting on the stack are only counted for the heads
+        they could get below them (which is no longer a bound)
+        """
+        last, stack = state
+        node = last + 1
+        if self.rfc:
+            values, rest = self._rfc_options(stack, node, later)
+            for below, top in zip(*np.nonzero(values > _NEG_INF)):
+                arcs, nxt = self._rfc_move(stack, node, below, top)
+                yield arcs, values[below, top], nxt, rest[below]
+            return
+        for head in range(node):
+            if head == 0 and self.unique_root and node > 1:
+                continue
+            score = self.scores[head, node]
+            if score > _NEG_INF:
+                yield ((head, node),), score, (node, ()), self.table[node]
+
+    def greedy(self, state):
+        """Complete a state by taking, for each remaining node, the
+        move that looks best
+
+        Moves are compared on their score and an estimate of what is
+        left in which the nodes on the stack can only get a head from
+        below: counting on later nodes (as the A* heuristic must)
+        would put everything off until the end.
+
+        Returns
+        -------
+        score : float
+            Score of the attachments added (-inf if stuck)
+
+        heads : dict(int, int)
+        """
+        total = 0.
+        heads = {}
+        while state[0] < self.scores.shape[0] - 1:
+            last, stack = state
+            if self.rfc:
+                values, rest = self._rfc_options(stack, last + 1, False)
+                values = values + rest[:, None]
+                below, top = np.unravel_index(np.argmax(values),
+                                              values.shape)
+                if values[below, top] == _NEG_INF:
+                    return _NEG_INF, {}
+                score = values[below, top] - rest[below]
+                arcs, state = self._rfc_move(stack, last + 1, below, top)
+            else:
+                moves = list(self.moves(state, later=False))
+                if not moves:
+                    return _NEG_INF, {}
+                arcs, score, state, _ = max(moves,
+                                            key=lambda m: m[1] + m[3])
+            heads.update((dep, head) for head, dep in arcs)
+            total += score
+        return total, heads
+
+
+def astar(scores, rfc=True, unique_root=True, max_expansions=None,
+          max_seconds=None, table=None):
+    """Best tree built by attaching nodes left to right (see `_Search`),
+    within a budget
+
+    The search starts with a greedy solution, and keeps the best
+    complete tree found so far; if the budget runs out we also
+    greedily complete the most promising state and return whichever
+    is better. Without a budget hit, the result is optimal (or there
+    is no tree at all in the search space).
+
+    Parameters
+    ----------
+    scores : 2D array of float
+        See `eisner`
+
+    rfc : bool
+        Projective trees, with arcs either way (otherwise, any tree
+        whose arcs all go rightwards)
+
+    max_expansions : int, optional
+
+    max_seconds : float, optional
+
+    table : tuple of array of float, optional
+        See `heuristic_table` (computed if not given)
+
+    Returns
+    -------
+    total : float
+        (-inf if we found no tree)
+
+    heads : array of int
+
+    info : dict
+        'expansions', 'budget_hit' (None, 'time' or 'expansions'),
+        'optimal' (False if we found no tree)
+    """
+    start = time.time()
+    n = scores.shape[0]
+    if table is None:
+        table = heuristic_table(scores, unique_root, rfc)
+    search = _Search(scores, rfc, unique_root, table)
+    init = search.init
+    parents = {init: (0., None, None)}
+    best_total, greedy_heads = search.greedy(init)
+    best_heads = _heads_for(n, init, parents, greedy_heads)
+    _, upper, _ = table
+    heap = [(-upper[0], 0, init, 0.)]
+    pushed = 1
+    expansions = 0
+    budget_hit = None
+    optimal = False
+    while heap:
+        neg_f, _, state, g_score = heapq.heappop(heap)
+        if g_score != parents[state][0]:
+            continue  # stale entry (found a better path since)
+        if -neg_f <= best_total + 1e-12:
+            optimal = True  # nothing left can beat what we have
+            break
+        if state[0] == n - 1:
+            best_total = g_score
+            best_heads = _heads_for(n, state, parents)
+            optimal = True
+            break
+        if max_expansions is not None and expansions >= max_expansions:
+            budget_hit = 'expansions'
+        elif max_seconds is not None and\
+                time.time() - start > max_seconds:
+            budget_hit = 'time'
+        if budget_hit is not None:
+            rest, greedy_heads = search.greedy(state)
+            if g_score + rest > best_total:
+                best_total = g_score + rest
+                best_heads = _heads_for(n, state, parents, greedy_heads)
+            break
+        expansions += 1
+        for arcs, score, nxt, rest in search.moves(state):
+            nxt_g = g_score + score
+            if nxt_g > parents.get(nxt, (_NEG_INF,))[0]:
+                parents[nxt] = (nxt_g, state, arcs)
+                heapq.heappush(heap, (-(nxt_g + rest), pushed, nxt,
+                                      nxt_g))
+                pushed += 1
+    if not heap and budget_hit is None:
+        optimal = True
+    if best_total == _NEG_INF:
+        optimal = False
+    return best_total, best_heads, {'expansions': expansions,
+                                    'budget_hit': budget_hit,
+                                    'optimal': optimal}
+
+
+class BudgetAstarDecoder(Decoder):
+    """
+    A* decoder reading EDUs left to right, with a per document budget
+
+    When the budget runs out, we decode again with `eisner` (which
+    finds the best tree of the RFC search space), or without the RFC,
+    return the best tree found so far (see `astar`), so decoding time
+    is bounded whatever the document.
+
+    Parameters
+    ----------
+    rfc : bool
+        Right frontier constraint: projective trees, with arcs either
+        way (otherwise, any tree whose arcs all go rightwards, see
+        `_Search`)
+
+    max_expansions : int, optional
+        Search states expanded per document
+
+    max_seconds : float, optional
+        Time per document
+
+    unique_real_root : bool
+
+    use_prob : bool
+    """
+    def __init__(self, rfc=True, max_expansions=None, max_seconds=None,
+                 unique_real_root=True, use_prob=True):
+        self.rfc = rfc
+        self.max_expansions = max_expansions
+        self.max_seconds = max_seconds
+        self.unique_real_root = unique_real_root
+        self.use_prob = use_prob
+
+    def decode(self, dpack, nonfixed_pairs=None):
+        start = time.time()
+        nodes, scores, labels = score_matrix(dpack, self.use_prob)
+        _, heads, info = astar(scores,
+                               rfc=self.rfc,
+                               unique_root=self.unique_real_root,
+                               max_expansions=self.max_expansions,
+                               max_seconds=self.max_seconds)
+        info['fallback'] = self.rfc and info['budget_hit'] is not None
+        if info['fallback']:
+            total, heads = eisner(scores,
+                                  unique_root=self.unique_real_root)
+            info['optimal'] = bool(total > _NEG_INF)
+        info.update(decoder='astar', seconds=time.time() - start)
+        _DECODE_STATS.append(info)
+        return convert_prediction(dpack,
+                                  _predictions(nodes, labels, heads))
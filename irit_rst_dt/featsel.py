@@ -0,0 +1,280 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Feature selection
+
+Most of our sparse features only fire a handful of times. The
+`select` stage computes feature counts and chi2/mutual information
+with the attachment and labelling targets, on the full training data
+and on each training fold. It writes reduced feature matrices, with
+the features selected on the full training data, that evaluations can
+use instead of the full ones (`SELECTED_FEATURES`). The per-fold
+selections are only saved for inspection (eg. to see how stable the
+selection is).
+
+The reduced matrices are fine for the test corpus, and for anything
+trained on all the training data, but cross-validation scores on them
+are optimistic: the selection has seen the test part of every fold
+(attelo runs all the folds on the same matrix, so we cannot give each
+fold its own). For cross-validation, wrap a learner's estimator in
+`SelectedFeaturesEstimator` instead (the `maxent-sel` learners), which
+redoes the selection on whatever data it is fit on, ie. on the
+training part of each fold only.
+"""
+
+from __future__ import print_function
+import codecs
+import os
+
+import numpy as np
+import scipy.sparse
+from sklearn.base import (BaseEstimator, ClassifierMixin)
+from sklearn.feature_selection import (chi2)
+
+from .folds import (select_rows)
+
+SELECTION_EXT = '.selection.npz'
+"""Extension (added to the features file) of the selection statistics"""
+
+REDUCED_EXT = '.reduced'
+"""Extension (added to the features file) of the reduced features"""
+
+
+def column_counts(data):
+    """Number of rows each column is active in"""
+    data = scipy.sparse.csc_matrix(data)
+    return np.diff(data.indptr)
+
+
+def mutual_information(data, target):
+    """Mutual information between the presence of each feature and
+    the target
+
+    Parameters
+    ----------
+    data : sparse matrix (n_samples, n_features)
+
+    target : array of int (n_samples)
+
+    Returns
+    -------
+    scores : array of float (n_features)
+    """
+    data = scipy.sparse.csr_matrix(data)
+    present = scipy.sparse.csr_matrix((np.ones_like(data.data),
+                                       data.indices, data.indptr),
+                                      shape=data.shape)
+    classes, target = np.unique(target, return_inverse=True)
+    nrows = float(data.shape[0])
+    onehot = scipy.sparse.csr_matrix(
+        (np.ones(len(target)), (np.arange(len(target)), target)),
+        shape=(len(target), len(classes)))
+    # joint counts: feature present/absent x class
+    n_11 = np.asarray((present.T * onehot).todense())
+    n_f = np.asarray(present.sum(axis=0)).reshape(-1, 1)
+    n_c = np.asarray(onehot.sum(axis=0)).reshape(1, -1)
+    n_01 = n_c - n_11
+    scores = np.zeros(data.shape[1])
+    for n_joint, n_marg in [(n_11, n_f), (n_01, nrows - n_f)]:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            terms = (n_joint / nrows) *\
+                np.log(n_joint * nrows / (n_marg * n_c))
+        scores += np.nansum(np.where(n_joint > 0, terms, 0.), axis=1)
+    return scores
+
+
+def feature_scores(data, target, score):
+    """Relevance of each feature to the target
+
+    Parameters
+    ----------
+    score : string
+        'chi2' or 'mi'
+    """
+    if score == 'chi2':
+        return np.nan_to_num(chi2(data, target)[0])
+    elif score == 'mi':
+        return mutual_information(data, target)
+    else:
+        raise ValueError("'score' should be one of chi2/mi: " + score)
+
+
+def select_columns(data, target, min_count=1, k=None, score=None):
+    """Columns to keep: those active in at least `min_count` rows, and
+    (if `k` and `score` are set) among the `k` best scoring ones
+
+    Returns
+    -------
+    columns : array of int
+        Sorted column numbers
+    """
+    keep = column_counts(data) >= min_count
+    if k is None or score is None or keep.sum() <= k:
+        return np.flatnonzero(keep)
+    scores = feature_scores(data, target, score)
+    scores[~keep] = -np.inf
+    best = np.argpartition(-scores, k)[:k]
+    return np.sort(best[np.isfinite(scores[best])])
+
+
+def fold_selections(data, target, fold_indices, unrelated, **kwargs):
+    """Select features on each training fold, and on the full data
+
+    We select separately for attachment (attached or not, on all
+    pairings) and labelling (label, on attached pairings), and keep
+    the union of both.
+
+    Parameters
+    ----------
+    data : scipy.sparse.csr_matrix
+        Stacked feature matrix (see `irit_rst_dt.folds`)
+
+    target : array of int
+        Stacked targets
+
+    fold_indices : dict(int, dict(string, array of int))
+        See `irit_rst_dt.folds`
+
+    unrelated : int
+        Label number for unrelated pairs
+
+    kwargs :
+        Passed on to `select_columns`
+
+    Returns
+    -------
+    selections : dict(string, array of int)
+        Selected columns for each fold ('fold-N') and for the full
+        training data ('all')
+
+    counts : dict(string, array of int)
+        Feature counts on the training pairs of each fold (and 'all')
+    """
+    parts = dict(('fold-{}'.format(f), idxes)
+                 for f, idxes in fold_indices.items())
+    parts['all'] = {'train_attach': np.arange(len(target)),
+                    'train_label': np.flatnonzero(target != unrelated)}
+    selections = {}
+    counts = {}
+    for name, indices in parts.items():
+        a_data, a_target = select_rows(data, target, {0: indices}, 0,
+                                       'train_attach')
+        l_data, l_target = select_rows(data, target, {0: indices}, 0,
+                                       'train_label')
+        counts[name] = column_counts(a_data)
+        selections[name] = np.union1d(
+            select_columns(a_data, a_target != unrelated, **kwargs),
+            select_columns(l_data, l_target, **kwargs))
+    return selections, counts
+
+
+def _vocab_columns(vocab_path):
+    "feature names and the column number they use in the features file"
+    entries = []
+    with codecs.open(vocab_path, 'r', 'utf-8') as stream:
+        for lnum, line in enumerate(stream):
+            fields = line.rstrip('\n').split('\t')
+            col = int(fields[1]) if len(fields) > 1 else lnum
+            entries.append((fields[0], col))
+    return entries
+
+
+def write_reduced(features_path, vocab_path, columns, out_path):
+    """Write a copy of a features file (and its vocabulary) with only
+    the given columns
+
+    Parameters
+    ----------
+    columns : array of int
+        Columns to keep, as positions in the vocabulary (ie. matrix
+        columns once loaded)
+
+    out_path : string
+        Reduced features file (its vocabulary is written alongside,
+        with a `.vocab` extension)
+    """
+    entries = _vocab_columns(vocab_path)
+    base = min(c for _, c in entries) if entries else 0
+    col_map = dict((entries[pos][1], new + base)
+                   for new, pos in enumerate(columns))
+    with codecs.open(out_path + '.vocab', 'w', 'utf-8') as stream:
+        for new, pos in enumerate(columns):
+            print(u'{}\t{}'.format(entries[pos][0], new + base),
+                  file=stream)
+    tmp_path = out_path + '.tmp'
+    with codecs.open(features_path, 'r', 'utf-8') as istream,\
+            codecs.open(tmp_path, 'w', 'utf-8') as ostream:
+        for line in istream:
+            if line.startswith('#'):
+                ostream.write(line)
+                continue
+            fields = line.split()
+            if not fields:
+                continue
+            kept = []
+            for field in fields[1:]:
+                col, val = field.split(':')
+                col = int(col)
+                if col in col_map:
+                    kept.append((col_map[col], val))
+            ostream.write(' '.join([fields[0]] +
+                                   ['{}:{}'.format(c, v)
+                                    for c, v in sorted(kept)]) + '\n')
+    os.rename(tmp_path, out_path)
+
+
+def save_selections(selections, counts, path):
+    """Save the selected columns and feature counts for each part"""
+    arrays = dict(('columns:' + k, v) for k, v in selections.items())
+    arrays.update(('counts:' + k, v) for k, v in counts.items())
+    with open(path, 'wb') as stream:
+        np.savez_compressed(stream, **arrays)
+
+
+class SelectedFeaturesEstimator(BaseEstimator, ClassifierMixin):
+    """
+    Wrap a scikit estimator so that it only sees the features selected
+    (see `select_columns`) on the data it is fit on.
+
+    This is leak-free feature selection for cross-validation: each fold
+    selects from its own training data. The coefficients (if any) are
+    reported over the full feature space, so that feature reports still
+    work.
+    """
+    def __init__(self, estimator, min_count=2, k=None, score='chi2'):
+        self.estimator = estimator
+        self.min_count = min_count
+        self.k = k
+        self.score = score
+
+    def fit(self, X, y):
+        "select features, then fit the wrapped estimator on them"
+        self.columns_ = select_columns(X, y,
+                                       min_count=self.min_count,
+                                       k=self.k,
+                                       score=self.score)
+        self.n_features_ = X.shape[1]
+        self.estimator.fit(X[:, self.columns_], y)
+        self.classes_ = self.estimator.classes_
+        return self
+
+    def predict(self, X):
+        "see wrapped estimator"
+        return self.estimator.predict(X[:, self.columns_])
+
+    def predict_proba(self, X):
+        "see wrapped estimator"
+        return self.estimator.predict_proba(X[:, self.columns_])
+
+    def decision_function(self, X):
+        "see wrapped estimator"
+        return self.estimator.decision_function(X[:, self.columns_])
+
+    @property
+    def coef_(self):
+        "coefficients of the wrapped estimator, over all features"
+        inner = self.estimator.coef_
+        coef = np.zeros((inner.shape[0], self.n_features_))
+        coef[:, self.columns_] = inner
+        return coef
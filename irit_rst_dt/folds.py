@@ -0,0 +1,208 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Precomputed row indices for the cross-validation folds
+
+The fold file only tells us which fold each document belongs to.
+Turning that into training/testing data means walking the multipack
+and stacking the selected documents every time we need them. Instead,
+we stack the multipack once (documents in sorted order) and save, for
+each fold, the sorted row indices of its training and testing
+instances. Selecting a fold is then a single fancy-indexing operation
+on the stacked CSR matrix.
+
+This is for code that works on the stacked matrix (feature selection,
+and `irit-rst-dt bench`). The attelo fold loop fits parsers on
+datapacks, one per document, so it still selects the documents of
+each fold as before.
+"""
+
+from __future__ import print_function
+from os import path as fp
+import hashlib
+
+import numpy as np
+import scipy.sparse
+
+from attelo.table import (UNRELATED)
+
+PARTS = ['train_attach', 'test_attach', 'train_label', 'test_label']
+"""Index arrays we keep for each fold.
+
+The attach arrays cover all candidate pairings; the label arrays only
+cover the pairings that are attached in the gold data (the instances
+a label learner is trained/scored on)"""
+
+
+def doc_order(mpack):
+    """Order in which the documents of a multipack are stacked"""
+    return sorted(mpack)
+
+
+def stack_multipack(mpack):
+    """Stack all documents of a multipack into a single matrix.
+
+    Parameters
+    ----------
+    mpack : dict(string, DataPack)
+
+    Returns
+    -------
+    docs : list of string
+        Document names, in stacking order (see `doc_order`)
+
+    data : scipy.sparse.csr_matrix
+        Feature rows of all pairings
+
+    target : array of int
+        Target label number of each row
+    """
+    docs = doc_order(mpack)
+    data = scipy.sparse.vstack([mpack[d].data for d in docs],
+                               format='csr')
+    target = np.concatenate([mpack[d].target for d in docs])
+    return docs, data, target
+
+
+def compute_fold_indices(mpack, fold_dict):
+    """Compute row index arrays for every fold in a single pass.
+
+    Documents that do not appear in the fold dictionary are left out
+    of every fold.
+
+    Parameters
+    ----------
+    mpack : dict(string, DataPack)
+
+    fold_dict : dict(string, int)
+        Document to fold mapping
+
+    Returns
+    -------
+    indices : dict(int, dict(string, array of int))
+        For each fold, sorted row indices (into the stacked multipack)
+        for each of `PARTS`
+    """
+    docs = doc_order(mpack)
+    row_folds = []
+    row_attached = []
+    for doc in docs:
+        dpack = mpack[doc]
+        nrows = dpack.data.shape[0]
+        row_folds.append(np.repeat(fold_dict.get(doc, -1), nrows))
+        unrelated = dpack.label_number(UNRELATED)
+        row_attached.append(dpack.target != unrelated)
+    row_folds = np.concatenate(row_folds)
+    row_attached = np.concatenate(row_attached)
+    known = row_folds >= 0
+
+    indices = {}
+    for fold in sorted(set(fold_dict.values())):
+        in_test = row_folds == fold
+        in_train = known & ~in_test
+        indices[fold] = {
+            'train_attach': np.flatnonzero(in_train),
+            'test_attach': np.flatnonzero(in_test),
+            'train_label': np.flatnonzero(in_train & row_attached),
+            'test_label': np.flatnonzero(in_test & row_attached),
+        }
+    return indices
+
+
+def fold_assignment(docs, fold_dict):
+    """Digest of the fold each document (in stacking order) is in"""
+    digest = hashlib.md5()
+    for doc in docs:
+        digest.update('{}\t{}\n'.format(doc, fold_dict.get(doc, -1))
+                      .encode('utf-8'))
+    return digest.hexdigest()
+
+
+def save_fold_indices(indices, docs, fold_dict, path):
+    """Save fold indices (as computed by `compute_fold_indices`).
+
+    We also save the document order they were computed against, and a
+    digest of the fold assignment (see `fold_assignment`) so that
+    stale indices can be detected on load.
+    """
+    arrays = {'docs': np.array(docs),
+              'assignment': np.array(fold_assignment(docs, fold_dict))}
+    for fold, parts in indices.items():
+        for part, idxes in parts.items():
+            arrays['{}-{}'.format(fold, part)] = idxes
+    with open(path, 'wb') as stream:
+        np.savez_compressed(stream, **arrays)
+
+
+def load_fold_indices(path):
+    """Read fold indices back from a file written by
+    `save_fold_indices`
+
+    Returns
+    -------
+    docs : list of string
+
+    assignment : string or None
+        See `fold_assignment` (None for files that predate it)
+
+    indices : dict(int, dict(string, array of int))
+    """
+    indices = {}
+    assignment = None
+    with np.load(path) as arrays:
+        docs = [str(d) for d in arrays['docs']]
+        for key in arrays.files:
+            if key == 'docs':
+                continue
+            elif key == 'assignment':
+                assignment = str(arrays[key])
+                continue
+            fold, part = key.split('-', 1)
+            indices.setdefault(int(fold), {})[part] = arrays[key]
+    return docs, assignment, indices
+
+
+def cached_fold_indices(mpack, fold_dict, path):
+    """Fold indices for a multipack, reading them from `path` if they
+    were computed against the same documents and fold assignment, and
+    (re)computing and saving them otherwise.
+    """
+    docs = doc_order(mpack)
+    if fp.exists(path):
+        cached_docs, assignment, indices = load_fold_indices(path)
+        if cached_docs == docs and\
+                assignment == fold_assignment(docs, fold_dict):
+            return indices
+    indices = compute_fold_indices(mpack, fold_dict)
+    save_fold_indices(indices, docs, fold_dict, path)
+    return indices
+
+
+def select_rows(data, target, indices, fold, part):
+    """Slice a stacked multipack down to one part of a fold
+
+    Parameters
+    ----------
+    data : scipy.sparse.csr_matrix
+        Stacked feature matrix (see `stack_multipack`)
+
+    target : array of int
+        Stacked targets
+
+    indices : dict(int, dict(string, array of int))
+        Fold indices
+
+    fold : int
+
+    part : string
+        One of `PARTS`
+
+    Returns
+    -------
+    data : scipy.sparse.csr_matrix
+
+    target : array of int
+    """
+    idxes = indices[fold][part]
+    return data[idxes], target[idxes]
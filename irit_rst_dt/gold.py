@@ -0,0 +1,161 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Gold RST trees, converted once (at gather time) and cached
+
+Reading the `.dis` files and converting them to dependency trees is
+slow, and the result is the same for every evaluation. Gather converts
+the gold trees of each corpus and saves them next to the multipack
+(`<corpus>.gold.npz`), as flat integer arrays (the head and relation
+of each EDU) with offsets into these arrays for each document.
+
+The trees go through the same relation rewriting as the features
+(`--coarse`, `--fix_pseudo_rels`), so that their labels are those of
+the datapacks.
+
+Only our own scoring reads the cache. attelo's reports are built from
+the corpus itself (see `IritHarness.mpack_paths`): its `cspans` metric
+needs the constituency trees, which we do not keep.
+"""
+
+from __future__ import print_function
+from collections import namedtuple
+from os import path as fp
+import os
+
+import numpy as np
+
+from educe.rst_dt.annotation import (SimpleRSTTree)
+from educe.rst_dt.corpus import (RELMAP_112_18_FILE,
+                                 Reader,
+                                 RstRelationConverter)
+from educe.rst_dt.deptree import (RstDepTree)
+from educe.rst_dt.pseudo_relations import (rewrite_pseudo_rels)
+
+
+GOLD_EXT = '.gold.npz'
+"""Extension (added to the corpus name) of the cached gold trees"""
+
+
+class GoldTree(namedtuple('GoldTree',
+                          ['heads', 'labels'])):
+    """
+    Gold structure of a document
+
+    Parameters
+    ----------
+    heads : array of int
+        Head of each EDU (0 for the root, which has head -1)
+
+    labels : list of string
+        Relation of each EDU to its head (None for the root)
+    """
+    pass
+
+
+def _relation_converter(coarse, fix_pseudo_rels):
+    """function to apply to each RST tree (and its document key)
+    before converting it, as the feature extraction does"""
+    coarsen = (RstRelationConverter(RELMAP_112_18_FILE).convert_tree
+               if coarse else (lambda x: x))
+    if not fix_pseudo_rels:
+        return lambda key, x: coarsen(x)
+    return lambda key, x: coarsen(rewrite_pseudo_rels(key, x))
+
+
+def read_gold_trees(corpus_path, coarse=False, fix_pseudo_rels=False):
+    """Read and convert the gold trees of a corpus
+
+    Returns
+    -------
+    trees : dict(string, GoldTree)
+        Gold trees by document name
+    """
+    convert = _relation_converter(coarse, fix_pseudo_rels)
+    trees = {}
+    for key, rtree in Reader(corpus_path).slurp().items():
+        stree = SimpleRSTTree.from_rst_tree(convert(key, rtree))
+        dtree = RstDepTree.from_simple_rst_tree(stree)
+        heads = np.array([-1 if h is None else h for h in dtree.heads],
+                         dtype=np.int32)
+        trees[key.doc] = GoldTree(heads=heads,
+                                  labels=list(dtree.labels))
+    return trees
+
+
+def _table(strings):
+    "string table and index of each string in it"
+    table = sorted(set(str(s) for s in strings))
+    index = dict((s, i) for i, s in enumerate(table))
+    return table, np.array([index[str(s)] for s in strings],
+                           dtype=np.int32)
+
+
+def save_gold_trees(trees, path):
+    """Save gold trees (see `read_gold_trees`) to a single binary
+    file"""
+    docs = sorted(trees)
+    edu_offsets = np.cumsum([0] + [len(trees[d].heads) for d in docs])
+    rel_table, dep_rels = _table([l for d in docs for l in trees[d].labels])
+    arrays = {
+        'docs': np.array(docs),
+        'edu_offsets': edu_offsets,
+        'heads': (np.concatenate([trees[d].heads for d in docs])
+                  if docs else np.zeros(0, dtype=np.int32)),
+        'dep_rels': dep_rels,
+        'rel_table': np.array(rel_table),
+    }
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as stream:
+        np.savez_compressed(stream, **arrays)
+    # write then rename (cluster jobs may be reading it)
+    os.rename(tmp_path, path)
+
+
+def load_gold_trees(path):
+    """Read back gold trees saved by `save_gold_trees`
+
+    Returns
+    -------
+    trees : dict(string, GoldTree)
+    """
+    def _string(table, idx):
+        "string from a table, with None written as 'None'"
+        val = str(table[idx])
+        return None if val == 'None' else val
+
+    trees = {}
+    with np.load(path) as arrays:
+        docs = [str(d) for d in arrays['docs']]
+        edu_offsets = arrays['edu_offsets']
+        heads = arrays['heads']
+        dep_rels = arrays['dep_rels']
+        rel_table = arrays['rel_table']
+    for i, doc in enumerate(docs):
+        e_lo, e_hi = edu_offsets[i], edu_offsets[i + 1]
+        trees[doc] = GoldTree(
+            heads=heads[e_lo:e_hi],
+            labels=[_string(rel_table, r) for r in dep_rels[e_lo:e_hi]])
+    return trees
+
+
+def gold_path(data_dir, corpus):
+    """Where the cached gold trees for a corpus live"""
+    return fp.join(data_dir, fp.basename(corpus) + GOLD_EXT)
+
+
+def cache_gold_trees(corpus, data_dir, coarse=False,
+                     fix_pseudo_rels=False):
+    """Convert the gold trees of a corpus and cache them next to its
+    features
+
+    Returns
+    -------
+    path : string
+    """
+    path = gold_path(data_dir, corpus)
+    save_gold_trees(read_gold_trees(corpus, coarse=coarse,
+                                    fix_pseudo_rels=fix_pseudo_rels),
+                    path)
+    return path
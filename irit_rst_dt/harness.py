@@ -1,12 +1,14 @@
 '''
 Paths to files used or generated by the test harness
 '''
+from __future__ import print_function
 from collections import Counter
 from os import path as fp
+import shutil
 import sys
 
 from attelo.fold import (make_n_fold)
-from attelo.harness import Harness
+from attelo.harness import (ClusterStage, Harness)
 from attelo.harness.evaluate import (evaluate_corpus,
                                      prepare_dirs)
 from attelo.io import (load_fold_dict,
@@ -14,15 +16,40 @@ from attelo.io import (load_fold_dict,
 from attelo.parser.intra import (IntraInterPair)
 from attelo.util import (mk_rng)
 
-from .local import (CONFIG_FILE,
+from .adaptive import (evaluate_adaptive)
+from .featsel import (REDUCED_EXT)
+from .folds import (cached_fold_indices)
+from .gold import (GOLD_EXT, load_gold_trees)
+from .learning import (SharedLabelClassifier,
+                       WarmStartParser,
+                       warm_start_estimators)
+from .local import (ADAPTIVE_METRIC,
+                    CONFIG_FILE,
                     DETAILED_EVALUATIONS,
                     EVALUATIONS,
                     FIXED_FOLD_FILE,
                     GRAPH_DOCS,
+                    MAXENT_SOLVER,
+                    MAXENT_WARM_START,
                     METRICS,
+                    SELECTED_FEATURES,
                     TEST_CORPUS,
                     TEST_EVALUATION_KEY,
-                    TRAINING_CORPUS)
+                    TRAINING_CORPUS,
+                    UNPACK_DIR)
+from .oracle import (GoldOracleParser)
+from .profiling import (PROFILE_MODES, profiled_evaluations)
+from .provenance import (check_gather)
+from .progress import (PROGRESS_DIR, progress_evaluations)
+from .repeated import (evaluate_repeated)
+from .results import (record_results)
+from .score import (HARNESS_METRICS, GoldCache)
+from .sharing import (INTER_PREFIXES, shared_evaluations)
+from .speculate import (check_outputs,
+                        committing_evaluations,
+                        mark_outputs)
+from .storage import (local_cache_dir, readable_path)
+from .testeval import (evaluate_test_only)
 from .util import (latest_tmp, exit_ungathered)
 
 
@@ -36,21 +63,167 @@ class IritHarness(Harness):
         dataset = fp.basename(TRAINING_CORPUS)
         testset = (fp.basename(TEST_CORPUS) if TEST_CORPUS is not None
                    else None)
+        self._evaluations = EVALUATIONS
+        self.profile_keys = []
+        self.profile_mode = PROFILE_MODES[0]
         super(IritHarness, self).__init__(dataset, testset)
         self.sanity_check_config()
 
-    def run(self, runcfg):
-        """Run the evaluation
+    def load(self, runcfg, eval_dir, scratch_dir):
+        super(IritHarness, self).load(runcfg, eval_dir, scratch_dir)
+        # models are committed atomically (see `irit_rst_dt.speculate`)
+        evaluations = committing_evaluations(EVALUATIONS)
+        # intra/inter parsers fit their models as a group
+        evaluations = shared_evaluations(evaluations)
+        if MAXENT_WARM_START:
+            evaluations = self._warm_start_evaluations(evaluations)
+        if self.profile_keys:
+            evaluations = profiled_evaluations(
+                evaluations, self.profile_keys,
+                fp.join(eval_dir, 'profiles'), self.profile_mode)
+        # progress events for `irit-rst-dt status`
+        self._evaluations = progress_evaluations(
+            evaluations, fp.join(eval_dir, PROGRESS_DIR))
+        # shared label scores live with the models
+        score_dir = fp.join(scratch_dir, 'label-scores')
+        self._label_score_dir = score_dir
+        for econf in self.evaluations:
+            learners = ([econf.learner.intra, econf.learner.inter]
+                        if isinstance(econf.learner, IntraInterPair)
+                        else [econf.learner])
+            for klearner in learners:
+                if isinstance(klearner.label.payload,
+                              SharedLabelClassifier):
+                    klearner.label.payload.cache_dir = score_dir
+        # gold oracles share the gold trees converted by gather
+        gold_paths = [self._gold_path(False)]
+        if self.testset is not None:
+            gold_paths.append(self._gold_path(True))
+        oracle_gold = GoldCache(paths=gold_paths)
+        for econf in EVALUATIONS:
+            if isinstance(econf.parser.payload, GoldOracleParser):
+                econf.parser.payload.gold_cache = oracle_gold
+
+    def _warm_start_evaluations(self, evaluations):
+        """Copy of a list of evaluations, with the parsers of those with
+        warm started maxent learners wrapped so that their combined
+        models start from the first fold's (see
+        `irit_rst_dt.learning.WarmStartParser`)
+        """
+        result = []
+        for econf in evaluations:
+            combined = self.model_paths(econf.learner, None, econf.parser)
+            first = self.model_paths(econf.learner, 0, econf.parser)
+            init_paths = []
+            for key in combined:
+                learner = econf.learner
+                task_key = key
+                if ':' in key:  # intra/inter, eg. 'inter:attach'
+                    half, task_key = key.split(':')
+                    learner = getattr(learner, half)
+                task = (learner.attach if task_key == 'attach'
+                        else learner.label)
+                init_paths.extend((est, first[key]) for est in
+                                  warm_start_estimators(task.payload))
+            if init_paths:
+                parser = econf.parser
+                econf = econf._replace(parser=parser._replace(
+                    payload=WarmStartParser(parser.payload, init_paths,
+                                            combined.values())))
+            result.append(econf)
+        return result
+
+    def _prepare(self, runcfg):
+        """Set up the eval/scratch dirs for a run and load them
         """
         data_dir = latest_tmp()
         if not fp.exists(data_dir):
             exit_ungathered()
+        # no stale features
+        check_gather(data_dir)
         eval_dir, scratch_dir = prepare_dirs(runcfg, data_dir)
         self.load(runcfg, eval_dir, scratch_dir)
         evidence_of_gathered = self.mpack_paths(False)[0]
         if not fp.exists(evidence_of_gathered):
             exit_ungathered()
+
+    def _warn_selected(self):
+        "cross-validation on the reduced features leaks test data"
+        if self.mpack_paths(False)[2].endswith(REDUCED_EXT):
+            print('WARNING: SELECTED_FEATURES is on: the features were '
+                  'selected on all the training data, so cross-validation '
+                  'scores are optimistic (use the maxent-sel learners '
+                  'instead)', file=sys.stderr)
+
+    def run(self, runcfg):
+        """Run the evaluation
+        """
+        self._prepare(runcfg)
+        self._warn_selected()
+        if runcfg.stage == ClusterStage.end:
+            # the report must not read predictions a straggler is
+            # rewriting (see `irit_rst_dt.speculate`)
+            check_outputs(self,
+                          frozenset(load_fold_dict(self.fold_file).values()))
         evaluate_corpus(self)
+        if runcfg.stage in [None, ClusterStage.main]:
+            # attelo has finished writing the predictions of its folds
+            # (see `irit_rst_dt.speculate`)
+            folds = runcfg.folds
+            if folds is None:
+                folds = frozenset(load_fold_dict(self.fold_file).values())
+            mark_outputs(self, folds)
+        if runcfg.stage in [None, ClusterStage.end]:
+            # for `irit-rst-dt compare`
+            record_results(self)
+            # the folds are done with their shared label scores
+            shutil.rmtree(self._label_score_dir, ignore_errors=True)
+
+    def run_repeated(self, runcfg):
+        """Run repeated cross-validation over several fold seeds
+        (see `irit_rst_dt.repeated`)
+        """
+        self._prepare(runcfg)
+        self._warn_selected()
+        evaluate_repeated(self)
+
+    def run_adaptive(self, runcfg):
+        """Successive halving over the evaluations (see
+        `irit_rst_dt.adaptive`)
+        """
+        if ADAPTIVE_METRIC not in HARNESS_METRICS:
+            oops = ("Sorry, there's an error in your configuration:\n"
+                    "ADAPTIVE_METRIC should be one of {}".format(
+                        ", ".join(HARNESS_METRICS)))
+            sys.exit(oops)
+        self._prepare(runcfg)
+        self._warn_selected()
+        evaluate_adaptive(self)
+
+    def set_profile_keys(self, keys, mode=PROFILE_MODES[0]):
+        """Profile the evaluations with these keys (from the next
+        `load` on; see `irit_rst_dt.profiling`)
+        """
+        known = frozenset(e.key for e in EVALUATIONS)
+        unknown = [k for k in keys if k not in known]
+        if unknown:
+            oops = ("Sorry, I can't profile evaluations that aren't in "
+                    "your configuration:\n{}".format("\n".join(unknown)))
+            sys.exit(oops)
+        self.profile_keys = list(keys)
+        self.profile_mode = mode
+
+    def run_test_only(self, runcfg):
+        """Score the test evaluation on the test corpus, skipping
+        cross-validation (see `irit_rst_dt.testeval`)
+        """
+        if self.test_evaluation is None:
+            oops = ("Sorry, there's an error in your configuration:\n"
+                    "A test-only evaluation needs both TEST_CORPUS and "
+                    "TEST_EVALUATION_KEY to be set")
+            sys.exit(oops)
+        self._prepare(runcfg)
+        evaluate_test_only(self)
 
     # ------------------------------------------------------
     # local settings
@@ -62,7 +235,7 @@ class IritHarness(Harness):
 
     @property
     def evaluations(self):
-        return EVALUATIONS
+        return self._evaluations
 
     @property
     def detailed_evaluations(self):
@@ -103,11 +276,27 @@ class IritHarness(Harness):
         save_fold_dict(fold_dict, self.fold_file)
         return fold_dict
 
+    def fold_indices(self, mpack, fold_dict):
+        """
+        Sorted row indices (into the stacked multipack) of the
+        training and testing instances of each fold, computed on first
+        use (`irit-rst-dt featsel`) and cached next to the fold file.
+
+        See `irit_rst_dt.folds`
+        """
+        return cached_fold_indices(mpack, fold_dict, self.fold_index_file)
+
     # ------------------------------------------------------
     # paths
     # ------------------------------------------------------
 
-    def mpack_paths(self, test_data, stripped=False):
+    @property
+    def fold_index_file(self):
+        """Row indices for each fold (companion to the fold file)"""
+        return fp.splitext(self.fold_file)[0] + '.idx.npz'
+
+    def mpack_paths(self, test_data, stripped=False,
+                    selected=SELECTED_FEATURES):
         """
         Parameters
         ----------
@@ -115,6 +304,10 @@ class IritHarness(Harness):
             If true, the returned paths point to self.testset else to
             self.dataset.
 
+        selected: boolean
+            If true, and `irit-rst-dt select` has been run, the features
+            and vocabulary are the reduced ones
+
         Returns
         -------
         path_to_edu_input : string
@@ -127,6 +320,10 @@ class IritHarness(Harness):
 
         corpus_path : string
             Path to corpus in order to access gold structures (WIP).
+            attelo's reports read the `.dis` trees from there (for
+            constituency metrics such as `cspans`, the cached
+            dependency trees will not do). Our own scoring uses the
+            gold trees cached by gather instead (see `gold_cache`)
         """
         ext = 'relations.sparse'
         # path to data file in the evaluation dir
@@ -136,12 +333,46 @@ class IritHarness(Harness):
         corpus_path = fp.abspath(TEST_CORPUS if test_data
                                  else TRAINING_CORPUS)
         # end WIP
-        return (core_path + '.edu_input',
-                core_path + '.pairings',
-                (core_path + '.stripped') if stripped else core_path,
-                core_path + '.vocab',
+        # packed artefacts (COMPRESS_ARTEFACTS) are read from a
+        # text export on local disk
+        cache_dir = local_cache_dir(self.eval_dir, UNPACK_DIR)
+        if stripped:
+            features_path = core_path + '.stripped'
+            vocab_path = core_path + '.vocab'
+        elif selected and fp.exists(core_path + REDUCED_EXT):
+            features_path = core_path + REDUCED_EXT
+            vocab_path = features_path + '.vocab'
+        else:
+            features_path = core_path
+            vocab_path = core_path + '.vocab'
+        return (readable_path(core_path + '.edu_input', cache_dir),
+                readable_path(core_path + '.pairings', cache_dir),
+                readable_path(features_path, cache_dir),
+                vocab_path,
                 corpus_path)
 
+    def gold_cache(self, test_data):
+        """Gold structures for scoring, from the gold trees converted
+        by gather (if there are any)
+
+        Parameters
+        ----------
+        test_data: boolean
+            If true, for self.testset else for self.dataset
+
+        Returns
+        -------
+        gold_cache : GoldCache
+        """
+        path = self._gold_path(test_data)
+        return GoldCache(load_gold_trees(path) if fp.exists(path)
+                         else None)
+
+    def _gold_path(self, test_data):
+        "gold trees converted by gather, for self.testset or dataset"
+        dset = self.testset if test_data else self.dataset
+        return fp.join(self.eval_dir, dset + GOLD_EXT)
+
     def model_paths(self, rconf, fold, parser):
         """Paths to the learner(s) model(s).
 
@@ -167,7 +398,30 @@ class IritHarness(Harness):
         """
         parent_dir = (self.fold_dir_path(fold) if fold is not None
                       else self.combined_dir_path())
+        return self.model_paths_in(parent_dir, rconf, parser)
+
+    def model_paths_in(self, parent_dir, rconf, parser):
+        """Paths to the learner(s) model(s), within a given directory.
+
+        This is `model_paths` for models that do not belong to a
+        fold of the main evaluation (eg. repeated cross-validation).
+
+        Parameters
+        ----------
+        parent_dir : string
+            Directory the models live in
+
+        rconf : (IntraInterPair of) LearnerConfig
+            See `model_paths`
 
+        parser : parser (WIP)
+            See `model_paths`
+
+        Returns
+        -------
+        paths : dict from string to pathname
+            Mapping from learner description to model paths.
+        """
         def _eval_model_path(subconf, mtype):
             "Model for a given loop/eval config and fold"
             # basic filename for a model: bname
@@ -182,19 +436,15 @@ class IritHarness(Harness):
 
         if isinstance(rconf, IntraInterPair):
             # WIP
-            sel_inter = parser.payload._sel_inter
-            inter_prefixes = {
-                'global': '',
-                'inter': 'doc-',
-                'head_to_head': 'doc_head-',
-                'frontier_to_head': 'doc_frontier-',
-            }
+            prefix = INTER_PREFIXES[parser.payload._sel_inter]
             # end WIP
+            # intra models are shared by all the intra/inter parsers
+            # with the same learners (see `irit_rst_dt.sharing`)
             return {
                 'inter:attach': _eval_model_path(
-                    rconf.inter, inter_prefixes[sel_inter] + "attach"),
+                    rconf.inter, prefix + "attach"),
                 'inter:label': _eval_model_path(
-                    rconf.inter, inter_prefixes[sel_inter] + "relate"),
+                    rconf.inter, prefix + "relate"),
                 'intra:attach': _eval_model_path(
                     rconf.intra, "sent-attach"),
                 'intra:label': _eval_model_path(
@@ -224,6 +474,12 @@ class IritHarness(Harness):
                     "ERROR! -----------------^^^^^--------------------"
                     "").format("\n".join(bad_confs))
             sys.exit(oops)
+        if MAXENT_WARM_START and MAXENT_SOLVER == 'liblinear':
+            oops = ("Sorry, there's an error in your configuration:\n"
+                    "MAXENT_WARM_START needs a MAXENT_SOLVER that can be "
+                    "warm started (eg. 'sag', 'saga', 'lbfgs'), not "
+                    "'liblinear'")
+            sys.exit(oops)
         if TEST_EVALUATION_KEY is not None and TEST_CORPUS is None:
             oops = ("Sorry, there's an error in your configuration:\n"
                     "You have requested a test evaluation, but have not "
@@ -240,3 +496,4 @@ class IritHarness(Harness):
                     "ERROR! -----------------^^^^^--------------------"
                     "").format(TEST_EVALUATION_KEY)
             sys.exit(oops)
+
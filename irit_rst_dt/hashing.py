@@ -0,0 +1,189 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Hashing trick for gathered features
+
+Rather than handing the training vocabulary over to the test
+extraction, each corpus is extracted with its own vocabulary, and its
+features are then rewritten into a fixed-width space, by hashing the
+feature names. Training and test data end up in the same space without
+ever talking to each other (so they can be extracted in parallel), and
+the learners have a fixed width whatever the feature set.
+
+Labels still need to agree between the two: the test targets are
+renumbered against the training labels.
+"""
+
+from __future__ import print_function
+from collections import defaultdict
+import codecs
+import hashlib
+import json
+import os
+
+HASH_REPORT_EXT = '.hash-report'
+"""Extension (added to the features file) of the collision report"""
+
+HASH_INDEX_EXT = '.hash-index'
+"""Extension (added to the features file) of the reverse index"""
+
+
+def feature_slot(name, width):
+    """Column a feature name is hashed to (stable across runs and
+    Python versions, unlike `hash`)"""
+    digest = hashlib.md5(name.encode('utf-8')).hexdigest()
+    return int(digest[:15], 16) % width
+
+
+def read_vocab(path):
+    """Read a vocabulary file
+
+    Returns
+    -------
+    vocab : dict(int, string)
+        Feature names by column, as used in the features file
+
+    base : int
+        Smallest column number (0 or 1)
+    """
+    vocab = {}
+    with codecs.open(path, 'r', 'utf-8') as stream:
+        for lnum, line in enumerate(stream):
+            fields = line.rstrip('\n').split('\t')
+            idx = int(fields[1]) if len(fields) > 1 else lnum
+            vocab[idx] = fields[0]
+    return vocab, (min(vocab) if vocab else 0)
+
+
+def read_labels(features_path):
+    """Labels listed at the top of a features file (None if there is
+    no such list)"""
+    with codecs.open(features_path, 'r', 'utf-8') as stream:
+        line = stream.readline()
+    if line.startswith('#'):
+        seq = line[1:].split()
+        if seq and seq[0] == 'labels:':
+            return seq[1:]
+    return None
+
+
+def _slot_names(slots, width, reverse_index):
+    "names for the hashed columns (for reports on features)"
+    names = []
+    for slot in range(width):
+        feats = slots.get(slot, [])
+        if reverse_index and feats:
+            names.append('|'.join(sorted(feats)[:3]) +
+                         ('|...' if len(feats) > 3 else ''))
+        else:
+            names.append('hash:{}'.format(slot))
+    return names
+
+
+def collision_report(slots, nfeatures, width):
+    """Summary of how badly features collide
+
+    Parameters
+    ----------
+    slots : dict(int, list of string)
+        Feature names in each hashed column
+
+    nfeatures : int
+        Number of (distinct) features we hashed
+
+    width : int
+    """
+    crowded = [feats for feats in slots.values() if len(feats) > 1]
+    return {
+        'width': width,
+        'features': nfeatures,
+        'columns_used': len(slots),
+        'columns_with_collisions': len(crowded),
+        'colliding_features': sum(len(f) for f in crowded),
+        'max_features_per_column': max([len(f) for f in slots.values()]
+                                       or [0]),
+    }
+
+
+def hash_features(features_path, width, labels=None, reverse_index=False):
+    """Rewrite a features file (and its vocabulary) into a hashed
+    feature space, in place
+
+    Features that land in the same column are summed.
+
+    Parameters
+    ----------
+    features_path : string
+        svmlight features file (the vocabulary is expected next to it,
+        with a `.vocab` extension)
+
+    width : int
+        Number of columns of the hashed space
+
+    labels : list of string, optional
+        Reference labels (eg. from the training data); if given, the
+        targets are renumbered against them (labels they don't know
+        become unknown, ie. 0)
+
+    reverse_index : bool
+        Write the list of features that land in each column (only
+        needed for the discriminating features report)
+
+    Returns
+    -------
+    report : dict
+        Collision report (see `collision_report`), also written next to
+        the features file
+    """
+    vocab_path = features_path + '.vocab'
+    vocab, base = read_vocab(vocab_path)
+    slots = defaultdict(list)
+    col_map = {}
+    for idx, name in vocab.items():
+        slot = feature_slot(name, width)
+        col_map[idx] = slot + base
+        slots[slot].append(name)
+
+    own_labels = read_labels(features_path) or []
+    if labels is None:
+        labels = own_labels
+    label_map = dict((i + 1, labels.index(l) + 1 if l in labels else 0)
+                     for i, l in enumerate(own_labels))
+
+    tmp_path = features_path + '.tmp'
+    with codecs.open(features_path, 'r', 'utf-8') as istream,\
+            codecs.open(tmp_path, 'w', 'utf-8') as ostream:
+        for line in istream:
+            if line.startswith('#'):
+                if line[1:].split()[:1] == ['labels:']:
+                    line = '# labels: ' + ' '.join(labels) + '\n'
+                ostream.write(line)
+                continue
+            fields = line.split()
+            if not fields:
+                continue
+            target = int(fields[0])
+            row = defaultdict(float)
+            for field in fields[1:]:
+                col, val = field.split(':')
+                row[col_map[int(col)]] += float(val)
+            ostream.write(' '.join(
+                [str(label_map.get(target, target))] +
+                ['{}:{:g}'.format(c, row[c]) for c in sorted(row)]) + '\n')
+    os.rename(tmp_path, features_path)
+
+    with codecs.open(vocab_path, 'w', 'utf-8') as stream:
+        for slot, name in enumerate(_slot_names(slots, width,
+                                                reverse_index)):
+            print(u'{}\t{}'.format(name, slot + base), file=stream)
+    if reverse_index:
+        with codecs.open(features_path + HASH_INDEX_EXT, 'w',
+                         'utf-8') as stream:
+            for slot in sorted(slots):
+                print(u'\t'.join([str(slot + base)] + sorted(slots[slot])),
+                      file=stream)
+    report = collision_report(slots, len(vocab), width)
+    with open(features_path + HASH_REPORT_EXT, 'w') as stream:
+        json.dump(report, stream, indent=2, sort_keys=True)
+    return report
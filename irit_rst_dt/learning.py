@@ -0,0 +1,333 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Learner wrappers used by our configurations
+"""
+
+from __future__ import print_function
+from os import path as fp
+import hashlib
+import os
+import shutil
+import tempfile
+import uuid
+
+import joblib
+import numpy as np
+
+from attelo.learning.interface import (LabelClassifier)
+from sklearn.base import (BaseEstimator, ClassifierMixin)
+from sklearn.decomposition import (TruncatedSVD)
+from sklearn.linear_model import (LogisticRegression)
+from sklearn.random_projection import (SparseRandomProjection)
+
+
+def doc_key(dpack):
+    """Identifier for the contents of a datapack (its pairings)"""
+    digest = hashlib.md5()
+    for edu1, edu2 in dpack.pairings:
+        digest.update((edu1.id + '\t' + edu2.id + '\n').encode('utf-8'))
+    return digest.hexdigest()
+
+
+def pack_key(dpack):
+    """Cheap identifier for a datapack within a process (its first and
+    last EDU, and size; the EDUs tell apart the sentence-level subpacks
+    of a document): good enough for in-memory caches, where `doc_key`
+    would cost more than what we are caching; use `doc_key` for
+    anything stored on disk"""
+    return (dpack.edus[0].id, dpack.edus[-1].id,
+            len(dpack.edus), len(dpack.pairings))
+
+
+class Wrapper(object):
+    """
+    Base class for wrappers: anything the wrapper does not define
+    itself is looked up on the wrapped object
+
+    Parameters
+    ----------
+    inner : object
+        The wrapped parser or learner
+    """
+    def __init__(self, inner):
+        self._inner = inner
+
+    def __getattr__(self, name):
+        # delegate anything we don't know about to the wrapped object
+        # (careful: this is called during unpickling too)
+        if name.startswith('__') or name == '_inner':
+            raise AttributeError(name)
+        return getattr(self._inner, name)
+
+
+class ParserWrapper(Wrapper):
+    """
+    Base class for parser wrappers, which by default fit and
+    transform with the real parser
+
+    Parameters
+    ----------
+    parser : Parser
+    """
+    def fit(self, dpacks, targets, cache=None):
+        "see the real parser"
+        self._inner.fit(dpacks, targets, cache=cache)
+        return self
+
+    def transform(self, dpack):
+        "see the real parser"
+        return self._inner.transform(dpack)
+
+
+class SharedLabelClassifier(Wrapper, LabelClassifier):
+    """
+    Label classifier that computes the label score matrix of each
+    document at most once per fitted model, and shares it with every
+    pipeline using the same model.
+
+    The joint and post-labelling pipelines of a learner both score
+    labels with the same label model on the same documents; they just
+    do it in different processes. Each fitted model gets a token (saved
+    along with the model, so it survives the model cache), and score
+    matrices are stored on disk under that token. Fitting again removes
+    those of the previous model (eg. the previous fold): another
+    pipeline still using it would just compute its scores again. This
+    is a cache: if reading or writing a score file fails, we compute
+    the scores ourselves.
+
+    Parameters
+    ----------
+    learner : LabelClassifier
+        The classifier doing the actual work
+
+    cache_dir : string, optional
+        Where to store score matrices (can be set later, eg. by the
+        harness once it knows the scratch directory); defaults to the
+        system temporary directory
+    """
+    def __init__(self, learner, cache_dir=None):
+        super(SharedLabelClassifier, self).__init__(learner)
+        self.cache_dir = cache_dir
+        self._token = None
+
+    @property
+    def can_predict_proba(self):
+        "same as the real learner"
+        return self._inner.can_predict_proba
+
+    def fit(self, dpacks, targets):
+        self._inner.fit(dpacks, targets)
+        if self._token is not None:
+            shutil.rmtree(self._token_dir(), ignore_errors=True)
+        self._token = uuid.uuid4().hex
+        return self
+
+    def _token_dir(self):
+        "where to cache the scores of the current model"
+        parent = self.cache_dir or fp.join(tempfile.gettempdir(),
+                                           'irit-rst-dt-label-scores')
+        return fp.join(parent, self._token)
+
+    def predict_score(self, dpack):
+        if self._token is None:
+            # not fitted by us (eg. loaded from an old model)
+            return self._inner.predict_score(dpack)
+        path = fp.join(self._token_dir(), doc_key(dpack) + '.npy')
+        try:
+            scores = np.load(path)
+            if scores.shape[0] == len(dpack.pairings):
+                return scores
+        except (IOError, OSError, ValueError):
+            pass  # not there (yet, or any more)
+        scores = self._inner.predict_score(dpack)
+        # write then rename, in case another pipeline is reading
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            if not fp.isdir(fp.dirname(path)):
+                os.makedirs(fp.dirname(path))
+            with open(tmp_path, 'wb') as stream:
+                np.save(stream, scores)
+            os.rename(tmp_path, path)
+        except OSError:
+            pass  # eg. removed under our feet; others can compute it
+        return scores
+
+
+class WarmStartLogisticRegression(LogisticRegression):
+    """
+    Logistic regression that starts each fit from the weights of a
+    model saved on disk, if that model is compatible with the new data
+    (same classes, same number of features).
+
+    When fitting the combined model of a learner and task, the harness
+    points `init_path` at the model of the first fold (see
+    `WarmStartParser`): it mostly shares its training data, and being
+    on disk, it is the same starting point in every process (unlike
+    the previous fit of whatever process the fold happens to run in).
+    Fold models start from scratch. If there is no first fold model
+    yet, neither does the combined one.
+
+    Construct with `warm_start=True` and a solver that supports it
+    (ie. not liblinear), otherwise this is plain `LogisticRegression`.
+
+    Attributes
+    ----------
+    init_path : string or None
+        Saved model to start from
+    """
+    init_path = None
+
+    def fit(self, X, y, sample_weight=None):
+        # never carry weights over from a previous fit in this process
+        for attr in ['coef_', 'intercept_']:
+            if attr in self.__dict__:
+                delattr(self, attr)
+        init = _saved_solution(self.init_path) if self.warm_start\
+            else None
+        if init is not None and\
+                init.coef_.shape[1] == X.shape[1] and\
+                np.array_equal(np.unique(y), init.classes_):
+            self.coef_ = init.coef_.copy()
+            self.intercept_ = init.intercept_.copy()
+        return super(WarmStartLogisticRegression, self).fit(
+            X, y, sample_weight=sample_weight)
+
+
+_SAVED_SOLUTIONS = {}
+"""Per process cache of `_saved_solution` (by path and mtime)"""
+
+
+def _fitted_regression(obj, depth=3):
+    "the fitted logistic regression inside a (wrapped) model, if any"
+    if isinstance(obj, LogisticRegression) and hasattr(obj, 'coef_'):
+        return obj
+    if depth and hasattr(obj, '__dict__'):
+        for value in vars(obj).values():
+            found = _fitted_regression(value, depth - 1)
+            if found is not None:
+                return found
+    return None
+
+
+def _saved_solution(path):
+    """Fitted logistic regression in a model file (None if there is
+    no such file or no such regression in it)"""
+    if path is None or not fp.exists(path):
+        return None
+    key = (path, fp.getmtime(path))
+    if key not in _SAVED_SOLUTIONS:
+        _SAVED_SOLUTIONS[key] = _fitted_regression(joblib.load(path))
+    return _SAVED_SOLUTIONS[key]
+
+
+class WarmStartParser(ParserWrapper):
+    """
+    Parser wrapper pointing its warm started estimators (see
+    `WarmStartLogisticRegression`) at a saved model when fitting the
+    combined models, and nowhere otherwise
+
+    Fold models are scored on their test part, and anything we could
+    start them from (the combined model, another fold's model) has
+    been fitted on it, so they start from scratch.
+
+    Parameters
+    ----------
+    parser : Parser
+
+    init_paths : list of (WarmStartLogisticRegression, string)
+        Model to start each estimator from
+
+    combined_paths : set of string
+        Model paths (cache values) of the combined fit
+    """
+    def __init__(self, parser, init_paths, combined_paths):
+        super(WarmStartParser, self).__init__(parser)
+        self.init_paths = init_paths
+        self.combined_paths = frozenset(combined_paths)
+
+    def fit(self, dpacks, targets, cache=None):
+        "fit the real parser, warm starting only the combined models"
+        combined = bool(self.combined_paths &
+                        frozenset((cache or {}).values()))
+        # the estimators may be shared with other parsers, so we set
+        # them up for every fit
+        for est, path in self.init_paths:
+            est.init_path = path if combined else None
+        self._inner.fit(dpacks, targets, cache=cache)
+        return self
+
+
+def warm_start_estimators(obj, depth=3):
+    """The `WarmStartLogisticRegression` instances inside a (wrapped)
+    learner"""
+    if isinstance(obj, WarmStartLogisticRegression):
+        return [obj]
+    found = []
+    if depth and hasattr(obj, '__dict__'):
+        for value in vars(obj).values():
+            found.extend(warm_start_estimators(value, depth - 1))
+    return found
+
+
+class ProjectedEstimator(BaseEstimator, ClassifierMixin):
+    """
+    Wrap a scikit estimator so that it is fit on a dense, low-rank
+    projection of our sparse features.
+
+    Tree learners are hopeless on hundreds of thousands of sparse
+    columns, but fine on a few hundred dense ones. The projection is
+    fit on the training data (ie. per fold) and kept as part of the
+    estimator, so it is saved and reloaded along with the model.
+
+    Parameters
+    ----------
+    estimator : scikit estimator
+        The estimator doing the actual work
+
+    n_components : int
+        Dimension of the projected features (capped by the number of
+        features)
+
+    method : string
+        'svd' (truncated SVD, slower to fit but keeps more of the
+        signal) or 'random' (sparse random projection)
+
+    random_state : int, optional
+    """
+    def __init__(self, estimator, n_components=200, method='svd',
+                 random_state=None):
+        self.estimator = estimator
+        self.n_components = n_components
+        self.method = method
+        self.random_state = random_state
+
+    def _projector(self, n_features):
+        "fresh (unfitted) projection for this many features"
+        n_components = min(self.n_components, max(n_features - 1, 1))
+        if self.method == 'svd':
+            return TruncatedSVD(n_components=n_components,
+                                random_state=self.random_state)
+        elif self.method == 'random':
+            return SparseRandomProjection(n_components=n_components,
+                                          dense_output=True,
+                                          random_state=self.random_state)
+        else:
+            raise ValueError("'method' should be one of svd/random: " +
+                             self.method)
+
+    def fit(self, X, y):
+        "fit the projection, then the wrapped estimator on its output"
+        self.projector_ = self._projector(X.shape[1])
+        self.estimator.fit(self.projector_.fit_transform(X), y)
+        self.classes_ = self.estimator.classes_
+        return self
+
+    def predict(self, X):
+        "see wrapped estimator"
+        return self.estimator.predict(self.projector_.transform(X))
+
+    def predict_proba(self, X):
+        "see wrapped estimator"
+        return self.estimator.predict_proba(self.projector_.transform(X))
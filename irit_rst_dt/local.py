@@ -13,10 +13,6 @@ import itertools as itr
 
 from attelo.harness.config import (LearnerConfig,
                                    Keyed)
-# from attelo.decoding.astar import (AstarArgs,
-#                                    AstarDecoder,
-#                                    Heuristic,
-#                                    RfcConstraint)
 from attelo.decoding.eisner import EisnerDecoder
 from attelo.decoding.mst import (MstDecoder, MstRootStrategy)
 from attelo.learning.local import (SklearnAttachClassifier,
@@ -32,7 +28,11 @@ from sklearn.tree import DecisionTreeClassifier
 from sklearn.ensemble import RandomForestClassifier
 
 
+from .decoding import (BudgetAstarDecoder)
+from .learning import (ProjectedEstimator,
+                       WarmStartLogisticRegression)
 from .config.intra import (combine_intra)
+from .featsel import (SelectedFeaturesEstimator)
 from .config.perceptron import (attach_learner_dp_pa,
                                 attach_learner_dp_perc,
                                 attach_learner_dp_struct_pa,
@@ -49,7 +49,9 @@ from .config.common import (ORACLE,
                             decoder_last,
                             decoder_local,
                             mk_joint,
-                            mk_post)
+                            mk_post,
+                            share_label_scores)
+from .oracle import (mk_gold_oracle)
 
 # PATHS
 
@@ -126,6 +128,75 @@ FEATURE_SET = 'dev'  # one of ['dev', 'eyk', 'li2014']
 Which feature set to use for feature extraction
 """
 
+FEATURE_HASH_WIDTH = None
+# FEATURE_HASH_WIDTH = 2 ** 18
+"""
+If set, hash the features of FEATURE_SET into this many columns
+(see `irit_rst_dt.hashing`). This bounds the width of our models
+whatever the feature set, and lets gather extract the training and
+test data in parallel (no vocabulary hand-off). A collision report is
+written next to each features file.
+"""
+
+HASH_REVERSE_INDEX = True
+"""
+With feature hashing, keep track of which features land in each
+column (only used to name columns in the discriminating features
+report)
+"""
+
+COMPRESS_ARTEFACTS = False
+"""
+Store the gathered features, pairings and EDU inputs (and the
+predictions of our own pipelines) as compressed block files (see
+`irit_rst_dt.storage`) instead of plain text.
+
+Text versions are exported on demand to UNPACK_DIR; use
+`irit-rst-dt export` if you want to look at them yourself.
+
+The per-fold predictions (`fold-N/output.*`) stay in plain text:
+attelo's fold loop writes them and its reports read them back.
+"""
+
+UNPACK_DIR = None
+"""
+Where to export text versions of compressed artefacts when we need
+to read them (None for the system temporary directory, which is
+usually on a local disk). Each process exports to its own
+subdirectory, which it removes when it exits
+"""
+
+SELECT_MIN_COUNT = 2
+"""
+Feature selection (`irit-rst-dt select`): drop features that fire
+on fewer training pairs than this
+"""
+
+SELECT_SCORE = 'chi2'  # one of ['chi2', 'mi', None]
+"""
+Feature selection: how to rank the features against the attachment
+and labelling targets (None to select on counts alone)
+"""
+
+SELECT_K = None
+# SELECT_K = 50000
+"""
+Feature selection: how many of the best ranked features to keep per
+fold and task (None for all of those that pass SELECT_MIN_COUNT)
+"""
+
+SELECTED_FEATURES = False
+"""
+Evaluate on the reduced feature matrices written by
+`irit-rst-dt select` (if they're there) rather than on the full ones.
+
+Their features are selected on all the training data, test folds
+included, so cross-validation scores on them are optimistic (fine for
+the test corpus though). For cross-validation, leave this off and use
+the `-sel` learners instead, which select within each training fold
+(see `attach_learner_maxent_sel`)
+"""
+
 FIXED_FOLD_FILE = None
 # FIXED_FOLD_FILE = 'folds-TRAINING.json'
 """
@@ -137,6 +208,77 @@ and even across different runs of gather.
 NB. It's up to you to ensure that the folds file makes sense
 """
 
+REPEATED_CV_SEEDS = [1, 2, 3, 4, 5]
+"""
+Seeds for the fold assignments of repeated cross-validation
+(`irit-rst-dt evaluate --repeated`); one full cross-validation is
+run for each seed, and we report the mean and a confidence interval
+over seeds.
+"""
+
+REPEATED_CV_FOLDS = 10
+"""
+Number of folds for each round of repeated cross-validation
+"""
+
+ADAPTIVE_METRIC = 'edges_by_label'
+"""
+Adaptive evaluation (`irit-rst-dt evaluate --adaptive`): metric (from
+`irit_rst_dt.score.HARNESS_METRICS`) on which evaluations are ranked
+after each round
+"""
+
+ADAPTIVE_MIN_FOLDS = 2
+"""
+Adaptive evaluation: number of folds in the first round (it doubles
+each round after that)
+"""
+
+ADAPTIVE_DROP = 0.5
+"""
+Adaptive evaluation: fraction of the evaluations to eliminate after
+each round
+"""
+
+
+MAXENT_SOLVER = 'liblinear'
+"""
+Solver for the maxent learners. 'liblinear' is the historical default;
+'sag', 'saga' or 'lbfgs' tend to converge faster on our sparse,
+high-dimensional features, and can be warm started
+"""
+
+MAXENT_TOL = 1e-4
+"""
+Stopping tolerance for the maxent solver
+"""
+
+MAXENT_WARM_START = False
+"""
+Start each combined maxent fit from the weights of the first fold's
+model (fitted on most of the same data), if it is already on disk;
+otherwise start from scratch. Fold models always start from scratch:
+anything else has seen their test data. Needs a MAXENT_SOLVER other
+than 'liblinear'
+"""
+
+PROJECTION_METHOD = 'svd'  # one of ['svd', 'random']
+"""
+How the tree learners (`*_rndforest_proj`) project our sparse
+features down to dense ones
+"""
+
+PROJECTION_DIM = 200
+"""
+Dimension of the dense features the tree learners see
+"""
+
+TREE_N_JOBS = 1
+"""
+Number of trees the random forests build in parallel. Each fold
+already runs in its own process (`--n-jobs`), so only raise this if
+you are running fewer folds at once than you have cores
+"""
 
 DECODER_LOCAL = decoder_local(0.2)
 "local decoder should accept above this score"
@@ -147,24 +289,100 @@ def decoder_eisner():
     return Keyed('eisner', EisnerDecoder(use_prob=True))
 
 
+ASTAR_RFC = True
+"""A* decoder: right frontier constraint, ie. projective trees with arcs
+either way (if False, heads always come before their dependents)"""
+
+ASTAR_MAX_EXPANSIONS = 20000
+"""A* decoder: search states expanded per document before giving up
+and decoding with Eisner instead (None for no limit); A* is rarely
+exact on documents of more than 20 EDUs, see `irit_rst_dt.decoding`"""
+
+ASTAR_MAX_SECONDS = 1.
+"""A* decoder: seconds per document before giving up and decoding
+with Eisner instead (None for no limit)"""
+
+
+def decoder_astar(unique_real_root=True, use_prob=True):
+    """our instantiation of the (budgeted) A* decoder, see
+    `irit_rst_dt.decoding`"""
+    return Keyed('astar',
+                 BudgetAstarDecoder(rfc=ASTAR_RFC,
+                                    max_expansions=ASTAR_MAX_EXPANSIONS,
+                                    max_seconds=ASTAR_MAX_SECONDS,
+                                    unique_real_root=unique_real_root,
+                                    use_prob=use_prob))
+
+
 def decoder_mst():
     "our instantiation of the mst decoder"
     return Keyed('mst', MstDecoder(MstRootStrategy.fake_root,
                                    use_prob=True))
 
 
+def _maxent():
+    "maxent estimator, with the solver settings above"
+    if MAXENT_WARM_START:
+        return WarmStartLogisticRegression(solver=MAXENT_SOLVER,
+                                           tol=MAXENT_TOL,
+                                           warm_start=True,
+                                           n_jobs=1)
+    return LogisticRegression(solver=MAXENT_SOLVER,
+                              tol=MAXENT_TOL,
+                              n_jobs=1)
+
+
 def attach_learner_maxent():
     "return a keyed instance of maxent learner"
     return Keyed('maxent',
-                 SklearnAttachClassifier(LogisticRegression(
-                     n_jobs=1)))
+                 SklearnAttachClassifier(_maxent()))
 
 
 def label_learner_maxent():
     "return a keyed instance of maxent learner"
     return Keyed('maxent',
-                 SklearnLabelClassifier(LogisticRegression(
-                     n_jobs=1)))
+                 SklearnLabelClassifier(_maxent()))
+
+
+def _selected(estimator):
+    "estimator that only sees the features selected on its training data"
+    return SelectedFeaturesEstimator(estimator,
+                                     min_count=SELECT_MIN_COUNT,
+                                     k=SELECT_K,
+                                     score=SELECT_SCORE)
+
+
+def attach_learner_maxent_sel():
+    "maxent learner with feature selection on each training fold"
+    return Keyed('maxent-sel',
+                 SklearnAttachClassifier(_selected(_maxent())))
+
+
+def label_learner_maxent_sel():
+    "maxent learner with feature selection on each training fold"
+    return Keyed('maxent-sel',
+                 SklearnLabelClassifier(_selected(_maxent())))
+
+
+def _projected(estimator):
+    "estimator fed with a dense projection of the features"
+    return ProjectedEstimator(estimator,
+                              n_components=PROJECTION_DIM,
+                              method=PROJECTION_METHOD)
+
+
+def attach_learner_rndforest_proj():
+    "random forest learner on projected features"
+    return Keyed('rndforest-' + PROJECTION_METHOD + str(PROJECTION_DIM),
+                 SklearnAttachClassifier(_projected(RandomForestClassifier(
+                     n_estimators=100, n_jobs=TREE_N_JOBS))))
+
+
+def label_learner_rndforest_proj():
+    "random forest learner on projected features"
+    return Keyed('rndforest-' + PROJECTION_METHOD + str(PROJECTION_DIM),
+                 SklearnLabelClassifier(_projected(RandomForestClassifier(
+                     n_estimators=100, n_jobs=TREE_N_JOBS))))
 
 
 def attach_learner_dectree():
@@ -199,8 +417,12 @@ _LOCAL_LEARNERS = [
                   label=label_learner_maxent()),
     #    LearnerConfig(attach=attach_learner_maxent(),
     #                  label=label_learner_oracle()),
+    #    LearnerConfig(attach=attach_learner_maxent_sel(),
+    #                  label=label_learner_maxent_sel()),
     #    LearnerConfig(attach=attach_learner_rndforest(),
     #                  label=label_learner_rndforest()),
+    #    LearnerConfig(attach=attach_learner_rndforest_proj(),
+    #                  label=label_learner_rndforest_proj()),
     #    LearnerConfig(attach=attach_learner_perc(),
     #                  label=label_learner_maxent()),
     #    LearnerConfig(attach=attach_learner_pa(),
@@ -235,9 +457,23 @@ We assume that they cannot be used relation modelling
 """
 
 
+SHARE_LABEL_SCORES = False
+"""
+Have the joint and post-labelling parsers of a learner score the labels
+of each document once, and share the scores through files in the
+scratch directory (a float64 pairings x labels matrix per document,
+fold and label model; those of a fold are removed once the label model
+is fitted again, the rest at the end of the evaluation). Measure the
+disk this takes on your corpus before turning it on
+"""
+
+
 def _core_parsers(klearner, unique_real_root=True):
     """Our basic parser configurations
     """
+    if SHARE_LABEL_SCORES:
+        # joint and post-labelling parsers share their label scores
+        klearner = share_label_scores(klearner)
     # joint
     if ((not klearner.attach.payload.can_predict_proba or
          not klearner.label.payload.can_predict_proba)):
@@ -251,6 +487,8 @@ def _core_parsers(klearner, unique_real_root=True):
                 Keyed('eisner',
                       EisnerDecoder(unique_real_root=unique_real_root,
                                     use_prob=True)),
+                # (compare with eisner in `irit-rst-dt bench` first)
+                # decoder_astar(unique_real_root=unique_real_root),
             ]
         ]
 
@@ -264,12 +502,17 @@ def _core_parsers(klearner, unique_real_root=True):
             Keyed('eisner',
                   EisnerDecoder(unique_real_root=unique_real_root,
                                 use_prob=use_prob)),
+            # decoder_astar(unique_real_root=unique_real_root,
+            #               use_prob=use_prob),
         ]
     ]
 
     return joint + post
 
 
+# configs with the same learners share their models (the intra models,
+# and the inter ones for each sel_inter mode; see irit_rst_dt.sharing),
+# so extra configs here mostly cost decoding time
 _INTRA_INTER_CONFIGS = [
 #    Keyed('ifrontier-inter', (FrontierToHeadParser, 'inter')),
 #    Keyed('ifrontier-head_to_head', (FrontierToHeadParser, 'head_to_head')),
@@ -284,6 +527,13 @@ _INTRA_INTER_CONFIGS = [
 ]
 
 
+GOLD_ORACLES = True
+"""Add upper bounds (gold oracles) to the evaluations. Unlike the
+attelo oracles (see `_is_junk`), these predict the gold structures
+directly, without any model or decoder, so they cost next to nothing;
+see `irit_rst_dt.oracle`"""
+
+
 _VERBOSE_INTRA_INTER = False
 """Toggle verbosity for intra/inter parsers ; if True, lost and hallucinated
 edges will be printed to stdout"""
@@ -434,8 +684,12 @@ def _evaluations():
                   for p, kconf
                   in itr.product(ii_pairs, _INTRA_INTER_CONFIGS)]
     res.extend(ii_parsers)
+    res = [x for x in res if not _is_junk(x)]
 
-    return [x for x in res if not _is_junk(x)]
+    # == upper bounds, straight from the gold ==
+    if GOLD_ORACLES:
+        res.extend(mk_gold_oracle(intra_only=x) for x in [False, True])
+    return res
 
 
 EVALUATIONS = _evaluations()
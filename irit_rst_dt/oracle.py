@@ -0,0 +1,108 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Gold oracles, without the learning machinery
+
+The attelo oracles (`ORACLE`, `ORACLE_INTER`) are learners: they go
+through the usual pipelines, save model files, build probability
+matrices from the gold and run the decoders over them, which costs as
+much as a real evaluation per decoder and per intra/inter combination.
+That is why `_is_junk` leaves them out.
+
+The parsers here predict the gold structure directly, from the gold
+structures we use for scoring (the gold trees converted by gather if
+the harness found them, see `irit_rst_dt.score.GoldCache`). There is
+nothing to fit and nothing saved. Each gives an upper bound that does
+not depend on any learner, so we only need one evaluation of each:
+
+* `oracle-gold`: every gold edge among the candidate pairings
+* `oracle-gold_intra`: only the intrasentential gold edges (and
+  attachments to the root), ie. what a perfect intrasentential parser
+  contributes to an intra/inter parser
+
+The intrasentential half is computed once per document and shared by
+all the oracle parsers in a process.
+"""
+
+from __future__ import print_function
+
+import numpy as np
+
+from attelo.harness.config import (EvaluationConfig, Keyed)
+from attelo.table import (FAKE_ROOT_ID, UNRELATED, Graph)
+
+from .config.common import (ORACLE, Settings, combined_key)
+from .learning import (pack_key)
+
+_INTRA_MASKS = {}
+"""Per process cache of `intra_mask` (by `pack_key`)"""
+
+
+def intra_mask(dpack):
+    """For each pairing of a datapack, true if it is intrasentential
+    (both EDUs in the same sentence, or an attachment to the root)"""
+    key = pack_key(dpack)
+    if key not in _INTRA_MASKS:
+        _INTRA_MASKS[key] = np.array(
+            [e1.id == FAKE_ROOT_ID or e1.subgrouping == e2.subgrouping
+             for e1, e2 in dpack.pairings], dtype=bool)
+    return _INTRA_MASKS[key]
+
+
+class GoldOracleParser(object):
+    """
+    Parser predicting the gold structure of each document, with no
+    models and no decoding
+
+    Parameters
+    ----------
+    intra_only : bool
+        Keep only the intrasentential gold edges
+
+    Attributes
+    ----------
+    gold_cache : GoldCache or None
+        Where to get the gold structures from (set by the harness);
+        if None, we use the targets of the datapacks
+    """
+    def __init__(self, intra_only=False):
+        self.intra_only = intra_only
+        self.gold_cache = None
+
+    def fit(self, dpacks, targets, cache=None):
+        "nothing to learn (and no models to save)"
+        return self
+
+    def _gold_labels(self, dpack):
+        "gold label of each pairing, and the unrelated label"
+        if self.gold_cache is None:
+            return (np.asarray(dpack.target),
+                    dpack.label_number(UNRELATED))
+        skel, gold = self.gold_cache.get(dpack)
+        return gold.labels, skel.unrelated
+
+    def transform(self, dpack):
+        "decode a datapack to its gold structure"
+        labels, unrelated = self._gold_labels(dpack)
+        if self.intra_only:
+            labels = np.where(intra_mask(dpack), labels, unrelated)
+        attached = labels != unrelated
+        label_scores = np.zeros((len(labels), len(dpack.labels) + 1))
+        label_scores[np.arange(len(labels)), labels] = 1.
+        return dpack.set_graph(Graph(prediction=labels,
+                                     attach=attached.astype(float),
+                                     label=label_scores))
+
+
+def mk_gold_oracle(intra_only=False):
+    "return an evaluation config for a gold oracle parser"
+    settings = Settings(key='gold_intra' if intra_only else 'gold',
+                        intra=False,
+                        oracle=True,
+                        children=None)
+    parser = Keyed(settings.key, GoldOracleParser(intra_only=intra_only))
+    return EvaluationConfig(key=combined_key(ORACLE, settings),
+                            settings=settings,
+                            learner=ORACLE,
+                            parser=parser)
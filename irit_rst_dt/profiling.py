@@ -0,0 +1,302 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Profiling selected evaluations (`irit-rst-dt evaluate --profile`)
+
+The parser of each selected evaluation is wrapped so that its `fit`
+and `transform` calls (ie. feature handling, learning and decoding)
+run under one of two profilers (`--profile-mode`):
+
+* cprofile: saved as `<key>.<fold>.<fit|decode>.prof` (for pstats,
+  snakeviz...), along with collapsed stacks worked out from the call
+  graph (see below)
+* sample: a stack sampler, saved as
+  `<key>.<fold>.<fit|decode>.collapsed` only
+
+Collapsed stack files have one line per distinct stack with its
+weight, which is what flamegraph tools (eg. `flamegraph.pl`,
+speedscope) read. The sampler counts samples. cProfile only knows
+the time spent in each function for each of its callers, so we
+spread that over the stacks leading to the caller in proportion to
+their time (in microseconds): the shape is right, but a function
+called from several places may show more time on some path than it
+really spent there. Running both profilers at once would only
+measure the sampler measuring cProfile.
+
+Fitting profiles are written when the fit is done. Decoding profiles
+accumulate over all the documents a process decodes for a fold, and
+are written after each document (so that we have them even if attelo
+terminates its decoding pool). attelo may decode in several worker
+processes, so the decoding profiles have the process id in their
+name (`<key>.<fold>.decode.<pid>.<ext>`): `pstats.Stats` takes
+several files, and collapsed stack files can just be concatenated.
+
+Other evaluations are left untouched.
+"""
+
+from __future__ import print_function
+from collections import Counter, defaultdict
+from os import path as fp
+import cProfile
+import os
+import pstats
+import re
+import signal
+
+from .learning import (ParserWrapper)
+
+PROFILE_MODES = ['cprofile', 'sample']
+"""Kinds of profile we can take (the first is the default)"""
+
+SAMPLE_INTERVAL = 0.005
+"""Seconds between stack samples (CPU time)"""
+
+COLLAPSED_MIN_SHARE = 0.0001
+"""cProfile collapsed stacks: leave out stacks with less than this
+share of the total time"""
+
+_FOLD_RE = re.compile(r'fold-(\d+)')
+
+_DECODE_PROFILES = {}
+"""Decoding profilers of this process for the current fold (by path,
+without the extension)"""
+
+
+class StackSampler(object):
+    """
+    Sample the Python stack of the main thread at regular (CPU time)
+    intervals
+
+    Works only in the main thread of a process (we use a profiling
+    timer signal); elsewhere it silently collects nothing.
+    """
+    ext = 'collapsed'
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self._old_handler = None
+
+    def _sample(self, _, frame):
+        "signal handler: record the current stack"
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append('{}:{}'.format(
+                fp.basename(code.co_filename), code.co_name))
+            frame = frame.f_back
+        self.stacks[';'.join(reversed(names))] += 1
+
+    def enable(self):
+        "start sampling"
+        try:
+            self._old_handler = signal.signal(signal.SIGPROF,
+                                              self._sample)
+        except ValueError:  # not in the main thread
+            return
+        signal.setitimer(signal.ITIMER_PROF,
+                         self.interval, self.interval)
+
+    def disable(self):
+        "stop sampling"
+        if self._old_handler is not None:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, self._old_handler)
+            self._old_handler = None
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *_):
+        self.disable()
+
+    def save(self, stem):
+        "write the samples in collapsed stack format"
+        _write_collapsed(self.stacks, '.'.join([stem, self.ext]))
+
+
+def _write_collapsed(stacks, path):
+    "write stack weights in collapsed stack format (atomically)"
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as stream:
+        for stack, count in sorted(stacks.items()):
+            print(stack, count, file=stream)
+    os.rename(tmp_path, path)
+
+
+def _func_name(func):
+    "name of a pstats function key, as `StackSampler` would put it"
+    filename, _, name = func
+    return '{}:{}'.format(fp.basename(filename), name)
+
+
+def collapsed_stacks(stats):
+    """Approximate collapsed stacks from cProfile statistics (see
+    module docstring)
+
+    Parameters
+    ----------
+    stats : pstats.Stats
+
+    Returns
+    -------
+    stacks : Counter(string, int)
+        Microseconds spent in the last function of each stack
+    """
+    children = defaultdict(list)
+    roots = []
+    for func, (_, _, _, cumtime, callers) in stats.stats.items():
+        if not callers:
+            roots.append((func, cumtime))
+        for caller, edge in callers.items():
+            # (cc, nc, tt, ct) of func when called from caller
+            children[caller].append((func, edge[3]))
+    total = sum(t for _, t in roots)
+    stacks = Counter()
+    if not total:
+        return stacks
+    threshold = total * COLLAPSED_MIN_SHARE
+    todo = [((func,), cumtime) for func, cumtime in roots]
+    while todo:
+        path, spent = todo.pop()
+        func = path[-1]
+        _, _, own, cumtime, _ = stats.stats[func]
+        share = spent / cumtime if cumtime else 0.
+        rest = spent * own / cumtime if cumtime else spent
+        for callee, edge_time in children[func]:
+            if callee in path:  # recursion: count it where it is
+                rest += edge_time * share
+            elif edge_time * share >= threshold:
+                todo.append((path + (callee,), edge_time * share))
+            else:
+                rest += edge_time * share
+        micros = int(round(rest * 1e6))
+        if micros:
+            stacks[';'.join(_func_name(f) for f in path)] += micros
+    return stacks
+
+
+class DeterministicProfiler(cProfile.Profile):
+    """
+    cProfile, with the same interface as `StackSampler`
+    """
+    ext = 'prof'
+
+    def save(self, stem):
+        """write the profile for pstats, and approximate collapsed
+        stacks"""
+        path = '.'.join([stem, self.ext])
+        self.dump_stats(path + '.tmp')
+        os.rename(path + '.tmp', path)
+        _write_collapsed(collapsed_stacks(pstats.Stats(self)),
+                         '.'.join([stem, StackSampler.ext]))
+
+
+_PROFILERS = {'cprofile': DeterministicProfiler,
+              'sample': StackSampler}
+
+
+def _decode_profiler(stem, mode):
+    "decoding profiler for a path stem (new if need be)"
+    if stem not in _DECODE_PROFILES:
+        _DECODE_PROFILES[stem] = _PROFILERS[mode]()
+    return _DECODE_PROFILES[stem]
+
+
+def fold_label(cache):
+    """Name for the fold a model cache belongs to ('combined' if it is
+    not in a fold directory)"""
+    for path in (cache or {}).values():
+        match = _FOLD_RE.search(path)
+        if match:
+            return 'fold-' + match.group(1)
+    return 'combined'
+
+
+class ProfiledParser(ParserWrapper):
+    """
+    Parser wrapper profiling the `fit` and `transform` calls of the
+    real parser
+
+    Parameters
+    ----------
+    parser : Parser
+
+    key : string
+        Evaluation key (for file names)
+
+    out_dir : string
+        Where to write profiles
+
+    mode : string
+        One of `PROFILE_MODES`
+    """
+    def __init__(self, parser, key, out_dir, mode=PROFILE_MODES[0]):
+        super(ProfiledParser, self).__init__(parser)
+        self.key = key
+        self.out_dir = out_dir
+        self.mode = mode
+        self._fold = 'combined'
+
+    def _stem(self, *parts):
+        "where to write a profile (without the extension)"
+        if not fp.exists(self.out_dir):
+            try:
+                os.makedirs(self.out_dir)
+            except OSError:
+                if not fp.isdir(self.out_dir):
+                    raise
+        return fp.join(self.out_dir,
+                       '.'.join((self.key, self._fold) + parts))
+
+    def _own_profiles(self):
+        "path stems of the decoding profiles of this parser"
+        # stems are <out_dir>/<key>.<fold>.decode.<pid>
+        mine = fp.join(self.out_dir, self.key)
+        return [s for s in _DECODE_PROFILES if s.rsplit('.', 3)[0] == mine]
+
+    def fit(self, dpacks, targets, cache=None):
+        "fit the real parser, under the profiler"
+        # decoding the previous fold (if any) is over, and its
+        # profiles saved
+        for stem in self._own_profiles():
+            del _DECODE_PROFILES[stem]
+        self._fold = fold_label(cache)
+        profiler = _PROFILERS[self.mode]()
+        profiler.enable()
+        try:
+            self._inner.fit(dpacks, targets, cache=cache)
+        finally:
+            profiler.disable()
+        profiler.save(self._stem('fit'))
+        return self
+
+    def transform(self, dpack):
+        "decode with the real parser, under the profiler"
+        stem = self._stem('decode', str(os.getpid()))
+        profiler = _decode_profiler(stem, self.mode)
+        profiler.enable()
+        try:
+            return self._inner.transform(dpack)
+        finally:
+            profiler.disable()
+            # the fold may end with this document, and nobody tells
+            # the worker processes (they may just be terminated)
+            profiler.save(stem)
+
+
+def profiled_evaluations(evaluations, keys, out_dir,
+                         mode=PROFILE_MODES[0]):
+    """Copy of a list of evaluations, with the parsers of those with
+    the given keys wrapped in `ProfiledParser`"""
+    result = []
+    for econf in evaluations:
+        if econf.key in keys:
+            parser = econf.parser
+            econf = econf._replace(parser=parser._replace(
+                payload=ProfiledParser(parser.payload, econf.key,
+                                       out_dir, mode)))
+        result.append(econf)
+    return result
@@ -0,0 +1,238 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Progress events for long running evaluations
+
+The parser of every evaluation is wrapped so that each fit and each
+decoded document is logged as a JSON line in the `progress`
+directory of the evaluation. Each process writes to its own file
+(`<host>.<pid>.jsonl`), so cluster jobs sharing an evaluation never
+step on each other. `irit-rst-dt status` puts them back together.
+"""
+
+from __future__ import print_function
+from collections import defaultdict
+from os import path as fp
+import glob
+import json
+import os
+import socket
+import time
+
+import numpy as np
+
+from .decoding import (DECODE_FIELDS,
+                       decode_summary,
+                       pop_decode_stats)
+from .learning import (ParserWrapper)
+from .profiling import (fold_label)
+
+PROGRESS_DIR = 'progress'
+"""Subdirectory of the eval dir for progress events"""
+
+STRAGGLER_FACTOR = 2.
+"""A unit running for longer than this many times the median unit
+duration is a straggler"""
+
+
+def _job_id():
+    "cluster job we are running in, if any"
+    return os.environ.get('SLURM_JOB_ID')
+
+
+class ProgressLog(object):
+    """
+    Append-only event log for the current process
+
+    Parameters
+    ----------
+    out_dir : string
+        Progress directory of the evaluation
+    """
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+
+    def path(self):
+        "file for the current process (pid may change after a fork)"
+        return fp.join(self.out_dir, '{}.{}.jsonl'.format(
+            socket.gethostname(), os.getpid()))
+
+    def event(self, event, **kwargs):
+        "log an event"
+        if not fp.exists(self.out_dir):
+            try:
+                os.makedirs(self.out_dir)
+            except OSError:
+                if not fp.isdir(self.out_dir):
+                    raise
+        record = {'time': time.time(),
+                  'event': event,
+                  'host': socket.gethostname(),
+                  'pid': os.getpid(),
+                  'job': _job_id()}
+        record.update(kwargs)
+        with open(self.path(), 'a') as stream:
+            stream.write(json.dumps(record, sort_keys=True) + '\n')
+
+
+class ProgressParser(ParserWrapper):
+    """
+    Parser wrapper logging progress events for the real parser
+
+    Events are 'fit_start', 'fit_end' (with 'seconds') and 'decoded'
+    (one per document, with 'seconds'); each has the evaluation 'key'
+    and 'fold'.
+
+    Parameters
+    ----------
+    parser : Parser
+
+    key : string
+        Evaluation key
+
+    out_dir : string
+        Progress directory of the evaluation
+    """
+    def __init__(self, parser, key, out_dir):
+        super(ProgressParser, self).__init__(parser)
+        self.key = key
+        self.log = ProgressLog(out_dir)
+        self._fold = 'combined'
+
+    def fit(self, dpacks, targets, cache=None):
+        "fit the real parser, logging start and end"
+        self._fold = fold_label(cache)
+        self.log.event('fit_start', key=self.key, fold=self._fold)
+        start = time.time()
+        self._inner.fit(dpacks, targets, cache=cache)
+        self.log.event('fit_end', key=self.key, fold=self._fold,
+                       seconds=time.time() - start)
+        return self
+
+    def transform(self, dpack):
+        "decode with the real parser, logging the document"
+        start = time.time()
+        dpack = self._inner.transform(dpack)
+        # pruning/budget counts, see `irit_rst_dt.decoding`
+        extra = decode_summary(pop_decode_stats())
+        self.log.event('decoded', key=self.key, fold=self._fold,
+                       docs=1, seconds=time.time() - start, **extra)
+        return dpack
+
+
+def progress_evaluations(evaluations, out_dir):
+    """Copy of a list of evaluations, with all their parsers wrapped
+    in `ProgressParser`"""
+    return [e._replace(parser=e.parser._replace(
+        payload=ProgressParser(e.parser.payload, e.key, out_dir)))
+            for e in evaluations]
+
+
+def read_events(out_dir):
+    """All progress events of an evaluation, in time order"""
+    events = []
+    for path in glob.glob(fp.join(out_dir, '*.jsonl')):
+        with open(path) as stream:
+            for line in stream:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:  # partly written line
+                    continue
+    return sorted(events, key=lambda e: e['time'])
+
+
+def summarise_progress(events, keys, fold_sizes, now=None):
+    """Where an evaluation is at
+
+    A unit is an (evaluation, fold) pair; it is done once all the
+    documents of its fold have been decoded.
+
+    Parameters
+    ----------
+    events : list of dict
+        See `read_events`
+
+    keys : list of string
+        Evaluation keys
+
+    fold_sizes : dict(string, int)
+        Number of test documents in each fold ('fold-N')
+
+    now : float, optional
+
+    Returns
+    -------
+    summary : dict
+        Overall counts, plus 'decoding': documents decoded, seconds
+        spent and the `DECODE_FIELDS` counts (pruning, A* budget hits)
+        for each evaluation key
+    """
+    now = time.time() if now is None else now
+    units = dict(((k, f), {'docs': 0, 'start': None, 'end': None,
+                           'where': None})
+                 for k in keys for f in fold_sizes)
+    decoded = []
+    for event in events:
+        unit = units.get((event.get('key'), event.get('fold')))
+        if unit is None:
+            continue
+        if event['event'] == 'fit_start':
+            if unit['start'] is None:
+                unit['start'] = event['time']
+            unit['where'] = '{host}:{pid} (job {job})'.format(**event)
+        elif event['event'] == 'decoded':
+            unit['docs'] += event.get('docs', 1)
+            decoded.append(event)
+            if unit['docs'] >= fold_sizes[event['fold']] and\
+                    unit['end'] is None:
+                unit['end'] = event['time']
+    done = [u for u in units.values() if u['end'] is not None]
+    running = dict((k, u) for k, u in units.items()
+                   if u['end'] is None and u['start'] is not None)
+    durations = [u['end'] - u['start'] for u in done
+                 if u['start'] is not None]
+    median = float(np.median(durations)) if durations else None
+    first = min([e['time'] for e in events] or [now])
+    elapsed = now - first
+    rate = len(done) / elapsed if elapsed > 0 else 0.
+    remaining = len(units) - len(done)
+    stragglers = []
+    if median is not None:
+        for (key, fold), unit in sorted(running.items()):
+            if now - unit['start'] > STRAGGLER_FACTOR * median:
+                stragglers.append({'key': key,
+                                   'fold': fold,
+                                   'seconds': now - unit['start'],
+                                   'where': unit['where']})
+    dec_seconds = sum(e.get('seconds', 0.) for e in decoded)
+    fields = ['docs', 'seconds'] + DECODE_FIELDS
+    decoding = dict((k, dict((f, 0) for f in fields)) for k in keys)
+    for event in decoded:
+        for field in fields:
+            decoding[event['key']][field] += event.get(field, 0)
+    return {
+        'units': len(units),
+        'done': len(done),
+        'running': len(running),
+        'elapsed': elapsed,
+        'units_per_hour': rate * 3600,
+        'docs_decoded': sum(e.get('docs', 1) for e in decoded),
+        'docs_per_second': (len(decoded) / dec_seconds
+                            if dec_seconds else 0.),
+        'median_unit_seconds': median,
+        'decoding': decoding,
+        'eta_seconds': remaining / rate if rate else None,
+        'stragglers': stragglers,
+        'workers': sorted(set('{host}:{pid}'.format(**e)
+                              for e in events)),
+    }
+
+
+def fold_sizes(fold_dict):
+    """Number of test documents in each fold, keyed as in the
+    progress events"""
+    sizes = defaultdict(int)
+    for fold in fold_dict.values():
+        sizes['fold-{}'.format(fold)] += 1
+    return dict(sizes)
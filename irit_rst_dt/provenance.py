@@ -0,0 +1,251 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Provenance of gathered data
+
+Each gather dir gets a manifest (`provenance.json`) saying what it was
+extracted from:
+
+* inputs: a content hash of each input tree (training and test
+  corpora, PTB, CoreNLP and LECSIE dirs)
+* settings: what else decides what comes out (`FEATURE_SET`, feature
+  hashing, compression, `--coarse`, `--fix_pseudo_rels`)
+* versions: of educe, attelo and the harness
+
+along with a fingerprint of all of the above, and the size and
+modification time of each gathered file.
+
+`irit-rst-dt gather` hashes the inputs first, and if an earlier gather
+dir has the same fingerprint (and its files are still as they were),
+points `TMP/latest` back to it instead of extracting everything again.
+
+`irit-rst-dt evaluate` checks the manifest of the data it is about to
+use against the current configuration and the files on disk, so that
+we never silently evaluate on features that are not what the
+configuration says. It does not hash the inputs again (that is what
+gather is for): if the corpus has changed, gather again.
+"""
+
+from __future__ import print_function
+from os import path as fp
+import hashlib
+import json
+import os
+import sys
+import time
+
+import pkg_resources
+
+from .local import (COMPRESS_ARTEFACTS,
+                    CORENLP_OUT_DIR,
+                    FEATURE_HASH_WIDTH,
+                    FEATURE_SET,
+                    HARNESS_NAME,
+                    HASH_REVERSE_INDEX,
+                    LECSIE_DATA_DIR,
+                    LOCAL_TMP,
+                    PTB_DIR,
+                    TEST_CORPUS,
+                    TRAINING_CORPUS)
+
+MANIFEST = 'provenance.json'
+"""Name of the manifest in each gather dir"""
+
+CHECKED_SETTINGS = ['training_corpus', 'test_corpus', 'feature_set',
+                    'feature_hash_width', 'hash_reverse_index',
+                    'compress_artefacts']
+"""Settings that evaluate can check against `local.py` (the rest are
+gather flags)"""
+
+
+def tree_digest(path):
+    """Digest of the names and contents of every file under a
+    directory (or of a single file)"""
+    digest = hashlib.md5()
+    if fp.isfile(path):
+        paths = [path]
+    else:
+        paths = []
+        for parent, dirs, fnames in os.walk(path, followlinks=True):
+            dirs.sort()
+            paths.extend(fp.join(parent, f) for f in sorted(fnames))
+    for fpath in paths:
+        digest.update(fp.relpath(fpath, path).encode('utf-8'))
+        with open(fpath, 'rb') as stream:
+            for block in iter(lambda: stream.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def _versions():
+    "versions of the packages gather depends on"
+    versions = {}
+    for pkg in ['educe', 'attelo', HARNESS_NAME]:
+        try:
+            versions[pkg] = pkg_resources.get_distribution(pkg).version
+        except pkg_resources.DistributionNotFound:
+            versions[pkg] = None
+    return versions
+
+
+def current_settings(coarse=None, fix_pseudo_rels=None):
+    """Settings deciding what gather produces (the gather flags are
+    left as None if not known)"""
+    return {'training_corpus': fp.basename(TRAINING_CORPUS),
+            'test_corpus': (fp.basename(TEST_CORPUS)
+                            if TEST_CORPUS is not None else None),
+            'feature_set': FEATURE_SET,
+            'feature_hash_width': FEATURE_HASH_WIDTH,
+            'hash_reverse_index': HASH_REVERSE_INDEX,
+            'compress_artefacts': COMPRESS_ARTEFACTS,
+            'coarse': coarse,
+            'fix_pseudo_rels': fix_pseudo_rels}
+
+
+def provenance(coarse, fix_pseudo_rels):
+    """What a gather with the current configuration would be made of
+    (this hashes all the inputs, so it takes a little while)"""
+    inputs = {}
+    for name, path in [('training_corpus', TRAINING_CORPUS),
+                       ('test_corpus', TEST_CORPUS),
+                       ('ptb', PTB_DIR),
+                       ('corenlp', CORENLP_OUT_DIR),
+                       ('lecsie', LECSIE_DATA_DIR)]:
+        if path is not None:
+            inputs[name] = tree_digest(path)
+    return {'inputs': inputs,
+            'settings': current_settings(coarse, fix_pseudo_rels),
+            'versions': _versions()}
+
+
+def fingerprint(prov):
+    """Single digest of a provenance record"""
+    blob = json.dumps(prov, sort_keys=True).encode('utf-8')
+    return hashlib.sha1(blob).hexdigest()
+
+
+def _file_stats(tdir):
+    "size and modification time of each gathered file"
+    stats = {}
+    for fname in sorted(os.listdir(tdir)):
+        path = fp.join(tdir, fname)
+        if fname != MANIFEST and fp.isfile(path) and\
+                not fp.islink(path):
+            info = os.stat(path)
+            stats[fname] = [info.st_size, info.st_mtime]
+    return stats
+
+
+def write_manifest(tdir, prov):
+    """Save the manifest of a (finished) gather dir"""
+    manifest = {'fingerprint': fingerprint(prov),
+                'provenance': prov,
+                'created': time.time(),
+                'files': _file_stats(tdir)}
+    path = fp.join(tdir, MANIFEST)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as stream:
+        json.dump(manifest, stream, indent=2, sort_keys=True)
+    # write then rename (a partial manifest would look like a match)
+    os.rename(tmp_path, path)
+    return manifest
+
+
+def read_manifest(tdir):
+    """Manifest of a gather dir (None if it has none)"""
+    path = fp.join(tdir, MANIFEST)
+    if not fp.exists(path):
+        return None
+    with open(path) as stream:
+        return json.load(stream)
+
+
+def changed_files(tdir, manifest):
+    """Gathered files that are missing or no longer what they were
+    when the manifest was written"""
+    now = _file_stats(tdir)
+    return sorted(f for f, stats in manifest['files'].items()
+                  if now.get(f) != stats)
+
+
+def find_gather(prov, tmp_dir=LOCAL_TMP):
+    """Latest intact gather dir with the same fingerprint (None if
+    there isn't one)"""
+    wanted = fingerprint(prov)
+    if not fp.isdir(tmp_dir):
+        return None
+    for name in sorted(os.listdir(tmp_dir), reverse=True):
+        tdir = fp.join(tmp_dir, name)
+        if fp.islink(tdir) or not fp.isdir(tdir):
+            continue
+        manifest = read_manifest(tdir)
+        if manifest is not None and\
+                manifest['fingerprint'] == wanted and\
+                not changed_files(tdir, manifest):
+            return tdir
+    return None
+
+
+def skip_training_provenance(tdir, prov):
+    """Provenance to record when gathering only the test data into an
+    existing gather dir (`gather --skip-training`)
+
+    We refuse (exit) unless the manifest of the dir says its training
+    data was made from the same inputs and settings as we would use
+    now: the manifest must keep saying what the training features were
+    extracted with. The package versions are those of the training
+    data too (`check_gather` warns about those).
+    """
+    manifest = read_manifest(tdir)
+    if manifest is None:
+        sys.exit("Sorry, {} has no provenance manifest, so I cannot tell "
+                 "what its training features were extracted from.\n"
+                 "Please run `{} gather` without --skip-training".format(
+                     tdir, HARNESS_NAME))
+    old = manifest['provenance']
+    wrong = []
+    for part in ['inputs', 'settings']:
+        for key in sorted(frozenset(old[part]) | frozenset(prov[part])):
+            if key != 'test_corpus' and\
+                    old[part].get(key) != prov[part].get(key):
+                wrong.append('{}: gathered with {!r}, now {!r}'.format(
+                    key, old[part].get(key), prov[part].get(key)))
+    if wrong:
+        sys.exit("Sorry, the training data in {} was not gathered from "
+                 "the same inputs and settings:\n{}\n"
+                 "Please run `{} gather` without --skip-training".format(
+                     tdir, "\n".join(wrong), HARNESS_NAME))
+    return dict(prov, versions=old['versions'])
+
+
+def check_gather(tdir):
+    """Complain if the gathered data in a directory does not go with
+    the current configuration (or has changed since it was gathered)
+
+    Differences in settings or files are fatal; we only warn about
+    package versions and missing manifests (older gathers)
+    """
+    manifest = read_manifest(tdir)
+    if manifest is None:
+        print('WARNING: no provenance manifest in {}; I cannot tell if '
+              'its features go with your configuration (gather again '
+              'to be sure)'.format(tdir), file=sys.stderr)
+        return
+    prov = manifest['provenance']
+    current = current_settings()
+    wrong = ['{}: gathered with {!r}, configured {!r}'.format(
+        k, prov['settings'].get(k), current[k])
+             for k in CHECKED_SETTINGS
+             if prov['settings'].get(k) != current[k]]
+    wrong.extend('{}: changed since gather'.format(f)
+                 for f in changed_files(tdir, manifest))
+    if wrong:
+        sys.exit("Sorry, the gathered data in {} is stale:\n{}\n"
+                 "Please run `{} gather`".format(tdir, "\n".join(wrong),
+                                                 HARNESS_NAME))
+    versions = _versions()
+    for pkg, version in sorted(prov['versions'].items()):
+        if versions.get(pkg) != version:
+            print('WARNING: {} was gathered with {} {} (now {})'.format(
+                tdir, pkg, version, versions.get(pkg)), file=sys.stderr)
@@ -0,0 +1,213 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Repeated cross-validation over several fold seeds
+
+Rather than running `irit-rst-dt evaluate` once per seed, we load the
+multipack once, generate one fold assignment per seed, and
+
+1. fit every evaluation config once per *distinct* training set
+   (models are stored by a hash of the training documents, so seeds
+   whose folds coincide share their models),
+2. decode and score every (seed, fold) unit in parallel,
+3. report the mean over seeds of each score, with a confidence
+   interval.
+"""
+
+from __future__ import print_function
+from collections import OrderedDict
+from os import path as fp
+import hashlib
+import json
+import os
+import random
+import sys
+
+from joblib import (Parallel, delayed)
+import numpy as np
+import scipy.stats
+
+from attelo.fold import (make_n_fold)
+from attelo.io import (load_multipack,
+                       save_fold_dict)
+
+from .local import (REPEATED_CV_FOLDS,
+                    REPEATED_CV_SEEDS)
+from .score import (add_counts, count_metrics, f1_scores, sum_counts)
+
+
+def training_key(docs):
+    """Short identifier for a set of training documents"""
+    digest = hashlib.md5('\n'.join(sorted(docs)).encode('utf-8'))
+    return digest.hexdigest()[:12]
+
+
+def confidence_interval(scores, level=0.95):
+    """Mean of a sample of scores, and the half-width of its
+    (Student's t) confidence interval
+
+    Returns
+    -------
+    mean : float
+
+    half_width : float
+        0 if we have fewer than two scores
+    """
+    scores = np.asarray(scores, dtype=float)
+    mean = float(scores.mean())
+    if len(scores) < 2:
+        return mean, 0.
+    sem = scores.std(ddof=1) / np.sqrt(len(scores))
+    return mean, float(sem * scipy.stats.t.ppf((1 + level) / 2.,
+                                               len(scores) - 1))
+
+
+def run_jobs(n_jobs, jobs):
+    """Run delayed jobs, honouring the `--n-jobs` conventions
+    (0 for fully sequential)"""
+    if n_jobs == 0:
+        return [f(*args, **kwargs) for f, args, kwargs in jobs]
+    return Parallel(n_jobs=n_jobs, verbose=5)(jobs)
+
+
+def learn(hconf, dpacks, model_dir, econfs=None):
+    """Fit (or load, if already fitted) every evaluation config (or
+    just the given ones) on the given training datapacks"""
+    if not fp.exists(model_dir):
+        os.makedirs(model_dir)
+    targets = [d.target for d in dpacks]
+    for econf in (hconf.evaluations if econfs is None else econfs):
+        cache = hconf.model_paths_in(model_dir, econf.learner,
+                                     econf.parser)
+        econf.parser.payload.fit(dpacks, targets, cache=cache)
+
+
+def decode(hconf, dpacks, model_dir, econfs=None):
+    """Decode the test datapacks with every evaluation config (or
+    just the given ones)
+
+    Returns
+    -------
+    counts : dict(string, dict(string, Count))
+        Counts for each evaluation key and metric
+    """
+    counts = {}
+    gold = hconf.gold_cache(False)
+    for econf in (hconf.evaluations if econfs is None else econfs):
+        cache = hconf.model_paths_in(model_dir, econf.learner,
+                                     econf.parser)
+        parser = econf.parser.payload
+        parser.fit([], [], cache=cache)  # load models
+        counts[econf.key] = sum_counts(
+            count_metrics(parser.transform(d), gold_cache=gold)
+            for d in dpacks)
+    return counts
+
+
+def seed_fold_dicts(mpack, seeds, nfolds):
+    """One fold assignment per seed"""
+    return OrderedDict((seed, make_n_fold(mpack, nfolds,
+                                          random.Random(seed)))
+                       for seed in seeds)
+
+
+def summarise(seed_counts):
+    """Mean and confidence interval of each score over the seeds
+
+    Parameters
+    ----------
+    seed_counts : dict(int, dict(string, dict(string, Count)))
+        Counts summed over all folds, for each seed and
+        evaluation key
+
+    Returns
+    -------
+    summary : dict(string, dict(string, dict(string, float)))
+        For each evaluation key and metric, the mean, confidence
+        interval half-width, and per-seed scores
+    """
+    summary = {}
+    for counts in seed_counts.values():
+        for key in counts:
+            summary.setdefault(key, {})
+    for key in summary:
+        per_seed = [f1_scores(seed_counts[s][key])
+                    for s in sorted(seed_counts)]
+        summary[key] = {}
+        for metric in sorted(per_seed[0]):
+            scores = [x[metric] for x in per_seed]
+            mean, half_width = confidence_interval(scores)
+            summary[key][metric] = {'mean': mean,
+                                    'ci95': half_width,
+                                    'scores': scores}
+    return summary
+
+
+def _report_lines(summary, nseeds):
+    "human readable version of `summarise`"
+    lines = ['repeated {}-fold cross-validation, {} seeds '
+             '(mean +/- 95% CI)'.format(REPEATED_CV_FOLDS, nseeds), '']
+    for key in sorted(summary):
+        lines.append(key)
+        for metric, stats in sorted(summary[key].items()):
+            lines.append('    {:<16} {:.4f} +/- {:.4f}'.format(
+                metric, stats['mean'], stats['ci95']))
+    return lines
+
+
+def evaluate_repeated(hconf):
+    """Run repeated cross-validation for all evaluations in the
+    harness (which must already be loaded)
+    """
+    n_jobs = hconf.runcfg.n_jobs
+    report_dir = fp.join(hconf.eval_dir, 'repeated-cv')
+    scratch_dir = fp.join(hconf.scratch_dir, 'repeated-cv')
+    for dname in [report_dir, scratch_dir]:
+        if not fp.exists(dname):
+            os.makedirs(dname)
+
+    mpack = load_multipack(*hconf.mpack_paths(False)[:4], verbose=True)
+    fold_dicts = seed_fold_dicts(mpack, REPEATED_CV_SEEDS,
+                                 REPEATED_CV_FOLDS)
+    units = []  # (seed, fold, training key)
+    train_sets = {}
+    for seed, fold_dict in fold_dicts.items():
+        save_fold_dict(fold_dict, fp.join(
+            report_dir, 'folds-{}-seed{}.json'.format(hconf.dataset, seed)))
+        for fold in sorted(frozenset(fold_dict.values())):
+            docs = sorted(d for d in mpack if fold_dict[d] != fold)
+            tkey = training_key(docs)
+            train_sets[tkey] = docs
+            units.append((seed, fold, tkey))
+
+    def _model_dir(tkey):
+        "where the models for a training set live"
+        return fp.join(scratch_dir, 'train-' + tkey)
+
+    print('repeated cross-validation: {} units, {} distinct training '
+          'sets'.format(len(units), len(train_sets)), file=sys.stderr)
+    run_jobs(n_jobs, [delayed(learn)(hconf,
+                                     [mpack[d] for d in docs],
+                                     _model_dir(tkey))
+                      for tkey, docs in sorted(train_sets.items())])
+    unit_counts = run_jobs(
+        n_jobs,
+        [delayed(decode)(hconf,
+                         [mpack[d] for d in sorted(mpack)
+                          if fold_dicts[seed][d] == fold],
+                         _model_dir(tkey))
+         for seed, fold, tkey in units])
+
+    seed_counts = {}
+    for (seed, _, _), counts in zip(units, unit_counts):
+        totals = seed_counts.setdefault(seed, {})
+        for key, count in counts.items():
+            totals[key] = add_counts(totals.get(key, {}), count)
+    summary = summarise(seed_counts)
+    with open(fp.join(report_dir, 'scores.json'), 'w') as stream:
+        json.dump(summary, stream, indent=2, sort_keys=True)
+    lines = _report_lines(summary, len(fold_dicts))
+    with open(fp.join(report_dir, 'report.txt'), 'w') as stream:
+        print('\n'.join(lines), file=stream)
+    print('\n'.join(lines))
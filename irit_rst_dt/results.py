@@ -0,0 +1,343 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Results of every evaluation, in one database
+
+Each evaluation has its own reports directory, which is fine for
+looking at one run but makes comparing configurations across weeks of
+runs a matter of grepping text reports. At the end of an evaluation
+(`irit-rst-dt evaluate` or `evaluate --end`), we score the predictions
+of each configuration on each fold and add them, with the fit/decode
+timings from the progress events, to a SQLite file in `SNAPSHOTS`.
+`irit-rst-dt compare` queries it.
+
+Tables:
+
+* runs: one per eval dir (`name` is `<timestamp>/eval-<timestamp>`),
+  with a hash of the gathered data it was run on (the fingerprint of
+  its provenance manifest, see `irit_rst_dt.provenance`) and when it
+  was recorded
+* scores: one per (run, config, fold, metric), with the raw counts,
+  the F1 `value` and the timings; fold `ALL_FOLDS` is the whole run
+  (counts and timings summed over the folds)
+
+Recording the same run again replaces what we had for it.
+"""
+
+from __future__ import print_function
+from collections import defaultdict
+from os import path as fp
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+
+from attelo.io import (load_fold_dict, load_multipack)
+from attelo.table import (UNRELATED)
+
+from .local import (SNAPSHOTS, UNPACK_DIR)
+from .progress import (PROGRESS_DIR, read_events)
+from .provenance import (read_manifest)
+from .score import (add_counts, count_metrics, prf)
+from .speculate import (output_path, output_state)
+from .storage import (local_cache_dir, readable_path)
+
+RESULTS_DB = fp.join(SNAPSHOTS, 'results.db')
+"""Default results database"""
+
+ALL_FOLDS = -1
+"""Fold number of the whole-run rows"""
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS runs (
+        run_id INTEGER PRIMARY KEY,
+        name TEXT UNIQUE NOT NULL,
+        gather_hash TEXT,
+        recorded REAL NOT NULL)""",
+    """CREATE TABLE IF NOT EXISTS scores (
+        run_id INTEGER NOT NULL REFERENCES runs (run_id),
+        config TEXT NOT NULL,
+        fold INTEGER NOT NULL,
+        metric TEXT NOT NULL,
+        tpos INTEGER,
+        npred INTEGER,
+        ngold INTEGER,
+        value REAL NOT NULL,
+        fit_seconds REAL,
+        decode_seconds REAL)""",
+    """CREATE INDEX IF NOT EXISTS runs_by_time ON runs (recorded)""",
+    """CREATE INDEX IF NOT EXISTS scores_by_metric
+        ON scores (metric, fold, config, value)""",
+    """CREATE INDEX IF NOT EXISTS scores_by_run ON scores (run_id)""",
+]
+
+
+def connect(path=RESULTS_DB):
+    """Open (creating it if need be) a results database"""
+    parent = fp.dirname(path)
+    if parent and not fp.exists(parent):
+        os.makedirs(parent)
+    conn = sqlite3.connect(path)
+    for statement in _SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    return conn
+
+
+def run_name(eval_dir):
+    """How a run is known in the database"""
+    eval_dir = fp.realpath(eval_dir)
+    return fp.join(fp.basename(fp.dirname(eval_dir)),
+                   fp.basename(eval_dir))
+
+
+def gather_hash(paths):
+    """Digest of the contents of the gathered files a run used (for
+    gathers without a provenance manifest)"""
+    digest = hashlib.md5()
+    for path in paths:
+        digest.update(fp.basename(path).encode('utf-8'))
+        with open(path, 'rb') as stream:
+            for block in iter(lambda: stream.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+def record_run(conn, name, ghash, counts, timings):
+    """
+    Add (or replace) the results of a run
+
+    Parameters
+    ----------
+    name : string
+        See `run_name`
+
+    ghash : string
+        See `run_gather_hash`
+
+    counts : dict((string, int), dict(string, Count))
+        Counts for each (config, fold)
+
+    timings : dict((string, int), (float, float))
+        Fit and decode seconds for each (config, fold)
+    """
+    cursor = conn.cursor()
+    cursor.execute('SELECT run_id FROM runs WHERE name = ?', (name,))
+    row = cursor.fetchone()
+    if row is not None:
+        cursor.execute('DELETE FROM scores WHERE run_id = ?', row)
+        cursor.execute('DELETE FROM runs WHERE run_id = ?', row)
+    cursor.execute('INSERT INTO runs (name, gather_hash, recorded) '
+                   'VALUES (?, ?, ?)', (name, ghash, time.time()))
+    run_id = cursor.lastrowid
+    totals = defaultdict(dict)
+    total_times = {}
+    for (config, fold), fcounts in counts.items():
+        totals[config] = add_counts(totals[config], fcounts)
+        if (config, fold) in timings:
+            total_times[config] = tuple(
+                x + y for x, y in zip(total_times.get(config, (0., 0.)),
+                                      timings[config, fold]))
+    rows = []
+    for (config, fold), fcounts in sorted(counts.items()):
+        rows.extend(_score_rows(run_id, config, fold, fcounts,
+                                timings.get((config, fold))))
+    for config, tcounts in sorted(totals.items()):
+        rows.extend(_score_rows(run_id, config, ALL_FOLDS, tcounts,
+                                total_times.get(config)))
+    cursor.executemany('INSERT INTO scores VALUES '
+                       '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    conn.commit()
+    return run_id
+
+
+def _score_rows(run_id, config, fold, counts, timing):
+    "score table rows for the counts of a (config, fold)"
+    fit, decode = timing or (None, None)
+    return [(run_id, config, fold, metric) + tuple(count) +
+            (prf(*count)[2], fit, decode)
+            for metric, count in sorted(counts.items())]
+
+
+def best_configs(conn, metric, last=None, config=None, gather=None,
+                 limit=None):
+    """
+    Configurations ranked by their best whole-run score on a metric
+
+    Parameters
+    ----------
+    last : int, optional
+        Only look at this many of the latest runs
+
+    config : string, optional
+        Only configurations whose key contains this
+
+    gather : string, optional
+        Only runs on gathered data whose hash starts with this
+
+    limit : int, optional
+        Only return this many configurations
+
+    Returns
+    -------
+    rows : list of (config, best, mean, runs, best run)
+    """
+    runs = 'SELECT run_id, name FROM runs'
+    params = []
+    if gather is not None:
+        runs += ' WHERE gather_hash LIKE ?'
+        params.append(gather + '%')
+    runs += ' ORDER BY recorded DESC'
+    if last is not None:
+        runs += ' LIMIT ?'
+        params.append(last)
+    # sqlite takes the bare column (name) from the row of the max
+    query = ('SELECT s.config, MAX(s.value), AVG(s.value), COUNT(*), '
+             'r.name FROM scores s JOIN (' + runs + ') r '
+             'ON s.run_id = r.run_id '
+             'WHERE s.metric = ? AND s.fold = ?')
+    params.extend([metric, ALL_FOLDS])
+    if config is not None:
+        query += ' AND s.config LIKE ?'
+        params.append('%' + config + '%')
+    query += ' GROUP BY s.config ORDER BY MAX(s.value) DESC'
+    if limit is not None:
+        query += ' LIMIT ?'
+        params.append(limit)
+    return conn.execute(query, params).fetchall()
+
+
+def config_history(conn, config, metric, last=None):
+    """
+    Whole-run scores of a configuration, latest run first
+
+    Returns
+    -------
+    rows : list of (run, gather hash, value, fit seconds,
+                    decode seconds)
+    """
+    query = ('SELECT r.name, r.gather_hash, s.value, s.fit_seconds, '
+             's.decode_seconds FROM scores s JOIN runs r '
+             'ON s.run_id = r.run_id '
+             'WHERE s.metric = ? AND s.fold = ? AND s.config = ? '
+             'ORDER BY r.recorded DESC')
+    params = [metric, ALL_FOLDS, config]
+    if last is not None:
+        query += ' LIMIT ?'
+        params.append(last)
+    return conn.execute(query, params).fetchall()
+
+
+# ---------------------------------------------------------------------
+# scoring a finished evaluation
+# ---------------------------------------------------------------------
+
+
+def _read_output(path):
+    "predicted label of each (edu1, edu2) pair in an output file"
+    labels = {}
+    with open(path) as stream:
+        for line in stream:
+            edu1, edu2, label = line.rstrip('\n').split('\t')[:3]
+            labels[edu1, edu2] = label
+    return labels
+
+
+def _predictions(dpack, labels):
+    "label number of each pairing of a datapack, from `_read_output`"
+    return np.array([dpack.label_number(labels.get((e1.id, e2.id),
+                                                   UNRELATED))
+                     for e1, e2 in dpack.pairings], dtype=np.intp)
+
+
+def _timings(events):
+    "fit and decode seconds for each (config, fold) from the events"
+    timings = defaultdict(lambda: (0., 0.))
+    for event in events:
+        fold = event.get('fold', '')
+        if not fold.startswith('fold-'):
+            continue
+        unit = (event['key'], int(fold.split('-', 1)[1]))
+        fit, decode = timings[unit]
+        if event['event'] == 'fit_end':
+            fit += event.get('seconds', 0.)
+        elif event['event'] == 'decoded':
+            decode += event.get('seconds', 0.)
+        timings[unit] = (fit, decode)
+    return dict(timings)
+
+
+def score_output(path, dpacks, gold_cache=None):
+    """Counts for the predictions in an output file on the given
+    datapacks"""
+    labels = _read_output(path)
+    total = {}
+    for dpack in dpacks:
+        total = add_counts(total, count_metrics(
+            dpack, gold_cache=gold_cache,
+            prediction=_predictions(dpack, labels)))
+    return total
+
+
+def score_outputs(hconf, mpack, fold_dict):
+    """Counts for each (config, fold) whose predictions are there
+
+    The harness must already be loaded
+    """
+    gold = hconf.gold_cache(False)
+    cache_dir = local_cache_dir(hconf.eval_dir, UNPACK_DIR)
+    counts = {}
+    for fold in sorted(frozenset(fold_dict.values())):
+        docs = [d for d in sorted(mpack) if fold_dict[d] == fold]
+        for econf in hconf.evaluations:
+            path = output_path(hconf, econf, fold)
+            state = output_state(path)
+            if state == 'changed':
+                # see `irit_rst_dt.speculate`
+                print('predictions for', econf.key, 'on fold', fold,
+                      'do not match their commit marker', file=sys.stderr)
+                continue
+            path = readable_path(path, cache_dir)
+            if not fp.exists(path):
+                print('no predictions for', econf.key, 'on fold', fold,
+                      file=sys.stderr)
+                continue
+            counts[econf.key, fold] = score_output(
+                path, [mpack[d] for d in docs], gold)
+    return counts
+
+
+def run_gather_hash(eval_dir, paths):
+    """Hash of the gathered data an evaluation was run on: the
+    fingerprint from the manifest of its gather dir if there is one
+    (no need to read the data again), else `gather_hash(paths)`"""
+    manifest = read_manifest(fp.dirname(fp.realpath(eval_dir)))
+    if manifest is not None:
+        return manifest['fingerprint'][:12]
+    return gather_hash(paths)
+
+
+def record_results(hconf, db_path=RESULTS_DB):
+    """Score a finished evaluation and add it to the results
+    database
+
+    The harness must already be loaded
+    """
+    mpack_paths = hconf.mpack_paths(False)[:4]
+    mpack = load_multipack(*mpack_paths, verbose=True)
+    fold_dict = load_fold_dict(hconf.fold_file)
+    counts = score_outputs(hconf, mpack, fold_dict)
+    timings = _timings(read_events(fp.join(hconf.eval_dir,
+                                           PROGRESS_DIR)))
+    conn = connect(db_path)
+    try:
+        record_run(conn, run_name(hconf.eval_dir),
+                   run_gather_hash(hconf.eval_dir, mpack_paths),
+                   counts, timings)
+    finally:
+        conn.close()
+    print('results recorded in', db_path, file=sys.stderr)
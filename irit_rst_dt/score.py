@@ -0,0 +1,348 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Lightweight scoring for harness-side pipelines
+
+This works directly on decoded datapacks (predictions vs gold targets)
+so that pipelines which do not go through the attelo fold loop can
+still report scores (see `HARNESS_METRICS`), and so that we can score
+each configuration on each fold of an evaluation for the results
+database (see `irit_rst_dt.results`). attelo's own reports come from
+its own scoring, inside its fold loop.
+
+Predicted and gold structures are integer arrays (edge masks over the
+pairings, head and label of each EDU, encoded dependency spans) so
+that all the metrics are computed in one pass over each document
+without any Python-level set operations. The gold side is the same for
+every configuration, so it is computed once per document and cached
+(see `GoldCache`), from the gold trees converted at gather time if we
+have them.
+"""
+
+from __future__ import print_function
+from collections import namedtuple
+from os import path as fp
+import sys
+
+import numpy as np
+
+from attelo.table import (UNRELATED)
+
+from .gold import (load_gold_trees)
+from .learning import (pack_key)
+from .local import (METRICS)
+
+
+SCORED_METRICS = ['edges', 'edges_by_label', 'edus', 'dspans']
+"""Metrics we know how to compute here:
+
+* edges: attached pairs
+* edges_by_label: attached pairs, with the right label
+* edus: EDUs with the right head and label
+* dspans: dependency spans (the span covered by each EDU and its
+  dependents) with the right label
+
+The first three are the same as attelo's. `dspans` is ours, and is
+not attelo's `cspans` (which compares the constituency trees the
+dependency trees convert back to), so the two cannot be compared.
+"""
+
+HARNESS_METRICS = [m for m in METRICS if m in SCORED_METRICS] + ['dspans']
+"""What we score by default: those of `METRICS` (attelo's) we know how
+to compute, and `dspans`"""
+
+
+class Count(namedtuple('Count', ['tpos', 'npred', 'ngold'])):
+    """
+    Raw counts for a single metric
+
+    Parameters
+    ----------
+    tpos : int
+        Number of predicted items that are also in the gold
+
+    npred : int
+        Number of predicted items
+
+    ngold : int
+        Number of gold items
+    """
+
+    def __add__(self, other):
+        return Count(*[x + y for x, y in zip(self, other)])
+
+
+EMPTY_COUNT = Count(0, 0, 0)
+
+
+class DocStructure(namedtuple('DocStructure',
+                              ['attached', 'labels', 'heads',
+                               'head_labels', 'spans'])):
+    """
+    Integer array view of the (predicted or gold) structure of a
+    document
+
+    Parameters
+    ----------
+    attached : array of bool
+        For each pairing, whether it is an edge
+
+    labels : array of int
+        Label number of each pairing
+
+    heads : array of int
+        Head (index into the EDUs) of each EDU (-1 if none)
+
+    head_labels : array of int
+        Label of the edge to the head of each EDU
+
+    spans : array of int
+        Encoded (start, end, label) of each dependency span, sorted
+    """
+    pass
+
+
+class _Skeleton(namedtuple('_Skeleton',
+                           ['sources', 'targets', 'nedus', 'nlabels',
+                            'unrelated'])):
+    "what we need to know about a document besides its labels"
+    pass
+
+
+def _skeleton(dpack):
+    "EDU indices of the pairings of a datapack"
+    index = dict((e.id, i) for i, e in enumerate(dpack.edus))
+    sources = np.array([index[e1.id] for e1, _ in dpack.pairings],
+                       dtype=np.intp)
+    targets = np.array([index[e2.id] for _, e2 in dpack.pairings],
+                       dtype=np.intp)
+    return _Skeleton(sources=sources,
+                     targets=targets,
+                     nedus=len(dpack.edus),
+                     nlabels=len(dpack.labels) + 1,
+                     unrelated=dpack.label_number(UNRELATED))
+
+
+def _spans(heads, head_labels, skel):
+    """Dependency span of each EDU with a head: the span covered by its
+    subtree, encoded with its label as a single integer"""
+    nedus = skel.nedus
+    children = np.flatnonzero(heads >= 0)
+    parents = heads[children]
+    start = np.arange(nedus)
+    end = np.arange(nedus)
+    for _ in range(nedus):  # at most the depth of the tree
+        new_start = start.copy()
+        new_end = end.copy()
+        np.minimum.at(new_start, parents, start[children])
+        np.maximum.at(new_end, parents, end[children])
+        if np.array_equal(new_start, start) and\
+                np.array_equal(new_end, end):
+            break
+        start, end = new_start, new_end
+    spans = ((start[children] * nedus + end[children]) * skel.nlabels +
+             head_labels[children])
+    return np.unique(spans)
+
+
+def structure(skel, labels):
+    """Structure of a document given the label of each pairing
+
+    Parameters
+    ----------
+    skel : _Skeleton
+
+    labels : array of int
+        One label number per pairing (unrelated if not an edge)
+
+    Returns
+    -------
+    doc : DocStructure
+    """
+    attached = labels != skel.unrelated
+    heads = np.empty(skel.nedus, dtype=np.intp)
+    heads.fill(-1)
+    head_labels = np.zeros(skel.nedus, dtype=np.intp)
+    # if an EDU has more than one head, the last one wins
+    heads[skel.targets[attached]] = skel.sources[attached]
+    head_labels[skel.targets[attached]] = labels[attached]
+    return DocStructure(attached=attached,
+                        labels=labels,
+                        heads=heads,
+                        head_labels=head_labels,
+                        spans=_spans(heads, head_labels, skel))
+
+
+class GoldCache(object):
+    """
+    Gold structures (and EDU indices) of the documents we have
+    scored, so that they are only computed once whatever the number
+    of configurations we score
+
+    Parameters
+    ----------
+    trees : dict(string, GoldTree), optional
+        Gold trees converted from the corpus (see `irit_rst_dt.gold`);
+        documents which are not in there (or whose EDUs do not line
+        up, or whose relations are not labels of the datapack) get
+        their gold structure from the datapack targets
+
+    paths : list of string, optional
+        Files to read (more) gold trees from, the first time we need
+        them (those that do not exist are ignored)
+    """
+    def __init__(self, trees=None, paths=None):
+        self._trees = dict(trees or {})
+        self._paths = list(paths or [])
+        self._docs = {}
+
+    def _tree(self, doc):
+        "converted gold tree for a document, if we have one"
+        while self._paths:
+            path = self._paths.pop(0)
+            if fp.exists(path):
+                self._trees.update(load_gold_trees(path))
+        return self._trees.get(doc)
+
+    def _from_tree(self, dpack, skel, tree):
+        """gold structure from a converted corpus tree (None if it has
+        relations that the datapack does not know about)"""
+        numbers = dict((l, dpack.label_number(l)) for l in dpack.labels)
+        unknown = sorted(frozenset(l for l in tree.labels
+                                   if l is not None and l not in numbers))
+        if unknown:
+            print('WARNING: gold tree of {} has relations that are not '
+                  'in the datapack ({}); scoring it against the '
+                  'datapack targets'.format(dpack.edus[-1].grouping,
+                                            ', '.join(unknown)),
+                  file=sys.stderr)
+            return None
+        heads = np.asarray(tree.heads, dtype=np.intp)
+        head_labels = np.array([0 if l is None else numbers[l]
+                                for l in tree.labels],
+                               dtype=np.intp)
+        is_head = heads[skel.targets] == skel.sources
+        labels = np.where(is_head, head_labels[skel.targets],
+                          skel.unrelated)
+        return DocStructure(attached=is_head,
+                            labels=labels,
+                            heads=heads,
+                            head_labels=head_labels,
+                            spans=_spans(heads, head_labels, skel))
+
+    def get(self, dpack):
+        """Skeleton and gold structure of a datapack
+
+        Returns
+        -------
+        skel : _Skeleton
+
+        gold : DocStructure
+        """
+        key = pack_key(dpack)
+        if key not in self._docs:
+            skel = _skeleton(dpack)
+            tree = self._tree(dpack.edus[-1].grouping)
+            gold = None
+            if tree is not None and len(tree.heads) == skel.nedus:
+                gold = self._from_tree(dpack, skel, tree)
+            if gold is None:
+                gold = structure(skel, np.asarray(dpack.target))
+            self._docs[key] = (skel, gold)
+        return self._docs[key]
+
+
+GOLD_CACHE = GoldCache()
+"""Per process gold cache (from datapack targets only)"""
+
+
+def count_metrics(dpack, metrics=None, gold_cache=GOLD_CACHE,
+                  prediction=None):
+    """Compare the predictions of a decoded datapack with its gold
+    targets
+
+    Parameters
+    ----------
+    dpack : DataPack
+        Datapack as returned by a parser's `transform`
+
+    metrics : list of string, optional
+        Defaults to `HARNESS_METRICS`
+
+    gold_cache : GoldCache
+
+    prediction : array of int, optional
+        Predicted label of each pairing, if not those of the
+        datapack's graph (eg. read back from an output file)
+
+    Returns
+    -------
+    counts : dict(string, Count)
+    """
+    if metrics is None:
+        metrics = HARNESS_METRICS
+    skel, gold = gold_cache.get(dpack)
+    if prediction is None:
+        prediction = dpack.graph.prediction
+    pred = structure(skel, np.asarray(prediction))
+    both = pred.attached & gold.attached
+    npred = int(pred.attached.sum())
+    ngold = int(gold.attached.sum())
+    counts = {}
+    for metric in metrics:
+        if metric == 'edges':
+            counts[metric] = Count(int(both.sum()), npred, ngold)
+        elif metric == 'edges_by_label':
+            counts[metric] = Count(
+                int((both & (pred.labels == gold.labels)).sum()),
+                npred, ngold)
+        elif metric == 'edus':
+            right = ((pred.heads == gold.heads) &
+                     (pred.head_labels == gold.head_labels) &
+                     (gold.heads >= 0))
+            counts[metric] = Count(int(right.sum()),
+                                   int((pred.heads >= 0).sum()),
+                                   int((gold.heads >= 0).sum()))
+        elif metric == 'dspans':
+            counts[metric] = Count(
+                len(np.intersect1d(pred.spans, gold.spans,
+                                   assume_unique=True)),
+                len(pred.spans), len(gold.spans))
+        else:
+            raise ValueError('Unknown metric: ' + metric)
+    return counts
+
+
+def add_counts(counts1, counts2):
+    """Sum of two dictionaries of counts (as returned by
+    `count_metrics`)"""
+    return dict((m, counts1.get(m, EMPTY_COUNT) + counts2.get(m, EMPTY_COUNT))
+                for m in set(counts1) | set(counts2))
+
+
+def sum_counts(counts):
+    """Total of an iterable of count dictionaries"""
+    total = {}
+    for count in counts:
+        total = add_counts(total, count)
+    return total
+
+
+def prf(tpos, npred, ngold):
+    """Precision, recall, F1 (0 wherever undefined)"""
+    prec = float(tpos) / npred if npred else 0.
+    rec = float(tpos) / ngold if ngold else 0.
+    fscore = 2 * prec * rec / (prec + rec) if prec + rec else 0.
+    return prec, rec, fscore
+
+
+def f1_scores(counts):
+    """F1 score for each metric in a count dictionary
+
+    Returns
+    -------
+    scores : dict(string, float)
+        Keys follow the names in `METRICS`
+    """
+    return dict((m, prf(*c)[2]) for m, c in counts.items())
@@ -0,0 +1,144 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Sharing models between intra/inter evaluations
+
+The models of an intra/inter parser only depend on its learners and
+on its `sel_inter` mode: the intrasentential models (`sent-attach`,
+`sent-relate`) are the same for every mode, and the intersentential
+ones are the same for every parser type (`HeadToHeadParser`,
+`FrontierToHeadParser`...) using a mode. Left to themselves, each
+evaluation would still go through the training data to fit (or at
+least rebuild the training sets of) all of them.
+
+Instead, the evaluations with the same learners form a group. The
+first of them to be fitted on a fold fits the models of every mode in
+the group, with the training data it has in hand (the intrasentential
+models once, then the intersentential ones for each mode); the others
+find everything on disk and just load it. A lock file keeps parallel
+jobs in the same fold from doing the same work at the same time.
+"""
+
+from __future__ import print_function
+from collections import defaultdict
+from os import path as fp
+import fcntl
+
+from attelo.parser.intra import (IntraInterPair)
+
+from .learning import (ParserWrapper)
+
+INTER_PREFIXES = {
+    'global': '',
+    'inter': 'doc-',
+    'head_to_head': 'doc_head-',
+    'frontier_to_head': 'doc_frontier-',
+}
+"""Task prefix of the intersentential models for each `sel_inter`
+mode ('global' models are those of the plain document parsers)"""
+
+
+def inter_cache(cache, sel_from, sel_to):
+    """Model paths of an intra/inter parser with another `sel_inter`
+    mode (but the same learners)"""
+    result = dict(cache)
+    for key, task in [('inter:attach', 'attach'),
+                      ('inter:label', 'relate')]:
+        old_suffix = '.' + INTER_PREFIXES[sel_from] + task + '.model'
+        new_suffix = '.' + INTER_PREFIXES[sel_to] + task + '.model'
+        path = cache[key]
+        if not path.endswith(old_suffix):
+            raise ValueError('Unexpected model path: ' + path)
+        result[key] = path[:-len(old_suffix)] + new_suffix
+    return result
+
+
+def _all_exist(cache):
+    "true if every model in the cache is on disk"
+    return all(fp.exists(p) for p in cache.values())
+
+
+class _FitLock(object):
+    """Exclusive lock (for the duration of a with block) on a lock
+    file next to a model"""
+    def __init__(self, path):
+        self.path = path + '.lock'
+        self._stream = None
+
+    def __enter__(self):
+        self._stream = open(self.path, 'a')
+        fcntl.flock(self._stream, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *_):
+        fcntl.flock(self._stream, fcntl.LOCK_UN)
+        self._stream.close()
+        self._stream = None
+
+
+class SharingParser(ParserWrapper):
+    """
+    Intra/inter parser wrapper fitting the models of all the modes in
+    its group at once
+
+    Parameters
+    ----------
+    parser : IntraInterParser (possibly wrapped)
+
+    sel_inter : string
+        Mode of this parser
+
+    group : dict(string, parser)
+        One parser (it doesn't matter which) for each mode used by
+        evaluations with the same learners as this one
+    """
+    def __init__(self, parser, sel_inter, group):
+        super(SharingParser, self).__init__(parser)
+        self.sel_inter = sel_inter
+        self.group = group
+
+    def fit(self, dpacks, targets, cache=None):
+        "fit the models of the whole group if needed, then load ours"
+        if cache is None or not dpacks:
+            self._inner.fit(dpacks, targets, cache=cache)
+            return self
+        if not _all_exist(cache):
+            with _FitLock(cache['intra:attach']):
+                for sel_inter, parser in sorted(self.group.items()):
+                    subcache = inter_cache(cache, self.sel_inter,
+                                           sel_inter)
+                    if not _all_exist(subcache):
+                        # intra models already on disk are just loaded
+                        parser.fit(dpacks, targets, cache=subcache)
+        self._inner.fit([], [], cache=cache)
+        return self
+
+
+def _learner_keys(learners):
+    "what the models of an intra/inter parser depend on (besides mode)"
+    return tuple(l.key for l in [learners.intra.attach,
+                                 learners.intra.label,
+                                 learners.inter.attach,
+                                 learners.inter.label])
+
+
+def shared_evaluations(evaluations):
+    """Copy of a list of evaluations, with the parsers of intra/inter
+    evaluations wrapped in `SharingParser` (others are left alone)"""
+    groups = defaultdict(dict)
+    for econf in evaluations:
+        if isinstance(econf.learner, IntraInterPair):
+            payload = econf.parser.payload
+            groups[_learner_keys(econf.learner)].setdefault(
+                payload._sel_inter, payload)
+    result = []
+    for econf in evaluations:
+        if isinstance(econf.learner, IntraInterPair):
+            payload = econf.parser.payload
+            wrapped = SharingParser(payload, payload._sel_inter,
+                                    groups[_learner_keys(econf.learner)])
+            econf = econf._replace(parser=econf.parser._replace(
+                payload=wrapped))
+        result.append(econf)
+    return result
@@ -0,0 +1,211 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Snapshots of evaluations, with deduplicated files
+
+A snapshot is a directory in `SNAPSHOTS` holding what we would want to
+keep of an evaluation (reports, configuration, fold file, versions of
+the gather environment, and the combined models of the evaluations we
+care about), plus a manifest of what is in there.
+
+The files themselves live in a content-addressed store
+(`SNAPSHOTS/objects/<sha1[:2]>/<sha1[2:]>`); each file of a snapshot
+is a hard link to its object, so a file which is the same in several
+snapshots (configs, fold files, models reused with `--jumpstart`...)
+is only stored once. Objects are made read-only, since any change to
+one would show up in every snapshot that has it.
+
+The digests of the files we have already seen are remembered (along
+with their size, modification time and inode) so that snapshotting
+the same evaluation again does not read its models again.
+"""
+
+from __future__ import print_function
+from os import path as fp
+import glob
+import hashlib
+import json
+import os
+import shutil
+import stat
+import time
+
+from .local import (SNAPSHOTS)
+
+OBJECTS_DIR = 'objects'
+"""Subdirectory of `SNAPSHOTS` for the content-addressed store"""
+
+MANIFEST = 'MANIFEST.json'
+"""Name of the manifest in each snapshot"""
+
+_DIGEST_CACHE = 'digests.json'
+
+
+def file_digest(path):
+    """SHA-1 of the contents of a file"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as stream:
+        for block in iter(lambda: stream.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_json(obj, path):
+    "write then rename"
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as stream:
+        json.dump(obj, stream, indent=2, sort_keys=True)
+    os.rename(tmp_path, path)
+
+
+class ObjectStore(object):
+    """
+    Content-addressed store of snapshot files
+
+    Parameters
+    ----------
+    root : string
+        Snapshot directory (the store is in its `OBJECTS_DIR`)
+    """
+    def __init__(self, root=SNAPSHOTS):
+        self.obj_dir = fp.join(root, OBJECTS_DIR)
+        if not fp.exists(self.obj_dir):
+            os.makedirs(self.obj_dir)
+        self._cache_path = fp.join(self.obj_dir, _DIGEST_CACHE)
+        self._digests = {}
+        if fp.exists(self._cache_path):
+            with open(self._cache_path) as stream:
+                self._digests = json.load(stream)
+
+    def object_path(self, digest):
+        "where the object with a given digest lives"
+        return fp.join(self.obj_dir, digest[:2], digest[2:])
+
+    def digest(self, path):
+        "digest of a file (not read again if it hasn't changed)"
+        info = os.stat(path)
+        key = fp.abspath(path)
+        sig = [info.st_size, info.st_mtime, info.st_ino]
+        known = self._digests.get(key)
+        if known is not None and known[:3] == sig:
+            return known[3]
+        digest = file_digest(path)
+        self._digests[key] = sig + [digest]
+        return digest
+
+    def add(self, path):
+        """Put a file in the store (if it isn't already there)
+
+        Returns
+        -------
+        digest : string
+
+        new : bool
+            True if it was not already in the store
+        """
+        digest = self.digest(path)
+        obj_path = self.object_path(digest)
+        if fp.exists(obj_path):
+            return digest, False
+        parent = fp.dirname(obj_path)
+        if not fp.exists(parent):
+            os.makedirs(parent)
+        # copy, not link: the original may be rewritten in place
+        tmp_path = obj_path + '.tmp'
+        shutil.copyfile(path, tmp_path)
+        os.chmod(tmp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.rename(tmp_path, obj_path)
+        return digest, True
+
+    def save(self):
+        "remember the digests we have computed"
+        _write_json(self._digests, self._cache_path)
+
+
+def snapshot_files(hconf, model_keys=None):
+    """What to snapshot of an evaluation
+
+    The harness must already be loaded
+
+    Parameters
+    ----------
+    model_keys : list of string, optional
+        Evaluations whose combined models we want
+
+    Returns
+    -------
+    files : list of (string, string)
+        Path in the snapshot, and current path of each file (those
+        which do not exist are left out)
+    """
+    eval_dir = hconf.eval_dir
+    files = []
+    for report_dir in sorted(glob.glob(fp.join(eval_dir, 'reports-*'))):
+        for parent, _, fnames in os.walk(report_dir):
+            for fname in sorted(fnames):
+                path = fp.join(parent, fname)
+                files.append((fp.relpath(path, eval_dir), path))
+    files.append((fp.basename(hconf.fold_file), hconf.fold_file))
+    for parent in [eval_dir, fp.dirname(fp.abspath(eval_dir))]:
+        path = fp.join(parent, 'versions-gather.txt')
+        if fp.exists(path):
+            files.append(('versions-gather.txt', path))
+            break
+    for path in hconf.config_files:
+        # the copy in the eval dir (if any) is the one that was used
+        used = fp.join(eval_dir, fp.basename(path))
+        files.append((fp.join('config', fp.basename(path)),
+                      used if fp.exists(used) else path))
+    econfs = dict((e.key, e) for e in hconf.evaluations)
+    for key in model_keys or []:
+        econf = econfs[key]
+        cache = hconf.model_paths(econf.learner, None, econf.parser)
+        for path in sorted(frozenset(cache.values())):
+            files.append((fp.join('models', fp.basename(path)), path))
+    return [(name, path) for name, path in files if fp.exists(path)]
+
+
+def make_snapshot(files, snap_dir, store, info=None):
+    """
+    Snapshot a list of files, as hard links to the store
+
+    Parameters
+    ----------
+    files : list of (string, string)
+        See `snapshot_files`
+
+    snap_dir : string
+        Snapshot directory (must not exist yet)
+
+    store : ObjectStore
+
+    info : dict, optional
+        Anything else to say in the manifest
+
+    Returns
+    -------
+    manifest : dict
+    """
+    os.makedirs(snap_dir)
+    manifest = dict(info or {})
+    manifest['created'] = time.time()
+    manifest['files'] = {}
+    new_bytes = 0
+    total_bytes = 0
+    for name, path in files:
+        digest, new = store.add(path)
+        size = fp.getsize(path)
+        total_bytes += size
+        if new:
+            new_bytes += size
+        target = fp.join(snap_dir, name)
+        if not fp.exists(fp.dirname(target)):
+            os.makedirs(fp.dirname(target))
+        os.link(store.object_path(digest), target)
+        manifest['files'][name] = digest
+    store.save()
+    manifest['bytes'] = total_bytes
+    manifest['new_bytes'] = new_bytes
+    _write_json(manifest, fp.join(snap_dir, MANIFEST))
+    return manifest
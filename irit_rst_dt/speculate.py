@@ -0,0 +1,361 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Speculative re-execution of straggling (evaluation, fold) units
+
+One slow node can hold up the whole evaluation (the report waits for
+every fold job). `irit-rst-dt speculate` watches the progress events
+(see `irit_rst_dt.progress`), and runs a duplicate of any unit that
+takes much longer than its peers.
+
+Both copies may then finish, so results are committed to the eval and
+scratch dirs atomically and idempotently: each file is written under a
+private name and hard linked into place only if it isn't there yet
+(`link_commit`). The first finisher wins; the other throws its copy
+away and carries on with the winner's (in particular, a parser that
+loses the race to commit a model loads the committed one).
+
+Predictions are another matter: attelo writes `fold-N/output.<key>`
+in place, so that file existing does not mean it is complete. A
+unit's predictions only count as committed once they have a marker
+(`fold-N/.output.<key>.committed`) with the size and digest of the
+complete file, and the file still matches it. The harness marks
+attelo's predictions once it is done with a fold; a duplicate run
+commits its own (complete) predictions over any unmarked file, and
+marks them.
+
+A straggler that gets to `fold-N/output.<key>` after a duplicate has
+committed it truncates the committed file and writes its own in place.
+So whatever reads predictions checks them against their marker
+(`output_state`): the results database skips files that no longer
+match, and the report (`evaluate --end`) refuses to run on them. When
+we cancel stragglers, we wait for them to stop before redoing
+whatever they left uncommitted.
+"""
+
+from __future__ import print_function
+from os import path as fp
+import errno
+import hashlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from attelo.io import (load_fold_dict, load_multipack)
+
+from .learning import (ParserWrapper)
+from .progress import (PROGRESS_DIR,
+                       fold_sizes,
+                       read_events,
+                       summarise_progress)
+from .testeval import (write_predictions)
+
+
+def private_path(path):
+    """Name under which to write a file before committing it"""
+    return '{}.{}.{}.tmp'.format(path, socket.gethostname(), os.getpid())
+
+
+def link_commit(tmp_path, path):
+    """Commit a privately written file to its final path, unless
+    someone else got there first
+
+    The temporary file is removed either way.
+
+    Returns
+    -------
+    won : bool
+        True if our file is now at `path`
+    """
+    try:
+        os.link(tmp_path, path)
+        won = True
+    except OSError as oops:
+        if oops.errno != errno.EEXIST:
+            raise
+        won = False
+    os.unlink(tmp_path)
+    return won
+
+
+class CommittingParser(ParserWrapper):
+    """
+    Parser wrapper saving models through `link_commit`, so that
+    duplicate runs of the same unit never see each other's half
+    written models
+
+    Parameters
+    ----------
+    parser : Parser
+    """
+    def fit(self, dpacks, targets, cache=None):
+        "fit the real parser, committing its models"
+        if cache is None or all(fp.exists(p) for p in cache.values()):
+            self._inner.fit(dpacks, targets, cache=cache)
+            return self
+        private = dict((k, private_path(p)) for k, p in cache.items())
+        # anything that has already been committed is reused as is
+        for key, path in cache.items():
+            if fp.exists(path):
+                private[key] = path
+        self._inner.fit(dpacks, targets, cache=private)
+        lost = False
+        for key, path in cache.items():
+            if private[key] != path and fp.exists(private[key]):
+                lost = not link_commit(private[key], path) or lost
+        if lost:
+            # somebody else committed first: use theirs
+            self._inner.fit([], [], cache=cache)
+        return self
+
+
+def committing_evaluations(evaluations):
+    """Copy of a list of evaluations, with all their parsers wrapped
+    in `CommittingParser`"""
+    return [e._replace(parser=e.parser._replace(
+        payload=CommittingParser(e.parser.payload)))
+            for e in evaluations]
+
+
+def output_path(hconf, econf, fold):
+    """Predictions of an evaluation on a fold"""
+    return fp.join(hconf.fold_dir_path(fold), 'output.' + econf.key)
+
+
+def _marker_path(path):
+    "commit marker of a predictions file"
+    parent, fname = fp.split(path)
+    return fp.join(parent, '.{}.committed'.format(fname))
+
+
+def _output_digest(path):
+    "size and digest of a predictions file"
+    with open(path, 'rb') as stream:
+        data = stream.read()
+    return {'size': len(data), 'md5': hashlib.md5(data).hexdigest()}
+
+
+def mark_committed(path, digest=None):
+    """Record that a predictions file is complete
+
+    Parameters
+    ----------
+    digest : dict, optional
+        What the complete file is (see `_output_digest`); by default,
+        whatever is there now
+    """
+    marker = _marker_path(path)
+    tmp_path = private_path(marker)
+    with open(tmp_path, 'w') as stream:
+        json.dump(digest or _output_digest(path), stream)
+    os.rename(tmp_path, marker)
+
+
+def output_state(path):
+    """Where a predictions file stands
+
+    Returns
+    -------
+    state : string
+        'missing', 'unmarked' (no commit marker: attelo may still be
+        writing it, or it predates markers), 'committed' (it is what
+        its marker says) or 'changed' (it is not, eg. a straggler is
+        rewriting it)
+    """
+    marker = _marker_path(path)
+    if not fp.exists(path):
+        return 'missing'
+    if not fp.exists(marker):
+        return 'unmarked'
+    with open(marker) as stream:
+        digest = json.load(stream)
+    if digest['size'] == fp.getsize(path) and\
+            digest == _output_digest(path):
+        return 'committed'
+    return 'changed'
+
+
+def is_committed(path):
+    """True if a predictions file is complete: it has a commit
+    marker, and it is still what the marker says"""
+    return output_state(path) == 'committed'
+
+
+def check_outputs(hconf, folds):
+    """Exit if the predictions of any of these folds no longer match
+    their commit markers (so that nothing reads them)"""
+    changed = [output_path(hconf, e, f) for f in sorted(folds)
+               for e in hconf.evaluations
+               if output_state(output_path(hconf, e, f)) == 'changed']
+    if changed:
+        sys.exit("Sorry, these predictions have changed since they were "
+                 "committed (a straggler rewriting them?):\n{}\n"
+                 "Please wait for the jobs still writing them to "
+                 "finish, then try again".format("\n".join(changed)))
+
+
+def commit_output(tmp_path, path):
+    """Commit privately written predictions to their final path,
+    unless committed ones are already there
+
+    Unlike `link_commit`, this replaces whatever uncommitted file is
+    at `path` (eg. one attelo is still writing in place). The
+    temporary file is gone either way.
+
+    Returns
+    -------
+    won : bool
+        True if our predictions were committed
+    """
+    if is_committed(path):
+        os.unlink(tmp_path)
+        return False
+    digest = _output_digest(tmp_path)
+    os.rename(tmp_path, path)
+    mark_committed(path, digest)
+    return True
+
+
+def mark_outputs(hconf, folds):
+    """Mark the predictions attelo has written for these folds as
+    committed
+
+    Only call this once attelo is done with these folds (it writes
+    the predictions in place)
+    """
+    for fold in folds:
+        for econf in hconf.evaluations:
+            path = output_path(hconf, econf, fold)
+            if fp.exists(path) and not is_committed(path):
+                mark_committed(path)
+
+
+def run_unit(hconf, mpack, fold_dict, econf, fold):
+    """Fit and decode one (evaluation, fold) unit, committing the
+    predictions
+
+    Returns
+    -------
+    won : bool
+        True if our predictions were committed (False if the unit
+        was done by somebody else in the meantime)
+    """
+    path = output_path(hconf, econf, fold)
+    if is_committed(path):
+        return False
+    fold_dir = hconf.fold_dir_path(fold)
+    if not fp.exists(fold_dir):
+        os.makedirs(fold_dir)
+    train = [mpack[d] for d in sorted(mpack) if fold_dict[d] != fold]
+    parser = econf.parser.payload
+    parser.fit(train, [d.target for d in train],
+               cache=hconf.model_paths(econf.learner, fold, econf.parser))
+    tmp_path = private_path(path)
+    with open(tmp_path, 'w') as stream:
+        for doc in sorted(mpack):
+            if fold_dict[doc] == fold:
+                write_predictions(parser.transform(mpack[doc]), stream)
+    return commit_output(tmp_path, path)
+
+
+def _parse_fold(fold):
+    "fold number from a progress event fold label"
+    return int(fold.split('-', 1)[1])
+
+
+def _uncommitted(hconf, fold_dict):
+    "(evaluation, fold) units without committed predictions"
+    return [(e, f) for e in hconf.evaluations
+            for f in sorted(frozenset(fold_dict.values()))
+            if not is_committed(output_path(hconf, e, f))]
+
+
+def _redundant_jobs(events):
+    """Cluster jobs which only ever worked on fold units (once every
+    unit is committed, anything they are still doing is redundant)"""
+    jobs = set()
+    keep = set()
+    for event in events:
+        job = event.get('job')
+        if job is None:
+            continue
+        if event.get('fold', '').startswith('fold-'):
+            jobs.add(job)
+        else:  # eg. the combined models
+            keep.add(job)
+    keep.add(os.environ.get('SLURM_JOB_ID'))
+    return sorted(jobs - keep)
+
+
+def _job_running(job):
+    "True if a cluster job is still in the queue"
+    with open(os.devnull, 'w') as devnull:
+        proc = subprocess.Popen(['squeue', '-h', '-o', '%i', '-j', job],
+                                stdout=subprocess.PIPE, stderr=devnull)
+        out = proc.communicate()[0].decode('utf-8')
+    return proc.returncode == 0 and job in out.split()
+
+
+def _wait_for_jobs(jobs, poll=5):
+    "wait until cancelled jobs are gone (scancel only signals them)"
+    while jobs:
+        jobs = [j for j in jobs if _job_running(j)]
+        if jobs:
+            time.sleep(poll)
+
+
+def speculate(hconf, poll=None, cancel=False):
+    """Run duplicates of straggling units (once, or every `poll`
+    seconds until every unit is committed)
+
+    With `cancel`, once every unit is committed, cancel the cluster
+    jobs still working on fold units (so that the report can go
+    ahead)
+
+    The harness must already be loaded
+    """
+    progress_dir = fp.join(hconf.eval_dir, PROGRESS_DIR)
+    fold_dict = load_fold_dict(hconf.fold_file)
+    sizes = fold_sizes(fold_dict)
+    econfs = dict((e.key, e) for e in hconf.evaluations)
+    mpack = None
+    while True:
+        events = read_events(progress_dir)
+        summary = summarise_progress(events, sorted(econfs), sizes)
+        todo = [s for s in summary['stragglers']
+                if not is_committed(output_path(hconf, econfs[s['key']],
+                                                _parse_fold(s['fold'])))]
+        for strag in todo:
+            if mpack is None:
+                mpack = load_multipack(*hconf.mpack_paths(False)[:4],
+                                       verbose=True)
+            print('speculating on {key} {fold} (running for '
+                  '{seconds:.0f}s on {where})'.format(**strag),
+                  file=sys.stderr)
+            won = run_unit(hconf, mpack, fold_dict, econfs[strag['key']],
+                           _parse_fold(strag['fold']))
+            print('... {}'.format('committed' if won else
+                                  'beaten to it'), file=sys.stderr)
+        finished = not _uncommitted(hconf, fold_dict)
+        if finished and cancel:
+            jobs = _redundant_jobs(read_events(progress_dir))
+            for job in jobs:
+                print('cancelling job', job, file=sys.stderr)
+                subprocess.call(['scancel', job])
+            _wait_for_jobs(jobs)
+            # a cancelled job may have been in the middle of rewriting
+            # some committed predictions: nobody else will redo them
+            for econf, fold in _uncommitted(hconf, fold_dict):
+                if mpack is None:
+                    mpack = load_multipack(*hconf.mpack_paths(False)[:4],
+                                           verbose=True)
+                print('redoing {} fold-{}'.format(econf.key, fold),
+                      file=sys.stderr)
+                run_unit(hconf, mpack, fold_dict, econf, fold)
+        if poll is None or finished:
+            return
+        time.sleep(poll)
@@ -0,0 +1,330 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Compressed, block-structured storage for harness artefacts
+
+Our big artefacts (features, pairings, EDU inputs, predictions) are
+line-oriented text files. We store them as a sequence of independently
+compressed blocks of lines, followed by an index of block offsets, so
+that a reader can decompress them one block at a time (or jump straight
+to a given block) instead of inflating the whole file.
+
+Layout ::
+
+    MAGIC codec_len codec
+    (block_len nlines compressed_bytes)*
+    (offset nlines)*          <- index
+    index_offset nblocks MAGIC
+
+The codec is zstd or lz4 if the corresponding package is installed,
+zlib otherwise. The blocks hold the text as is, so a file that does
+not end with a newline comes back without one.
+
+Tools that need a text file (attelo reads its inputs by path) get a
+text export in a per-process cache directory, which is removed when
+the process exits (see `readable_path`).
+"""
+
+from __future__ import print_function
+from os import path as fp
+import atexit
+import hashlib
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+
+MAGIC = b'IRDTBLK1'
+
+PACKED_EXT = '.blk'
+"""Extension for packed versions of a file"""
+
+BLOCK_LINES = 4096
+"""Default number of lines per block"""
+
+_BLOCK_HEADER = struct.Struct('>II')  # compressed length, lines
+_INDEX_ENTRY = struct.Struct('>QI')  # offset, lines
+_FOOTER = struct.Struct('>QI')  # index offset, blocks
+
+
+class StorageException(Exception):
+    "Something went wrong reading a packed file"
+
+
+def _zstd_codec():
+    "zstandard compression (optional dependency)"
+    import zstandard
+    return (zstandard.ZstdCompressor(level=3).compress,
+            zstandard.ZstdDecompressor().decompress)
+
+
+def _lz4_codec():
+    "lz4 compression (optional dependency)"
+    import lz4.frame
+    return (lz4.frame.compress, lz4.frame.decompress)
+
+
+def _zlib_codec():
+    "zlib compression (always available)"
+    return (lambda x: zlib.compress(x, 6), zlib.decompress)
+
+
+_CODECS = [('zstd', _zstd_codec),
+           ('lz4', _lz4_codec),
+           ('zlib', _zlib_codec)]
+
+
+def get_codec(name):
+    """(compress, decompress) functions for a codec"""
+    for cname, loader in _CODECS:
+        if cname == name:
+            return loader()
+    raise StorageException('Unknown codec: ' + name)
+
+
+def default_codec():
+    """Name of the best codec we have available"""
+    for cname, loader in _CODECS:
+        try:
+            loader()
+            return cname
+        except ImportError:
+            continue
+    return 'zlib'
+
+
+class BlockWriter(object):
+    """
+    File-like object that writes text to a packed file, one block of
+    lines at a time. Use as a context manager (or call `close`)
+    """
+    def __init__(self, path, codec=None, block_lines=BLOCK_LINES):
+        self.codec = codec or default_codec()
+        self._compress = get_codec(self.codec)[0]
+        self._block_lines = block_lines
+        self._pending = []
+        self._partial = ''
+        self._index = []
+        self._stream = open(path, 'wb')
+        name = self.codec.encode('ascii')
+        self._stream.write(MAGIC + struct.pack('>B', len(name)) + name)
+
+    def write(self, text):
+        "write some text (need not be whole lines)"
+        lines = (self._partial + text).split('\n')
+        self._partial = lines.pop()
+        self._pending.extend(lines)
+        while len(self._pending) >= self._block_lines:
+            self._flush_block(self._pending[:self._block_lines])
+            self._pending = self._pending[self._block_lines:]
+
+    def _flush_block(self, lines, partial=''):
+        """compress and write a block of lines (and the final line of
+        the file, if it has no newline)"""
+        nlines = len(lines) + (1 if partial else 0)
+        if not nlines:
+            return
+        data = self._compress(
+            (''.join(l + '\n' for l in lines) + partial).encode('utf-8'))
+        self._index.append((self._stream.tell(), nlines))
+        self._stream.write(_BLOCK_HEADER.pack(len(data), nlines))
+        self._stream.write(data)
+
+    def close(self):
+        "write any pending lines and the index"
+        if self._stream is None:
+            return
+        self._flush_block(self._pending, self._partial)
+        self._pending = []
+        self._partial = ''
+        index_offset = self._stream.tell()
+        for offset, nlines in self._index:
+            self._stream.write(_INDEX_ENTRY.pack(offset, nlines))
+        self._stream.write(_FOOTER.pack(index_offset, len(self._index)))
+        self._stream.write(MAGIC)
+        self._stream.close()
+        self._stream = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+class BlockReader(object):
+    """
+    Read a packed file block by block. Use as a context manager
+    (or call `close`)
+    """
+    def __init__(self, path):
+        self._stream = open(path, 'rb')
+        if self._stream.read(len(MAGIC)) != MAGIC:
+            raise StorageException('Not a packed file: ' + path)
+        name_len = struct.unpack('>B', self._stream.read(1))[0]
+        self.codec = self._stream.read(name_len).decode('ascii')
+        self._decompress = get_codec(self.codec)[1]
+        tail_len = _FOOTER.size + len(MAGIC)
+        self._stream.seek(-tail_len, os.SEEK_END)
+        tail = self._stream.read(tail_len)
+        if tail[_FOOTER.size:] != MAGIC:
+            raise StorageException('Truncated packed file: ' + path)
+        index_offset, nblocks = _FOOTER.unpack(tail[:_FOOTER.size])
+        self._stream.seek(index_offset)
+        raw = self._stream.read(nblocks * _INDEX_ENTRY.size)
+        self.index = [_INDEX_ENTRY.unpack_from(raw, i * _INDEX_ENTRY.size)
+                      for i in range(nblocks)]
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def nlines(self):
+        "total number of lines in the file"
+        return sum(n for _, n in self.index)
+
+    def raw_block(self, idx):
+        """Text of the given block, as stored (bytes)"""
+        offset = self.index[idx][0]
+        self._stream.seek(offset)
+        header = self._stream.read(_BLOCK_HEADER.size)
+        size, _ = _BLOCK_HEADER.unpack(header)
+        return self._decompress(self._stream.read(size))
+
+    def block(self, idx):
+        """Lines (without newlines) of the given block"""
+        lines = self.raw_block(idx).decode('utf-8').split('\n')
+        if lines[-1] == '':
+            lines.pop()  # the block ends with a newline
+        return lines
+
+    def blocks(self):
+        """Iterate over the blocks of the file, as lists of lines"""
+        for idx in range(len(self.index)):
+            yield self.block(idx)
+
+    def lines(self):
+        """Iterate over all lines of the file"""
+        for block in self.blocks():
+            for line in block:
+                yield line
+
+    def close(self):
+        "close the underlying file"
+        self._stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def is_packed(path):
+    """True if the file looks like one of our packed files"""
+    with open(path, 'rb') as stream:
+        return stream.read(len(MAGIC)) == MAGIC
+
+
+def pack_file(path, packed_path=None, codec=None, block_lines=BLOCK_LINES):
+    """Write a packed copy of a text file
+
+    Returns
+    -------
+    packed_path : string
+        Defaults to `path` + `PACKED_EXT`
+    """
+    packed_path = packed_path or path + PACKED_EXT
+    with open(path, 'rb') as istream,\
+            BlockWriter(packed_path, codec=codec,
+                        block_lines=block_lines) as ostream:
+        for line in istream:
+            ostream.write(line.decode('utf-8'))
+    return packed_path
+
+
+def unpack_file(packed_path, path=None):
+    """Write the text export of a packed file (atomically)
+
+    Returns
+    -------
+    path : string
+        Defaults to `packed_path` minus `PACKED_EXT`
+    """
+    if path is None:
+        if not packed_path.endswith(PACKED_EXT):
+            raise StorageException('Please specify an output path for ' +
+                                   packed_path)
+        path = packed_path[:-len(PACKED_EXT)]
+    tmp_path = path + '.tmp-{}'.format(os.getpid())
+    with BlockReader(packed_path) as reader,\
+            open(tmp_path, 'wb') as ostream:
+        for idx in range(len(reader)):
+            ostream.write(reader.raw_block(idx))
+    os.rename(tmp_path, path)
+    return path
+
+
+_EXPORT_DIRS = {}
+"""Cache directories `readable_path` created (and the process that
+created each one)"""
+
+
+def _remove_export_dirs():
+    "remove the cache directories this process created"
+    for cache_dir, pid in _EXPORT_DIRS.items():
+        if pid == os.getpid():
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+atexit.register(_remove_export_dirs)
+
+
+def local_cache_dir(key, parent=None):
+    """Directory (on a local disk if `parent` is None) for the text
+    exports of packed files belonging to `key` (eg. an eval dir)
+
+    Each process has its own, so that one job removing its exports
+    when it is done does not pull them from under another
+    """
+    digest = hashlib.md5(fp.abspath(key).encode('utf-8')).hexdigest()
+    return fp.join(parent or tempfile.gettempdir(),
+                   'irit-rst-dt-{}-{}'.format(digest[:10], os.getpid()))
+
+
+def readable_path(path, cache_dir):
+    """Path to a text version of a file that may only exist in packed
+    form
+
+    If `path` exists, it is returned as is. Otherwise, if there is a
+    packed version of it, we export it to `cache_dir` (unless an
+    up-to-date export is already there) and return the exported path;
+    the directory is removed when this process exits. If neither
+    exist, we return `path` unchanged.
+    """
+    packed_path = path + PACKED_EXT
+    if fp.exists(path) or not fp.exists(packed_path):
+        return path
+    text_path = fp.join(cache_dir, fp.basename(path))
+    if not fp.exists(text_path) or\
+            fp.getmtime(text_path) < fp.getmtime(packed_path):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            if not fp.isdir(cache_dir):
+                raise
+        _EXPORT_DIRS.setdefault(cache_dir, os.getpid())
+        unpack_file(packed_path, text_path)
+    return text_path
+
+
+def open_output(path, packed=False):
+    """Open a text file for writing, packed or not
+
+    If packed, `PACKED_EXT` is added to the path
+    """
+    if packed:
+        return BlockWriter(path + PACKED_EXT)
+    return open(path, 'w')
@@ -0,0 +1,112 @@
+# Author: Eric Kow
+# License: CeCILL-B (French BSD3-like)
+
+"""
+Test-corpus evaluation without the cross-validation loop
+
+We only deal with the test evaluation (`TEST_EVALUATION_KEY`): fit it
+on the full training data (unless the combined models are already
+there, in which case we just reuse them), then decode the test
+multipack one document at a time, writing predictions as we go.
+"""
+
+from __future__ import print_function
+from os import path as fp
+import json
+import os
+import sys
+import time
+
+from attelo.io import (load_multipack)
+
+from .local import (COMPRESS_ARTEFACTS)
+from .score import (add_counts, count_metrics, prf)
+from .storage import (open_output)
+
+
+def _have_models(cache):
+    "true if every model in a cache dictionary has been saved"
+    return all(fp.exists(p) for p in cache.values())
+
+
+def write_predictions(dpack, stream):
+    """Append the predictions of a decoded datapack to an (open)
+    attelo output file"""
+    for (edu1, edu2), num in zip(dpack.pairings, dpack.graph.prediction):
+        print('\t'.join([edu1.id, edu2.id, dpack.get_label(num)]),
+              file=stream)
+
+
+def evaluate_test_only(hconf):
+    """Train (or reuse) the test evaluation model on the full training
+    data and score it on the test corpus
+
+    The harness must already be loaded
+    """
+    econf = hconf.test_evaluation
+    out_dir = fp.join(hconf.eval_dir, 'test-only')
+    if not fp.exists(out_dir):
+        os.makedirs(out_dir)
+    if not fp.exists(hconf.combined_dir_path()):
+        os.makedirs(hconf.combined_dir_path())
+
+    parser = econf.parser.payload
+    cache = hconf.model_paths(econf.learner, None, econf.parser)
+    start = time.time()
+    if _have_models(cache):
+        print('reusing combined models for', econf.key, file=sys.stderr)
+        parser.fit([], [], cache=cache)
+    else:
+        print('training', econf.key, 'on', hconf.dataset,
+              file=sys.stderr)
+        train_pack = load_multipack(*hconf.mpack_paths(False)[:4],
+                                    verbose=True)
+        dpacks = list(train_pack.values())
+        parser.fit(dpacks, [d.target for d in dpacks], cache=cache)
+        del train_pack, dpacks
+    train_time = time.time() - start
+
+    test_pack = load_multipack(*hconf.mpack_paths(True)[:4],
+                               verbose=True)
+    counts = {}
+    gold = hconf.gold_cache(True)
+    out_path = fp.join(out_dir, 'output.' + econf.key)
+    start = time.time()
+    with open_output(out_path, packed=COMPRESS_ARTEFACTS) as stream:
+        for i, doc in enumerate(sorted(test_pack), 1):
+            dpack = parser.transform(test_pack[doc])
+            write_predictions(dpack, stream)
+            counts = add_counts(counts, count_metrics(dpack,
+                                                        gold_cache=gold))
+            if i % 10 == 0:
+                elapsed = time.time() - start
+                print('decoded {} docs ({:.2f} docs/sec)'.format(
+                    i, i / elapsed if elapsed else 0.), file=sys.stderr)
+    decode_time = time.time() - start
+
+    ndocs = len(test_pack)
+    results = {
+        'key': econf.key,
+        'testset': hconf.testset,
+        'docs': ndocs,
+        'train_seconds': train_time,
+        'decode_seconds': decode_time,
+        'docs_per_second': ndocs / decode_time if decode_time else 0.,
+    }
+    for metric, count in counts.items():
+        results[metric] = prf(*count)
+    with open(fp.join(out_dir, 'scores.json'), 'w') as stream:
+        json.dump(results, stream, indent=2, sort_keys=True)
+    lines = [
+        '{} on {} ({} docs)'.format(econf.key, hconf.testset, ndocs),
+        'training: {:.1f}s, decoding: {:.1f}s ({:.2f} docs/sec)'.format(
+            train_time, decode_time, results['docs_per_second']),
+        '',
+        '{:<16} {:>6} {:>6} {:>6}'.format('', 'P', 'R', 'F1'),
+    ]
+    for metric in sorted(counts):
+        lines.append('{:<16} {:.4f} {:.4f} {:.4f}'.format(
+            metric, *results[metric]))
+    with open(fp.join(out_dir, 'report.txt'), 'w') as stream:
+        print('\n'.join(lines), file=stream)
+    print('\n'.join(lines))